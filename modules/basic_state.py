@@ -0,0 +1,113 @@
+import numpy as np
+
+import save_and_load_hdf5_files as h5saveload
+
+
+def phi_T(y, y0=0, H0=100, N=2, grav=9.80616):
+    ## y takes latitude in radians
+    y0  = np.deg2rad(y0)
+    phi = grav*H0*(1-(np.sin(y)-np.sin(y0))**N)
+    return phi
+
+
+def phi_T_asymmetric(x, y, y0=0, H0=100, N=2, \
+                     xN = 145,   yN = 45, \
+                     delta_xN = 35, delta_yN = 12, \
+                     xS = 145,   yS = 15, \
+                     delta_xS = 35, delta_yS = 15, \
+                     AN=0.45, AS=-0.25, grav=9.80616):
+    ## x, y take longitude and latitude in radians
+
+    xN, xS, yN, yS, delta_xN, delta_xS, delta_yN, delta_yS = \
+    map(lambda z: np.deg2rad(z), [xN, xS, yN, yS, delta_xN, delta_xS, delta_yN, delta_yS])
+
+    phi1 = phi_T(y, y0, H0, N, grav)
+    phi2 = grav*H0*(AN * np.exp(-((x-xN)/(delta_xN))**2 - ((y-yN)/(delta_yN))**2))
+    phi3 = grav*H0*(AS * np.exp(-((x-xS)/(delta_xS))**2 - ((y-yS)/(delta_yS))**2))
+    return phi1 + phi2 + phi3
+
+
+class phi_T_provider(object):
+    """
+    The imposed basic state phi_T = H0(t) * pattern. Everything that only
+    depends on the pattern (the grid, its spectrum and its spectral
+    Laplacian) is made once, so a time step only scales by H0:
+
+        phi_T = symmetric(sp_harmonic, y0=0, N=2)
+        phi_T.spec(H0)          #### H0 * grdtospec(pattern)
+        phi_T.lap_spec(H0)      #### H0 * lap * grdtospec(pattern)
+        phi_T.grid(H0)
+
+    unit, unit_spec, lap_unit_spec and lap_unit_grid are the H0 = 1 fields.
+    """
+    def __init__(self, sp_harmonic, unit):
+        self.sp_harmonic   = sp_harmonic
+        self.unit          = unit
+        self.unit_spec     = sp_harmonic.grdtospec(unit)
+        self.lap_unit_spec = sp_harmonic.lap*self.unit_spec
+        self.lap_unit_grid = sp_harmonic.spectogrd(self.lap_unit_spec)
+
+    def grid(self, H0):
+        return H0*self.unit
+
+    def spec(self, H0):
+        return H0*self.unit_spec
+
+    def lap_spec(self, H0):
+        return H0*self.lap_unit_spec
+
+
+def grid_lons_lats(sp_harmonic):
+    return np.meshgrid(sp_harmonic.lons, sp_harmonic.lats)
+
+
+def symmetric(sp_harmonic, y0=0, N=2, grav=9.80616):
+    """grav*(1-(sin(lat)-sin(y0))**N) per metre of H0"""
+    lons, lats = grid_lons_lats(sp_harmonic)
+    return phi_T_provider(sp_harmonic, phi_T(lats, y0, 1., N, grav))
+
+
+def asymmetric(sp_harmonic, y0=0, N=2, grav=9.80616, **kwargs):
+    """phi_T_asymmetric per metre of H0; kwargs are xN, yN, delta_xN, ..., AN, AS"""
+    lons, lats = grid_lons_lats(sp_harmonic)
+    return phi_T_provider(sp_harmonic, phi_T_asymmetric(lons, lats, y0, 1., N, grav=grav, **kwargs))
+
+
+def empirical(sp_harmonic, filename, key='geopot_Z_mean', grav=9.80616):
+    """
+    phi_T_empirical: the reanalysis field in filename (lon, lat in degrees)
+    interpolated with a bicubic spline onto the model grid, read and
+    interpolated once.
+    """
+    from scipy.interpolate import RectBivariateSpline
+
+    phi_T_data = h5saveload.load_dict_from_hdf5(filename)
+    lon, lat   = np.asarray(phi_T_data['lon']), np.asarray(phi_T_data['lat'])
+    data       = np.asarray(phi_T_data[key])
+    order      = np.argsort(lat)                  #### the spline wants increasing latitudes
+    spline     = RectBivariateSpline(lat[order], lon, data[order, :], kx=3, ky=3)
+
+    model_lats = np.rad2deg(sp_harmonic.lats)
+    model_lons = np.rad2deg(sp_harmonic.lons)
+    lat_order  = np.argsort(model_lats)
+    unit       = np.empty((model_lats.size, model_lons.size))
+    unit[lat_order, :] = spline(model_lats[lat_order], model_lons)
+    return phi_T_provider(sp_harmonic, unit*grav)
+
+
+def from_input_file(sp_harmonic, input_file):
+    """
+    the basic state named by input_file['phi_T_type'] ('symmetric' (default),
+    'asymmetric' or 'empirical' with input_file['phi_T_file'])
+    """
+    phi_T_type = input_file.get('phi_T_type', 'symmetric')
+    grav       = input_file['grav']
+    if phi_T_type == 'symmetric':
+        return symmetric(sp_harmonic, input_file.get('y0', 0), input_file.get('N', 2), grav)
+    if phi_T_type == 'asymmetric':
+        keys = ['xN', 'yN', 'delta_xN', 'delta_yN', 'xS', 'yS', 'delta_xS', 'delta_yS', 'AN', 'AS']
+        return asymmetric(sp_harmonic, input_file.get('y0', 0), input_file.get('N', 2), grav, \
+                          **{key: input_file[key] for key in keys if key in input_file})
+    if phi_T_type == 'empirical':
+        return empirical(sp_harmonic, input_file['phi_T_file'], grav=grav)
+    raise ValueError('Unknown phi_T_type %s'%(phi_T_type))
@@ -0,0 +1,147 @@
+import numpy as np
+
+
+class runaway_error(ValueError):
+    """raised by cfl_controller before a run blows up; diagnostics has what it measured"""
+
+    def __init__(self, message, diagnostics):
+        ValueError.__init__(self, message)
+        self.diagnostics = diagnostics
+
+
+class cfl_controller(object):
+    """
+    Adaptive time step of SWE_stepper from the Courant number of the
+    fastest signal, advection plus gravity waves, on the grids of every
+    tendency call:
+
+        courant = dt*(max|u| + sqrt(max phi))*sqrt(L(L+1))/rsphere
+
+    with L the truncation (sqrt(phi - phi_ref) for the gravity waves of a
+    semi-implicit run, which only sees the part above the reference depth).
+    AB3 becomes unstable for oscillations near 0.72.
+
+    dt stays the input_file dt times a power of two. It is halved as often
+    as needed when the Courant number is above shrink_at, and doubled once
+    it has been below grow_at for grow_after checks, within min_dt and
+    max_dt. dt only grows at a time that is a multiple of the new dt, and
+    only to values that divide sync_interval, so the save times (every
+    sync_interval) are hit exactly. Every change restarts AB3
+    (stepper.set_dt).
+
+    If even min_dt would leave the Courant number above abort_at, or the
+    grids are no longer finite, or max|u| is above max_speed, update()
+    raises runaway_error with the diagnostics of the step (time, dt,
+    Courant number, max|u| and where, phi range, H0, recent Courant
+    numbers), instead of the run going on to NaNs:
+
+        stepper.dt_control = cfl_controller(stepper, logging_object=logging_object)
+        try:
+            for ...:
+                stepper.step()
+        except cfl_control.runaway_error as error:
+            logging_object.write('ABORTING: %s'%(error))
+
+    The controller counts as run state (saved_state/restore are called by
+    the stepper's checkpoints), so attach it before load_checkpoint.
+    """
+    def __init__(self, stepper, shrink_at=0.5, grow_at=0.2, grow_after=100, abort_at=0.7, min_dt=None, max_dt=None,
+                 sync_interval=3*3600., check_every=1, max_speed=None, logging_object=None):
+        base_dt = stepper.base_dt
+        if sync_interval % base_dt != 0:
+            raise ValueError('dt = %s does not divide the sync interval %s'%(base_dt, sync_interval))
+        if not grow_at*2 < shrink_at < abort_at:
+            raise ValueError('need 2*grow_at < shrink_at < abort_at, got %s, %s, %s'%(grow_at, shrink_at, abort_at))
+
+        self.shrink_at      = shrink_at
+        self.grow_at        = grow_at
+        self.grow_after     = grow_after
+        self.abort_at       = abort_at
+        self.min_dt         = min_dt if min_dt is not None else base_dt/8.
+        self.max_dt         = max_dt if max_dt is not None else base_dt*4.
+        self.sync_interval  = sync_interval
+        self.check_every    = check_every
+        self.max_speed      = max_speed
+        self.logging_object = logging_object
+
+        #### largest total wavenumber over the radius
+        self.k_max          = np.sqrt(np.abs(stepper.sp_harmonic.lap).max())
+        self.checks         = 0
+        self.quiet_checks   = 0
+        self.recent         = []      #### (day, dt, courant) of the last checks
+        self.changes        = []      #### (day, old dt, new dt, courant) of every change of dt
+
+    def diagnostics(self, stepper):
+        """Courant number and what it is made of, for the grids of the last tendency call"""
+        sp = stepper.sp_harmonic
+        speed2, tmp, _ = stepper.work_grid
+        np.multiply(stepper.ug, stepper.ug, out=speed2)
+        np.multiply(stepper.vg, stepper.vg, out=tmp)
+        speed2 += tmp
+
+        fastest   = np.unravel_index(np.argmax(speed2), speed2.shape)
+        max_speed = np.sqrt(speed2[fastest])
+        phi_max   = stepper.phig.max()
+        phi_min   = stepper.phig.min()
+        phi_waves = phi_max - np.max(stepper.phi_ref) if stepper.semi_implicit else phi_max
+        gravity   = np.sqrt(max(phi_waves, 0.))
+        return {'day': stepper.t/(24*3600), 'ncycle': stepper.ncycle, 'dt': stepper.dt, \
+                'courant': stepper.dt*(max_speed + gravity)*self.k_max, \
+                'max_speed': max_speed, 'gravity_speed': gravity, 'phi_max': phi_max, 'phi_min': phi_min, \
+                'lat_lon_of_max_speed': (np.degrees(sp.lats[fastest[-2]]), np.degrees(sp.lons[fastest[-1]])), \
+                'H0': np.max(stepper.H0), 'recent': list(self.recent)}
+
+    def abort(self, reason, diagnostics):
+        message = '%s at day %1.2f (dt = %s s, Courant number %1.3g, max|u| = %1.1f m/s at lat/lon %1.1f/%1.1f, ' \
+                  'phi in [%1.4g, %1.4g], H0 = %s)'%(reason, diagnostics['day'], diagnostics['dt'], \
+                  diagnostics['courant'], diagnostics['max_speed'], diagnostics['lat_lon_of_max_speed'][0], \
+                  diagnostics['lat_lon_of_max_speed'][1], diagnostics['phi_min'], diagnostics['phi_max'], \
+                  diagnostics['H0'])
+        raise runaway_error(message, diagnostics)
+
+    def change_dt(self, stepper, dt, courant):
+        self.changes.append((stepper.t/(24*3600), stepper.dt, dt, courant))
+        if self.logging_object is not None:
+            self.logging_object.write('dt %s -> %s s at day %1.2f (Courant number %1.3f)'%( \
+                                      stepper.dt, dt, stepper.t/(24*3600), courant))
+        stepper.set_dt(dt)
+        self.quiet_checks = 0
+
+    def update(self, stepper):
+        """called by SWE_stepper.step() after every step"""
+        self.checks += 1
+        if self.checks % self.check_every:
+            return
+
+        diagnostics = self.diagnostics(stepper)
+        courant     = diagnostics['courant']
+        self.recent = (self.recent + [(diagnostics['day'], stepper.dt, courant)])[-10:]
+
+        if not (np.isfinite(courant) and np.isfinite(diagnostics['phi_min'])):
+            self.abort('non-finite fields', diagnostics)
+        if self.max_speed is not None and diagnostics['max_speed'] > self.max_speed:
+            self.abort('max|u| above %s m/s'%(self.max_speed), diagnostics)
+
+        if courant > self.shrink_at:
+            dt = stepper.dt
+            while courant*dt/stepper.dt > self.shrink_at and dt/2 >= self.min_dt:
+                dt = dt/2
+            if courant*dt/stepper.dt > self.abort_at:
+                self.abort('Courant number above %s even with dt = %s s'%(self.abort_at, dt), diagnostics)
+            if dt != stepper.dt:
+                self.change_dt(stepper, dt, courant)
+        elif courant < self.grow_at:
+            self.quiet_checks += 1
+            dt = 2*stepper.dt
+            if self.quiet_checks >= self.grow_after and dt <= self.max_dt and \
+               self.sync_interval % dt == 0 and stepper.t % dt == 0:
+                self.change_dt(stepper, dt, courant)
+        else:
+            self.quiet_checks = 0
+
+    def saved_state(self):
+        return {'checks': self.checks, 'quiet_checks': self.quiet_checks}
+
+    def restore(self, saved):
+        self.checks       = int(saved['checks'])
+        self.quiet_checks = int(saved['quiet_checks'])
@@ -0,0 +1,158 @@
+import numpy as np
+
+import linear_steady as linear_steady
+
+
+class comoving_steady_solver(object):
+    """
+    Nonlinear steady state of the forced model in the frame moving with
+    a forcing of constant phase speed, by Jacobian-free Newton-Krylov.
+
+    A solution that moves with the forcing has x(t) = x rotated by
+    exp(-i m angular_speed t), so it is a zero of
+
+        R(x) = tendencies(x, forcing at t) + i m angular_speed x
+
+    with tendencies those of SWE_stepper.tendencies() itself (same
+    forcing callables, phi_T, damping; the hyperdiffusion of step() as
+    its damping rate). Newton steps are solved with LGMRES, using only
+    evaluations of R; the per-m linear_steady blocks about the zonal mean
+    of the state, shifted by i m angular_speed, precondition them. This is
+    what a long run settles to once the ramps are over, for a few dozen
+    tendency evaluations:
+
+        stepper = swe_stepper.SWE_stepper(input_file, H0_values=Hmax, spectral_phi_forcing=forcing)
+        solver  = comoving_steady_solver(stepper, t=600*86400.)
+        state   = solver.solve()                       #### from the linear response
+        state   = solver.solve(initial_state=state)    #### warm start, e.g. next Q0 of a sweep
+
+    stepper       : SWE_stepper (single member). Its state and clock are
+                    overwritten; after solve() it holds the steady state at t,
+                    so stepper.step() continues the run from there (restarting
+                    AB3 with a forward Euler step).
+    phase_speed   : m/s, default stepper.spectral_phi_forcing.phase_speed
+    radius        : of the forcing motion, default that of the forcing
+                    (forcing_engine uses 6371 km) or rsphere
+    t             : time at which forcing and H0 are taken (after the ramps);
+                    default the stepper's clock
+    """
+    def __init__(self, stepper, phase_speed=None, radius=None, t=None):
+        forcing = stepper.spectral_phi_forcing
+        if phase_speed is None:
+            phase_speed = getattr(forcing, 'phase_speed', 0.)
+        if radius is None:
+            radius = getattr(forcing, 'radius', stepper.sp_harmonic.rsphere)
+        if phase_speed and stepper.input_file.get('phi_T_type', 'symmetric') != 'symmetric':
+            raise ValueError('a zonally asymmetric phi_T does not move with the forcing, '
+                             'there is no steady state in the moving frame')
+
+        self.stepper       = stepper
+        self.sp_harmonic   = stepper.sp_harmonic
+        self.angular_speed = phase_speed/radius
+        self.rotation      = 1j*self.angular_speed*self.sp_harmonic.m
+        if t is not None:
+            #### the clock of a run that continues from t (also after a change of dt)
+            stepper.t_start, stepper.ab3_start = float(t), stepper.ncycle
+        self.H0            = stepper.current_H0(stepper.step_index)
+        self.evaluations   = 0
+        self.info          = {}
+
+        hyperdiff_fact   = stepper.hyperdiff_fact if stepper.hyperdiffusion else 1.
+        self.hyper_rate  = -np.log(hyperdiff_fact)/stepper.dt
+
+    def residual(self, vrt, div, phi):
+        """R(x) for the spectra vrt, div, phi, shape (3, nlm)"""
+        st = self.stepper
+        np.copyto(st.vrtspec, vrt)
+        np.copyto(st.divspec, div)
+        np.copyto(st.phispec, phi)
+        st.tendencies()
+        self.evaluations += 1
+
+        dvrt = st.dvrtdtspec[st.nnew] - self.hyper_rate*vrt
+        ddiv = st.ddivdtspec[st.nnew] - self.hyper_rate*div
+        dphi = st.dphidtspec[st.nnew].copy()
+        if st.semi_implicit:
+            #### tendencies() leaves the gravity wave terms to the implicit step
+            ddiv = ddiv + st.minus_lap*phi
+            dphi = dphi - st.phi_ref*div
+        return np.array([dvrt + self.rotation*vrt, ddiv + self.rotation*div, dphi + self.rotation*phi])
+
+    def linear_solver(self, state):
+        """linear_steady_solver about the zonal mean of state, in the moving frame"""
+        return linear_steady.linear_steady_solver(self.stepper, basic_state=state, H0=self.H0, \
+                                                  angular_speed=self.angular_speed)
+
+    def linear_response(self):
+        """axisymmetric steady state plus the linear response to the forcing at t (default first guess)"""
+        st     = self.stepper
+        linear = linear_steady.linear_steady_solver(st, H0=self.H0, angular_speed=self.angular_speed)
+        basic  = linear.basic_state
+        #### the forcing spectra the stepper adds at t
+        self.residual(basic['vrtspec'], basic['divspec'], basic['phispec'])
+        forcing = {'phi_forcing_spec': st.phi_forcing_spec.copy() if 'phi_forcing' in st.active_terms else None, \
+                   'vrt_forcing_spec': st.f_vrt_forcing_spec.copy() if 'uv_forcing' in st.active_terms else None, \
+                   'div_forcing_spec': st.f_div_forcing_spec.copy() if 'uv_forcing' in st.active_terms else None}
+        return linear.steady_state(**forcing)
+
+    def solve(self, initial_state=None, f_tol=1e-7, maxiter=30, inner_maxiter=30, verbose=False):
+        """
+        Newton-Krylov from initial_state (dict with vrtspec, divspec, phispec,
+        e.g. the state of a previous run or solve) or the linear response.
+        Converged when the scaled residual (tendency times 1 day over the
+        typical size of each field) is below f_tol. Raises ValueError
+        otherwise. self.info has the Newton iterations, tendency
+        evaluations and the final residual.
+        """
+        from scipy.optimize import newton_krylov, NoConvergence
+        from scipy.sparse.linalg import LinearOperator
+
+        keys  = ['vrtspec', 'divspec', 'phispec']
+        state = initial_state if initial_state is not None else self.linear_response()
+        x0    = np.array([np.asarray(state[key], dtype=np.complex128) for key in keys])
+        nlm   = self.sp_harmonic.nlm
+        day   = 24*3600.
+
+        #### unknowns and residual in units of the typical size of the zonal mean and of
+        #### the waves of each field (phi waves are 1e-4 of its mean, too small for the
+        #### finite difference Jacobian if scaled together)
+        zonal = self.sp_harmonic.m == 0
+        scale = np.array([np.where(zonal, np.abs(x[zonal]).max() or 1., np.abs(x[~zonal]).max() or 1.) for x in x0])
+        pack   = lambda x: np.concatenate([(x/scale).real.ravel(), (x/scale).imag.ravel()])
+        unpack = lambda y: (y[:3*nlm] + 1j*y[3*nlm:]).reshape(3, nlm)*scale
+
+        def scaled_residual(y):
+            return pack(day*self.residual(*unpack(y)))
+
+        #### per-m blocks linearized about the zonal mean of the first guess as preconditioner
+        linear  = self.linear_solver(dict(zip(keys, x0)))
+        linear.factorize()
+
+        def precondition(y):
+            r = unpack(y)/day
+            x = np.zeros(r.shape, np.complex128)
+            for m, index in enumerate(linear.m_index):
+                x[:, index] = linear.factors[m](r[:, index].ravel()).reshape(3, index.size)
+            return pack(x)
+
+        size = 6*nlm
+        self.evaluations = 0
+        iterations = []
+        try:
+            y = newton_krylov(scaled_residual, pack(x0), method='lgmres', f_tol=f_tol, maxiter=maxiter, \
+                              inner_maxiter=inner_maxiter, verbose=verbose, \
+                              inner_M=LinearOperator((size, size), matvec=precondition), \
+                              callback=lambda y, f: iterations.append(np.abs(f).max()))
+        except NoConvergence as error:
+            raise ValueError('no steady state in the moving frame after %d Newton iterations (%d tendency '
+                             'evaluations), residual %s'%(len(iterations), self.evaluations, \
+                             iterations[-1] if iterations else None)) from error
+
+        x = unpack(y)
+        #### leave the stepper at the solution, with its tendencies
+        final = np.abs(self.residual(*x)).max(axis=1)
+        #### residual() only fills the nnew tendency slot, so the next step starts AB3 again
+        self.stepper.t_start, self.stepper.ab3_start = self.stepper.t, self.stepper.ncycle
+        self.info = {'newton_iterations': len(iterations), 'evaluations': self.evaluations, \
+                     'residual': dict(zip(keys, final))}
+        return dict(zip(keys, x))
@@ -0,0 +1,128 @@
+import os
+import queue
+import threading
+import numpy as np
+
+
+class scalar_series(object):
+    """
+    Time series of a few diagnostic scalars, appended one value at a time
+    into preallocated arrays that are doubled when full. arrays() gives
+    views of the values so far without copying: a value is never changed
+    once written and a full array is replaced rather than resized, so the
+    views stay valid (e.g. for a plot in the background) while the run
+    keeps appending.
+
+        series = scalar_series(['T', 'U_max'])
+        series.append(T=day, U_max=np.max(ug.mean(axis=-1)))
+        series.arrays()     #### {'T': array, 'U_max': array}
+
+    initial: dict of arrays to start from (e.g. from a checkpoint)
+    """
+    def __init__(self, names, capacity=1024, initial=None):
+        self.names  = list(names)
+        self.data   = {name: np.zeros(capacity) for name in self.names}
+        self.length = {name: 0 for name in self.names}
+        if initial is not None:
+            for name in self.names:
+                values = np.asarray(initial[name], dtype=np.float64).ravel()
+                self.data[name] = np.zeros(max(capacity, 2*values.size))
+                self.data[name][:values.size] = values
+                self.length[name] = values.size
+
+    def append(self, **values):
+        for name, value in values.items():
+            n = self.length[name]
+            if n == self.data[name].size:
+                grown = np.zeros(2*n)
+                grown[:n] = self.data[name]
+                self.data[name] = grown
+            self.data[name][n] = value
+            self.length[name]  = n + 1
+
+    def arrays(self):
+        return {name: self.data[name][:self.length[name]] for name in self.names}
+
+
+class plot_worker(object):
+    """
+    Renders figures in a background thread, so that a run does not wait
+    for matplotlib:
+
+        worker = plot_worker()
+        worker.submit(forcing_and_U_figures, direc, title, **series.arrays())
+        ...
+        errors = worker.close()        #### waits for what is still queued
+
+    Jobs only get references to their data, so they should be given values
+    that do not change afterwards (scalar_series.arrays() does that).
+    At most max_queued jobs wait; submit() blocks beyond that. A failing
+    job does not stop the worker, its exception ends up in the list
+    close() returns.
+    """
+    def __init__(self, max_queued=4):
+        self.queue  = queue.Queue(maxsize=max_queued)
+        self.errors = []
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            func, args, kwargs = job
+            try:
+                func(*args, **kwargs)
+            except Exception as error:
+                self.errors.append(error)
+
+    def submit(self, func, *args, **kwargs):
+        self.queue.put((func, args, kwargs))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        return self.errors
+
+
+def new_figure(figsize):
+    """figure that is drawn without pyplot (whose state is not thread safe)"""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def forcing_and_U_figures(direc, title, T, FORCING_max, U_max, EDDY_DIV_max, dpi=300):
+    """
+    forcing.png (max |forcing| and max zonal mean U against days) and
+    div_U.png (max eddy divergence against max zonal mean U) in direc.
+    The series are cut to a common length (a run may stop between appends).
+    """
+    n = min(len(T), len(FORCING_max), len(U_max), len(EDDY_DIV_max))
+    T, FORCING_max, U_max, EDDY_DIV_max = T[:n], FORCING_max[:n], U_max[:n], EDDY_DIV_max[:n]
+    os.makedirs(direc, exist_ok=True)
+
+    fig = new_figure((15, 4))
+    ax  = fig.add_subplot(111)
+    ax.plot(T, FORCING_max, 'g-', lw=4, label='forcing')
+    ax.set_ylabel('forcing', fontsize=20)
+    ax.set_xlabel('days', fontsize=20)
+    ax.tick_params(labelsize=20)
+    ax2 = ax.twinx()
+    ax2.plot(T, U_max, 'b-', lw=4, label='U')
+    ax2.set_ylabel('U', fontsize=20)
+    ax2.tick_params(labelsize=20)
+    ax2.set_title('%s - forcing & U'%(title), fontsize=20)
+    fig.savefig(os.path.join(direc, 'forcing.png'), dpi=dpi, bbox_inches='tight')
+
+    fig = new_figure((15, 4))
+    ax  = fig.add_subplot(111)
+    ax.plot(U_max, EDDY_DIV_max, 'k-', lw=4)
+    ax.tick_params(labelsize=20)
+    ax.set_xlabel('U', fontsize=20)
+    ax.set_ylabel('eddy div', fontsize=20)
+    ax.set_title('%s - eddy div'%(title), fontsize=20)
+    fig.savefig(os.path.join(direc, 'div_U.png'), dpi=dpi, bbox_inches='tight')
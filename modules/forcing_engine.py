@@ -0,0 +1,106 @@
+import numpy as np
+
+
+#### kilometers2degrees (obspy) of the run scripts uses a 6371 km earth
+EARTH_RADIUS_KM = 6371.
+
+
+def tanh_ramp(switch_on_day=0, alpha=25):
+    """tanh((t - switch_on)/alpha days), the transient_effect of PHI_perturb_propagating"""
+    switch_on_time = switch_on_day*24*3600
+    return lambda t: np.tanh(((t - switch_on_time)/(24*3600))/alpha)
+
+
+def switch_on(switch_on_day=None):
+    """0 before switch_on_day and 1 after, the flag of PHI_perturb/F_uv_perturb"""
+    if not switch_on_day:
+        return lambda t: 1.
+    switch_on_time = switch_on_day*24*3600
+    return lambda t: 1. if t >= switch_on_time else 0.
+
+
+class spectral_forcing(object):
+    """
+    A forcing pattern that is only translated in longitude and scaled in time,
+
+        F(lon, lat, t) = ramp(t) * pattern(lon - shift(t), lat)
+        shift(t)       = shift0 + phase_speed*(t - t0)/radius
+
+    transformed once. A shift in longitude is a phase rotation exp(-i m shift)
+    of every coefficient with zonal wavenumber m, so calling the instance
+    (t -> spectrum) costs one complex multiply per coefficient and no
+    transform. Pass it as spectral_phi_forcing of SWE_stepper.
+
+    pattern     : grid of the forcing at shift 0 (or its spectrum)
+    phase_speed : m/s, 0 for a stationary forcing
+    ramp        : callable t -> scalar amplitude (default 1)
+    """
+    def __init__(self, sp_harmonic, pattern, phase_speed=0., t0=0., shift0=0., ramp=None,
+                 radius=EARTH_RADIUS_KM*1e3):
+        self.sp_harmonic = sp_harmonic
+        self.base_spec   = sp_harmonic.grdtospec(pattern) if np.ndim(pattern) == 2 else np.asarray(pattern)
+        self.phase_speed = phase_speed
+        self.t0          = t0
+        self.shift0      = shift0
+        self.ramp        = ramp
+        self.radius      = radius
+        self.zonal_wavenumbers = np.arange(np.max(sp_harmonic.m)+1)
+
+        #### a stationary pattern is rotated once here
+        if phase_speed == 0:
+            self.base_spec = self.base_spec*self.rotation(shift0)
+
+    def shift(self, t):
+        return self.shift0 + self.phase_speed*(t - self.t0)/self.radius
+
+    def rotation(self, shift):
+        return np.exp(-1j*self.zonal_wavenumbers*shift)[self.sp_harmonic.m]
+
+    def __call__(self, t):
+        amplitude = self.ramp(t) if self.ramp is not None else 1.
+        if self.phase_speed == 0:
+            return amplitude*self.base_spec
+        return amplitude*self.base_spec*self.rotation(self.shift(t))
+
+    def grid(self, t):
+        return self.sp_harmonic.spectogrd(self(t))
+
+
+class spectral_uv_forcing(object):
+    """
+    Stationary momentum forcing (fu, fv) times ramp(t), as the vorticity and
+    divergence spectra that getvrtdivspec would give. Pass it as
+    spectral_uv_forcing of SWE_stepper.
+    """
+    def __init__(self, sp_harmonic, fu, fv, ramp=None):
+        self.vrt_spec, self.div_spec = sp_harmonic.getvrtdivspec(fu, fv)
+        self.ramp = ramp
+
+    def __call__(self, t):
+        amplitude = self.ramp(t) if self.ramp is not None else 1.
+        return amplitude*self.vrt_spec, amplitude*self.div_spec
+
+
+def heating_lon(lons, wave_number=2, DIPOLE=True):
+    """one (DIPOLE) or half a wavelength of sin(K lon) starting at lon=0, zero elsewhere"""
+    K       = wave_number
+    width   = (2*np.pi if DIPOLE else np.pi)/K
+    heating = np.sin(K*lons)
+    heating[lons > width] = 0
+    return heating
+
+
+def propagating_heating(sp_harmonic, Q0=10, yp=0, Ly=10, c=5, wave_number=2, DIPOLE=True,
+                        switch_on_day=0, alpha=25, grav=9.80616):
+    """
+    PHI_perturb_propagating of the run scripts as a spectral_forcing:
+    grav*Q0*exp(-(lat-yp)**2/Ly**2) times the dipole/monopole heating in
+    longitude, moving east at c m/s from switch_on_day (parked at 100E if
+    c is 0), ramped up with tanh(t/alpha days).
+    """
+    lons, lats = np.meshgrid(sp_harmonic.lons, sp_harmonic.lats)
+    yp, Ly     = np.deg2rad(yp), np.deg2rad(Ly)
+    pattern    = grav*Q0*np.exp(-((lats-yp)**2/Ly**2))*heating_lon(lons, wave_number, DIPOLE)
+    shift0     = 0. if c != 0 else np.deg2rad(100)
+    return spectral_forcing(sp_harmonic, pattern, phase_speed=c, t0=switch_on_day*24*3600, shift0=shift0, \
+                            ramp=tanh_ramp(switch_on_day, alpha))
@@ -0,0 +1,206 @@
+import numpy as np
+
+
+def equilibrated_solver(block):
+    """
+    LU factors of block with its rows and columns scaled to unit max norm
+    (vrt, div and phi differ by orders of magnitude); returns
+    solve(rhs) -> x of block x = rhs
+    """
+    from scipy.linalg import lu_factor, lu_solve
+    row     = 1./np.abs(block).max(axis=1)
+    col     = 1./np.abs(row[:, None]*block).max(axis=0)
+    factors = lu_factor(row[:, None]*block*col[None, :])
+    return lambda rhs: col*lu_solve(factors, row*rhs)
+
+
+class linear_steady_solver(object):
+    """
+    Steady response of the damped shallow water model to a stationary
+    forcing, linearized about a zonally symmetric basic state (vrt0, div0,
+    phi0). With x the spectral perturbation (vrt, div, phi),
+
+        dx/dt = L x + F = 0      ->      x = -L^-1 F
+
+    The basic state does not depend on longitude, so L does not couple
+    zonal wavenumbers: it is one dense block of size 3(ntrunc-m+1) per m,
+    assembled from 3(ntrunc+1) evaluations of the linearized tendencies
+    (every evaluation probes one coefficient of every m at once) and
+    LU factorized once. A solve is then a few small triangular solves:
+
+        solver   = linear_steady_solver(stepper, H0=Hmax)    #### basic state: axisymmetric_state(H0)
+        response = solver.solve(phi_forcing_spec=forcing(t)*stepper.inv_K_T)
+        state    = solver.steady_state(phi_forcing_spec=...)  #### basic state + response
+
+    The physics is that of SWE_stepper (damping K_M, K_T, hyperdiffusion
+    as the equivalent damping rate, the phi_T forcing of the divergence),
+    so the response is where a long run with a weak stationary forcing
+    ends up. stepper only provides grid, parameters and phi_T.
+
+    stepper      : SWE_stepper (single member)
+    basic_state  : dict with vrtspec, divspec, phispec. Only the m = 0
+                   coefficients are used. Default: axisymmetric_state(H0)
+    H0           : phi_T amplitude. The zonally asymmetric part of H0 phi_T
+                   (asymmetric or empirical phi_T) is part of the forcing
+                   of solve(); the zonal mean part maintains the basic state.
+    angular_speed: steady in a frame moving east at this rate (rad/s), i.e.
+                   the response to a forcing moving at phase_speed/radius.
+                   A field moving with the frame has dx/dt = -i m angular_speed x,
+                   so L gets + i m angular_speed.
+    """
+    def __init__(self, stepper, basic_state=None, H0=0., angular_speed=0.):
+        self.stepper     = stepper
+        self.sp_harmonic = stepper.sp_harmonic
+        self.H0          = H0
+        self.angular_speed = angular_speed
+        self.f           = stepper.f
+        self.inv_K_M     = stepper.inv_K_M
+        self.inv_K_T     = stepper.inv_K_T
+        self.phi_B_spec  = stepper.phi_B*stepper.one_spec
+
+        sp = self.sp_harmonic
+        #### coefficients of every zonal wavenumber, in increasing l
+        self.m_index     = [np.where(sp.m == m)[0] for m in range(int(np.max(sp.m))+1)]
+
+        #### per step hyperdiffusion factor as the damping rate it amounts to
+        self.hyper_rate  = -np.log(stepper.hyperdiff_fact)/stepper.dt if stepper.hyperdiffusion else 0.
+
+        if basic_state is None:
+            basic_state = self.axisymmetric_state(H0)
+        self.set_basic_state(basic_state)
+
+    def zonal_mean(self, spec):
+        return np.where(self.sp_harmonic.m == 0, spec, 0)
+
+    def set_basic_state(self, basic_state):
+        """use the m = 0 part of basic_state; the blocks are rebuilt on the next solve"""
+        sp = self.sp_harmonic
+        self.basic_state = {key: self.zonal_mean(np.asarray(basic_state[key], dtype=np.complex128)) \
+                            for key in ['vrtspec', 'divspec', 'phispec']}
+        self.u0, self.v0  = sp.getuv(self.basic_state['vrtspec'], self.basic_state['divspec'])
+        self.abs_vrt0     = sp.spectogrd(self.basic_state['vrtspec']) + self.f
+        self.phi0         = sp.spectogrd(self.basic_state['phispec'])
+        self.factors      = None
+
+    def tendencies(self, vrt, div, phi, H0=0.):
+        """unforced nonlinear tendencies of SWE_stepper with a fixed H0"""
+        sp         = self.sp_harmonic
+        vrtg       = sp.spectogrd(vrt)
+        ug, vg     = sp.getuv(vrt, div)
+        phig       = sp.spectogrd(phi)
+        abs_vrt    = vrtg + self.f
+
+        curl_NL, div_NL = sp.getvrtdivspec(ug*abs_vrt, vg*abs_vrt)
+        _, div_uvphi_NL = sp.getvrtdivspec(ug*phig, vg*phig)
+        KE_plus_phi     = sp.grdtospec(0.5*(ug**2+vg**2)) + phi + H0*self.stepper.phi_T_unit_spec
+
+        dvrt = - div_NL - vrt*(self.inv_K_M + self.hyper_rate)
+        ddiv =   curl_NL - sp.lap*KE_plus_phi - div*(self.inv_K_M + self.hyper_rate)
+        dphi = - div_uvphi_NL - (phi - self.phi_B_spec)*self.inv_K_T
+        return np.array([dvrt, ddiv, dphi])
+
+    def linear_tendencies(self, vrt, div, phi):
+        """tendencies linearized about the basic state (L x)"""
+        sp         = self.sp_harmonic
+        vrtg       = sp.spectogrd(vrt)
+        ug, vg     = sp.getuv(vrt, div)
+        phig       = sp.spectogrd(phi)
+
+        curl_NL, div_NL = sp.getvrtdivspec(self.u0*vrtg + ug*self.abs_vrt0, self.v0*vrtg + vg*self.abs_vrt0)
+        _, div_uvphi_NL = sp.getvrtdivspec(self.u0*phig + ug*self.phi0,     self.v0*phig + vg*self.phi0)
+        KE_plus_phi     = sp.grdtospec(self.u0*ug + self.v0*vg) + phi
+
+        dvrt = - div_NL - vrt*(self.inv_K_M + self.hyper_rate)
+        ddiv =   curl_NL - sp.lap*KE_plus_phi - div*(self.inv_K_M + self.hyper_rate)
+        dphi = - div_uvphi_NL - phi*self.inv_K_T
+        if self.angular_speed:
+            rotation = 1j*self.angular_speed*sp.m
+            dvrt, ddiv, dphi = dvrt + rotation*vrt, ddiv + rotation*div, dphi + rotation*phi
+        return np.array([dvrt, ddiv, dphi])
+
+    def blocks(self, operator=None, m_values=None):
+        """
+        dense matrix of operator (default linear_tendencies) for every m in
+        m_values (default all), unknowns ordered [vrt, div, phi] x increasing l
+        """
+        operator = operator if operator is not None else self.linear_tendencies
+        m_values = m_values if m_values is not None else range(len(self.m_index))
+        nlm      = self.sp_harmonic.nlm
+        sizes    = {m: self.m_index[m].size for m in m_values}
+        blocks   = {m: np.zeros((3*n, 3*n), np.complex128) for m, n in sizes.items()}
+
+        for field in range(3):
+            for k in range(max(sizes.values())):
+                probe = np.zeros((3, nlm), np.complex128)
+                for m in m_values:
+                    if k < sizes[m]:
+                        probe[field, self.m_index[m][k]] = 1.
+                result = operator(*probe)
+                for m in m_values:
+                    if k < sizes[m]:
+                        blocks[m][:, field*sizes[m] + k] = result[:, self.m_index[m]].ravel()
+        return blocks
+
+    def factorize(self):
+        self.factors = {m: equilibrated_solver(block) for m, block in self.blocks().items()}
+
+    def forcing_vector(self, phi_forcing_spec=None, vrt_forcing_spec=None, div_forcing_spec=None):
+        sp      = self.sp_harmonic
+        forcing = np.zeros((3, sp.nlm), np.complex128)
+        for i, spec in enumerate([vrt_forcing_spec, div_forcing_spec, phi_forcing_spec]):
+            if spec is not None:
+                forcing[i] += spec
+        if self.H0:
+            phi_T_spec  = self.H0*self.stepper.phi_T_unit_spec
+            forcing[1] -= sp.lap*(phi_T_spec - self.zonal_mean(phi_T_spec))
+        return forcing
+
+    def solve(self, phi_forcing_spec=None, vrt_forcing_spec=None, div_forcing_spec=None):
+        """
+        steady perturbation for stationary forcing spectra (the tendencies
+        SWE_stepper adds, i.e. phi_forcing_spec is the forcing over K_T)
+        """
+        if self.factors is None:
+            self.factorize()
+
+        forcing  = self.forcing_vector(phi_forcing_spec, vrt_forcing_spec, div_forcing_spec)
+        response = np.zeros(forcing.shape, np.complex128)
+        for m, index in enumerate(self.m_index):
+            response[:, index] = self.factors[m](-forcing[:, index].ravel()).reshape(3, index.size)
+        #### m = 0 coefficients of real fields are real
+        response[:, self.m_index[0]] = response[:, self.m_index[0]].real
+        return {'vrtspec': response[0], 'divspec': response[1], 'phispec': response[2]}
+
+    def steady_state(self, **forcing):
+        """basic state plus solve(**forcing), e.g. as initial_state of SWE_stepper"""
+        response = self.solve(**forcing)
+        return {key: self.basic_state[key] + response[key] for key in response}
+
+    def axisymmetric_state(self, H0, tol=1e-10, continuation=4, max_iterations=20):
+        """
+        Zonally symmetric steady state of the nonlinear model with phi_T
+        amplitude H0 (the zonal mean of phi_T), by Newton iterations on the
+        m = 0 block, with H0 raised to its value in continuation stages from
+        rest (phi = phi_B). Raises ValueError if Newton does not converge.
+        """
+        index = self.m_index[0]
+        state = {'vrtspec': np.zeros(self.sp_harmonic.nlm, np.complex128), \
+                 'divspec': np.zeros(self.sp_harmonic.nlm, np.complex128), \
+                 'phispec': self.phi_B_spec.astype(np.complex128)}
+        keys  = ['vrtspec', 'divspec', 'phispec']
+
+        for H0_stage in np.linspace(0, H0, continuation+1)[1:]:
+            for iteration in range(max_iterations):
+                self.set_basic_state(state)
+                x        = np.array([state[key] for key in keys])
+                residual = self.zonal_mean(self.tendencies(*x, H0=H0_stage))
+                jacobian = equilibrated_solver(self.blocks(m_values=[0])[0])
+                dx       = jacobian(-residual[:, index].ravel()).real.reshape(3, index.size)
+                for i, key in enumerate(keys):
+                    state[key][index] += dx[i]
+                if all(np.abs(dx[i]).max() <= tol*np.abs(x[i][index]).max() for i in range(3)):
+                    break
+            else:
+                raise ValueError('no axisymmetric steady state found for H0 = %s (stage %s), try more continuation stages'%( \
+                                 H0, H0_stage))
+        return state
@@ -0,0 +1,218 @@
+import os
+import hashlib
+import numpy as np
+
+import save_and_load_hdf5_files as h5saveload
+
+
+#### meridional profiles of every bank are cached here, keyed by Hmean, constants and grid
+MODE_CACHE_DIR = os.environ.get('SWE_MATSUNO_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'swe_matsuno_modes'))
+
+FAMILIES = ['Kelvin', 'MRG', 'Rossby', 'WIG', 'EIG']
+
+#### the parameters calc_matsuno_modes sets at import, which every run built its modes with:
+#### beta and R fixed, and yT from c = sqrt(10*500) (the scripts only updated params['c'] after that)
+LEGACY_R    = 6371e3
+LEGACY_BETA = 2*7.292e-5/LEGACY_R
+LEGACY_YT   = np.sqrt(np.sqrt(10*500)/LEGACY_BETA)
+
+
+def parabolic_cylinder(n_max, zeta):
+    """
+    D_n(zeta) = H_n(zeta) exp(-zeta^2/2) 2^(-n/2) for n = 0 ... n_max (the
+    Dn of calc_matsuno_modes), by the recurrence D_n+1 = sqrt(2) zeta D_n - n D_n-1,
+    which stays finite where the Hermite polynomials themselves overflow
+    """
+    D    = np.zeros((n_max+1,)+np.shape(zeta))
+    D[0] = np.exp(-np.square(zeta)/2)
+    if n_max >= 1:
+        D[1] = np.sqrt(2)*zeta*D[0]
+    for n in range(1, n_max):
+        D[n+1] = np.sqrt(2)*zeta*D[n] - n*D[n-1]
+    return D
+
+
+def dispersion_roots(n, kn):
+    """
+    The three real roots, in increasing order along the last axis, of the
+    nondimensional Matsuno dispersion relation w^3 - w (k^2 + 2n + 1) - k = 0
+    for arrays of n >= 1 and k (trigonometric form of the depressed cubic).
+    The largest is the eastward (k >= 0) or westward (k < 0) inertia
+    gravity wave, the middle one the Rossby wave for k < 0.
+    """
+    n, kn = np.broadcast_arrays(np.asarray(n, dtype=np.float64), np.asarray(kn, dtype=np.float64))
+    p     = -(np.square(kn) + 2*n + 1)
+    q     = -kn
+    r     = 2*np.sqrt(-p/3)
+    theta = np.arccos(np.clip((3*q/(2*p))*np.sqrt(-3/p), -1, 1))/3
+    roots = np.stack([r*np.cos(theta - 2*np.pi*j/3) for j in range(3)], axis=-1)
+    return np.sort(roots, axis=-1)
+
+
+def mode_list(n_max=5, k_max=10):
+    """(family, n, kn) of every mode of calc_matsuno_modes.MODE_N"""
+    k_both = [kn for kn in range(-k_max, k_max+1) if kn != 0]
+    modes  = [('Kelvin', -1, kn) for kn in k_both] + [('MRG', 0, kn) for kn in k_both]
+    for family, k_range in [('Rossby', range(-k_max, 0)), ('WIG', range(-k_max, 0)), ('EIG', range(0, k_max+1))]:
+        modes += [(family, n, kn) for n in range(1, n_max+1) for kn in k_range]
+    return modes
+
+
+def gaussian_lats_lons(nlons, nlats):
+    """latitudes (north to south) and longitudes in radians of the Gaussian grid of Spharmt"""
+    nodes, _ = np.polynomial.legendre.leggauss(nlats)
+    return np.arcsin(nodes[::-1]), (2.*np.pi/nlons)*np.arange(nlons)
+
+
+class matsuno_bank(object):
+    """
+    The equatorial shallow water (Matsuno) modes of calc_matsuno_modes,
+    for all families, n and kn at once and without plotting: frequencies
+    from the closed form roots of the dispersion relation, meridional
+    structures from one recurrence of the parabolic cylinder functions.
+    A mode is separable, field = Re(profile(lat) exp(i(kn lon - w t))),
+    so only the complex meridional profiles (u, v, phi, div) are stored,
+    shape (number of modes, nlats); fields on a grid are made when asked:
+
+        bank  = load_bank(Hmean, lats, grav=grav)           #### cached on disk
+        mode  = bank.mode('Rossby', kn=-1, n=1, lons=lons)  #### un, vn, phin, div, w, ...
+        state = bank.combination([('Kelvin', -1, 1, 0.5), ('Rossby', 1, -1, 0.1)], lons)
+
+    As in calc_matsuno_modes, kn is both the zonal wavenumber of the
+    pattern and the nondimensional k (units 1/yT) of the dispersion
+    relation and the amplitudes are those of its vector().
+
+    By default (legacy_params) the parameters are those the initial value
+    runs used: c = sqrt(grav Hmean), but beta, R and yT as set at import
+    of calc_matsuno_modes (LEGACY_BETA, LEGACY_R, LEGACY_YT), whatever
+    omega, rsphere and Hmean are. With legacy_params=False beta and R come
+    from omega and rsphere and yT = sqrt(c/beta) follows Hmean, the modes
+    of the model's own equator; yT can also be given.
+
+    lats  : latitudes of the grid in radians (e.g. sp_harmonic.lats)
+    saved : saved_state() of the same bank (load_bank), instead of building it
+    """
+    def __init__(self, Hmean, lats, grav=9.80616, omega=7.292e-5, rsphere=6371e3, n_max=5, k_max=10, saved=None, \
+                 legacy_params=True, yT=None):
+        if legacy_params:
+            omega, rsphere = LEGACY_BETA*LEGACY_R/2, LEGACY_R
+        self.Hmean, self.grav, self.omega, self.rsphere = Hmean, grav, omega, rsphere
+        self.n_max, self.k_max = n_max, k_max
+        self.legacy_params = legacy_params
+        self.lats    = np.asarray(lats, dtype=np.float64)
+
+        self.c       = np.sqrt(grav*Hmean)
+        self.beta    = LEGACY_BETA if legacy_params else 2*omega/rsphere
+        self.yT      = yT if yT is not None else (LEGACY_YT if legacy_params else np.sqrt(self.c/self.beta))
+        self.w_scale = np.sqrt(self.beta*self.c)
+
+        modes        = mode_list(n_max, k_max)
+        self.family  = np.array([family for family, _, _ in modes])
+        self.n       = np.array([n for _, n, _ in modes])
+        self.kn      = np.array([kn for _, _, kn in modes], dtype=np.float64)
+        self.lookup  = {mode: i for i, mode in enumerate(modes)}
+        self.k       = self.kn/self.yT
+        if saved is None:
+            self.build()
+        else:
+            self.restore(saved)
+
+    def build(self):
+        family, n, kn = self.family, self.n, self.kn
+        wd = kn.copy()                                                      #### Kelvin: w = k
+        mrg = family == 'MRG'
+        wd[mrg] = 0.5*(kn[mrg] + np.sqrt(np.square(kn[mrg]) + 4))           #### (w + k)(w^2 - k w - 1) = 0
+        waves = n >= 1
+        roots = dispersion_roots(n[waves], kn[waves])
+        wd[waves] = np.where(family[waves] == 'Rossby', roots[:, 1], roots[:, 2])
+        self.wd = wd
+        self.w  = wd*self.w_scale
+
+        zeta  = self.rsphere*self.lats/self.yT
+        D     = parabolic_cylinder(self.n_max+1, zeta)
+        n_up  = D[np.clip(n+1, 0, None)]
+        n_low = D[np.clip(n-1, 0, None)]*np.maximum(n, 0)[:, None]
+        D_n   = D[np.clip(n, 0, None)]
+
+        #### q_n+1 and r_n-1 of vector(); the Kelvin wave is D_0 without the frequency factors
+        scale = np.sqrt(2*self.beta*self.c)
+        kelvin = (family == 'Kelvin')[:, None]
+        w, k, c = self.w[:, None], self.k[:, None], self.c
+        with np.errstate(divide='ignore', invalid='ignore'):
+            q = np.where(kelvin, D[0][None, :], n_up*scale/(w - k*c))
+            r = np.where(kelvin | (n[:, None] < 1), 0., n_low*scale/(w + k*c))
+
+        self.u   = (q + r)/2 + 0j
+        self.phi = c*(q - r)/2 + 0j
+        self.v   = np.where(kelvin, 0., -1j*D_n)
+        div_y    = np.where(kelvin, 0., (n_low - n_up)/(np.sqrt(2)*self.yT))
+        self.div = 1j*k*self.u - 1j*div_y
+
+    def index(self, family, kn, n=None):
+        n = {'Kelvin': -1, 'MRG': 0}.get(family, n)
+        if (family, n, kn) not in self.lookup:
+            raise ValueError('no %s mode with n = %s, kn = %s in the bank (n_max = %d, k_max = %d)'%( \
+                             family, n, kn, self.n_max, self.k_max))
+        return self.lookup[(family, n, kn)]
+
+    def mode(self, family, kn, n=None, lons=None, t=0):
+        """fields of one mode on the grid (lats, lons), with the keys of calc_matsuno_modes.vector()"""
+        i     = self.index(family, kn, n)
+        lons  = np.asarray(lons if lons is not None else gaussian_lats_lons(2*self.lats.size, self.lats.size)[1])
+        phase = np.exp(1j*(self.kn[i]*lons - self.w[i]*t))[None, :]
+        return {'n': self.n[i], 'kn': self.kn[i], 'k': self.k[i], 'wd': self.wd[i], 'w': self.w[i], \
+                'un'  : (self.u[i][:, None]*phase).real, 'vn': (self.v[i][:, None]*phase).real, \
+                'phin': (self.phi[i][:, None]*phase).real, 'div': (self.div[i][:, None]*phase).real, \
+                'lat' : np.rad2deg(self.lats), 'lon': np.rad2deg(lons), 'trap_scale': np.rad2deg(self.yT/self.rsphere)}
+
+    def combination(self, modes, lons, t=0):
+        """un, vn, phin, div of a sum of (family, n, kn, amplitude) modes"""
+        index     = [self.index(family, kn, n) for family, n, kn, _ in modes]
+        amplitude = np.array([amp for _, _, _, amp in modes])[:, None, None]
+        phase     = amplitude*np.exp(1j*(self.kn[index][:, None]*np.asarray(lons)[None, :] - self.w[index][:, None]*t))[:, None, :]
+        return {key: np.sum(getattr(self, name)[index][:, :, None]*phase, axis=0).real \
+                for key, name in [('un', 'u'), ('vn', 'v'), ('phin', 'phi'), ('div', 'div')]}
+
+    def mode_dict(self, lons, t=0):
+        """all modes on the grid, nested like calc_matsuno_modes.MODE_N"""
+        modes = {family: {} for family in FAMILIES}
+        for (family, n, kn) in self.lookup:
+            if family in ('Kelvin', 'MRG'):
+                modes[family]['(kn=%d)'%(kn)] = self.mode(family, kn, lons=lons, t=t)
+            else:
+                modes[family].setdefault('(n=%d)'%(n), {})['(kn=%d)'%(kn)] = self.mode(family, kn, n, lons, t)
+        return modes
+
+    def saved_state(self):
+        return {'wd': self.wd, 'u': self.u, 'v': self.v, 'phi': self.phi, 'div': self.div}
+
+    def restore(self, saved):
+        self.wd = np.asarray(saved['wd'])
+        self.w  = self.wd*self.w_scale
+        for key in ['u', 'v', 'phi', 'div']:
+            setattr(self, key, np.asarray(saved[key]))
+
+
+def cache_key(Hmean, lats, grav, omega, rsphere, n_max, k_max, legacy_params=True, yT=None):
+    grid   = hashlib.sha1(np.ascontiguousarray(lats, dtype=np.float64).tobytes()).hexdigest()[:16]
+    params = 'legacy' if legacy_params else 'omega_%s_R_%s'%(omega, rsphere)
+    params = params if yT is None else params+'_yT_%s'%(yT)
+    return 'Hmean_%s_grav_%s_%s_n%d_k%d_nlats%d_%s'%(Hmean, grav, params, n_max, k_max, len(lats), grid)
+
+
+def load_bank(Hmean, lats, grav=9.80616, omega=7.292e-5, rsphere=6371e3, n_max=5, k_max=10, cache_dir=None, \
+              legacy_params=True, yT=None):
+    """matsuno_bank from the disk cache (MODE_CACHE_DIR), built and cached if it is not there"""
+    cache_dir  = cache_dir if cache_dir is not None else MODE_CACHE_DIR
+    cache_file = os.path.join(cache_dir, cache_key(Hmean, lats, grav, omega, rsphere, n_max, k_max, legacy_params, yT)+'.hdf5')
+    options    = dict(legacy_params=legacy_params, yT=yT)
+    if os.path.exists(cache_file):
+        return matsuno_bank(Hmean, lats, grav, omega, rsphere, n_max, k_max, \
+                            saved=h5saveload.load_dict_from_hdf5(cache_file), **options)
+
+    bank = matsuno_bank(Hmean, lats, grav, omega, rsphere, n_max, k_max, **options)
+    h5saveload.make_sure_path_exists(cache_dir)
+    tmp_file = cache_file+'.tmp%d'%(os.getpid())   #### parallel sweeps may build the same bank
+    h5saveload.save_dict_to_hdf5(bank.saved_state(), tmp_file)
+    os.replace(tmp_file, cache_file)
+    return bank
@@ -0,0 +1,153 @@
+import numpy as np
+
+import matsuno_bank as matsuno_bank
+
+
+class modal_projection(object):
+    """
+    Amplitudes of the Matsuno modes of a matsuno_bank in fields on the
+    model grid, by least squares. A mode only appears at the zonal
+    wavenumber m = |kn|, so the basis is split by m: the rfft of (u, v,
+    phi) along longitude at m > 0 has
+
+        F_m(lat) = nlons/2 [ sum_kn=+m a P(lat) + sum_kn=-m conj(a P(lat)) ]
+
+    (P the complex profile, a the complex amplitude of
+    bank.combination times exp(-i w t)), and the pseudo-inverse of each
+    of these small (3 nlats, number of modes of m) blocks is computed
+    once. A whole time series is then one matrix product per m:
+
+        projection = modal_projection(bank, lons=sp_harmonic.lons)
+        result     = projection.project(U, V, PHI)         #### (ntimes, nlats, nlons) each
+        result['amplitudes']                                #### (ntimes, number of modes of the bank)
+        projection.family_energy(result['amplitudes'])      #### {'Kelvin': (ntimes,), ...}
+
+        result     = project_history(path2+'spatial_data.hdf5', projection)
+
+    The fit is in the energy norm, u^2 + v^2 + phi^2/c^2 weighted by the
+    latitude spacing, only over |lat| <= max_lat (degrees) if given.
+    residual[:, j] is the part of the energy at wavenumbers[j] the modes
+    do not explain (0 for a pure combination of modes, 1 for none of it).
+
+    The bank's Kelvin wave with kn = -m (w = k) is the one with kn = m
+    and the conjugate amplitude, so Kelvin waves are reported at kn = m
+    only.
+
+    wavenumbers : m to project, default 1 ... k_max. m = 0 holds the
+                  zonal mean state, which is not a mode, so it is only
+                  fitted (eastward inertia gravity waves with kn = 0) if
+                  asked for. Modes of other m have NaN amplitudes.
+    """
+    def __init__(self, bank, lons=None, wavenumbers=None, max_lat=None):
+        self.bank        = bank
+        nlats            = bank.lats.size
+        self.lons        = np.asarray(lons if lons is not None else matsuno_bank.gaussian_lats_lons(2*nlats, nlats)[1])
+        self.nlons       = self.lons.size
+        self.wavenumbers = list(wavenumbers) if wavenumbers is not None else list(range(1, bank.k_max+1))
+        if max(self.wavenumbers) > self.nlons//2 or min(self.wavenumbers) < 0:
+            raise ValueError('wavenumbers must be in 0 ... %d for %d longitudes'%(self.nlons//2, self.nlons))
+        if not np.allclose(self.lons, self.lons[0] + (2*np.pi/self.nlons)*np.arange(self.nlons)):
+            raise ValueError('lons must be %d equally spaced longitudes around the globe'%(self.nlons))
+
+        #### quadrature weights of the energy norm, u, v and phi/c stacked over latitude
+        lat_weight = np.abs(np.gradient(bank.lats))
+        if max_lat is not None:
+            lat_weight = lat_weight*(np.abs(bank.lats) <= np.deg2rad(max_lat))
+        self.weight  = np.sqrt(np.concatenate([lat_weight, lat_weight, lat_weight]))
+        self.c_scale = np.array([1., 1., 1./bank.c])
+        basis        = np.concatenate([bank.u, bank.v, bank.phi/bank.c], axis=1)*self.weight   #### (nmodes, 3 nlats)
+
+        #### rfft of lons starting at lons[0] instead of 0
+        self.shift   = np.exp(1j*np.array(self.wavenumbers)*self.lons[0])
+
+        self.index, self.inverse, self.projector = [], [], []
+        for m in self.wavenumbers:
+            plus  = np.flatnonzero(bank.kn == m)
+            minus = np.flatnonzero((bank.kn == -m) & (bank.family != 'Kelvin')) if m > 0 else np.zeros(0, dtype=int)
+            if m > 0:
+                #### unknowns a (kn = m) and conj(a) (kn = -m)
+                A = np.concatenate([basis[plus], basis[minus].conj()]).T
+            else:
+                #### real fit for real and imaginary part of a
+                A = np.concatenate([basis[plus].real, -basis[plus].imag]).T
+            inverse = np.linalg.pinv(A)
+            self.index.append((plus, minus))
+            self.inverse.append(inverse.T)                           #### right multiply rows of coefficients
+            self.projector.append((np.eye(A.shape[0]) - A @ inverse).T)
+
+    def coefficients(self, u, v, phi):
+        """weighted Fourier coefficients, (ntimes, number of wavenumbers, 3 nlats)"""
+        fields = np.stack([np.asarray(u), np.asarray(v), np.asarray(phi)], axis=-3)    #### (ntimes, 3, nlats, nlons)
+        F      = np.fft.rfft(fields, axis=-1)[..., self.wavenumbers]*self.shift
+        F      = F*(self.c_scale[:, None, None]*2./self.nlons)
+        F      = np.moveaxis(F, -1, 1).reshape(F.shape[0], len(self.wavenumbers), -1)
+        return F*self.weight
+
+    def project(self, u, v, phi):
+        """
+        u, v, phi of shape (ntimes, nlats, nlons) or (nlats, nlons).
+        Returns a dict with amplitudes (ntimes, number of modes, complex,
+        aligned with the bank: bank.index(family, kn, n)) and residual
+        (ntimes, number of wavenumbers).
+        """
+        single = np.ndim(u) == 2
+        if single:
+            u, v, phi = u[None], v[None], phi[None]
+        F          = self.coefficients(u, v, phi)
+        amplitudes = np.full((F.shape[0], self.bank.kn.size), np.nan + 0j)
+        left       = np.zeros((F.shape[0], len(self.wavenumbers)))
+        total      = np.zeros((F.shape[0], len(self.wavenumbers)))
+
+        for j, m in enumerate(self.wavenumbers):
+            plus, minus = self.index[j]
+            if m > 0:
+                coefficients = F[:, j]
+                fit          = coefficients @ self.inverse[j]
+                amplitudes[:, plus]  = fit[:, :plus.size]
+                amplitudes[:, minus] = fit[:, plus.size:].conj()
+            else:
+                coefficients = F[:, j].real/2                     #### rfft at m = 0 is nlons times the mean
+                fit          = coefficients @ self.inverse[j]
+                amplitudes[:, plus] = fit[:, :plus.size] + 1j*fit[:, plus.size:]
+            total[:, j] = np.sum(np.abs(coefficients)**2, axis=-1)
+            left[:, j]  = np.sum(np.abs(coefficients @ self.projector[j])**2, axis=-1)
+
+        #### wavenumbers with no energy (round off only) count as explained
+        empty = total <= 1e-20*total.sum(axis=-1, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            residual = np.where(empty, 0., left/total)
+
+        if single:
+            return {'amplitudes': amplitudes[0], 'residual': residual[0]}
+        return {'amplitudes': amplitudes, 'residual': residual}
+
+    def energy(self, amplitudes):
+        """zonal mean energy (u^2 + v^2 + phi^2/c^2)/2, integrated over latitude, of each mode"""
+        norm = np.sum(np.abs(np.concatenate([self.bank.u, self.bank.v, self.bank.phi/self.bank.c], axis=1)*self.weight)**2, axis=1)
+        return 0.25*np.abs(amplitudes)**2*norm
+
+    def family_energy(self, amplitudes):
+        """energy of the projected modes summed by family (Kelvin, MRG, Rossby, WIG, EIG)"""
+        energy = self.energy(amplitudes)
+        return {family: np.nansum(energy[..., self.bank.family == family], axis=-1) for family in matsuno_bank.FAMILIES}
+
+
+def project_history(filename, projection, block=256, keys=('U', 'V', 'PHI')):
+    """
+    project() of every snapshot of a spatial_data.hdf5, read block time
+    indices at a time (either kind of file, through spectral_history).
+    Adds T_in_days if the file has it.
+    """
+    import spectral_history as spectral_history
+
+    data   = spectral_history.spectral_history(filename)
+    try:
+        ntimes = data.ntimes(keys[0])
+        parts  = [projection.project(*[data.read(key, slice(start, min(start+block, ntimes))) for key in keys]) \
+                  for start in range(0, ntimes, block)]
+        result = {key: np.concatenate([part[key] for part in parts]) for key in ['amplitudes', 'residual']}
+        if 'T_in_days' in data.h5file:
+            result['T_in_days'] = data['T_in_days']
+    finally:
+        data.close()
+    return result
@@ -4,14 +4,71 @@ import glob
 import numpy as np
 from tqdm import tqdm
 
+#### storage profiles for save_dict_to_hdf5 / history_writer:
+####    float32          : keys (dataset names) stored in single precision (complex128 -> complex64)
+####    compression      : 'gzip' or 'lzf' (None for no filter), with compression_opts for gzip
+####    shuffle          : byte shuffle before compression, helps a lot for floats
+####    time_chunks      : chunk length along the first (time) axis, the other axes are
+####                       kept whole so one snapshot is one read
+HISTORY_KEYS = ['U', 'V', 'PHI', 'div', 'vrt', 'phi_T', 'phi_forcing', 'vrt_forcing', 'div_forcing']
+
+STORAGE_PROFILES = {'compact': {'float32': HISTORY_KEYS, 'compression': 'gzip', 'compression_opts': 4, \
+                                'shuffle': True, 'time_chunks': 8}, \
+                    'fast'   : {'float32': HISTORY_KEYS, 'compression': 'lzf', \
+                                'shuffle': True, 'time_chunks': 8}, \
+                    'exact'  : {'float32': [], 'compression': 'gzip', 'compression_opts': 4, \
+                                'shuffle': True, 'time_chunks': 8}}
+
+def storage_profile(profile):
+    if profile is None or isinstance(profile, dict):
+        return profile
+    if profile not in STORAGE_PROFILES:
+        raise ValueError('Unknown storage profile %s, use one of %s'%(profile, list(STORAGE_PROFILES.keys())))
+    return STORAGE_PROFILES[profile]
+
+def storage_dtype(key, dtype, profile):
+    if profile is not None and key in profile.get('float32', []):
+        if dtype == np.float64:
+            return np.dtype(np.float32)
+        if dtype == np.complex128:
+            return np.dtype(np.complex64)
+    return dtype
+
+def storage_options(shape, profile):
+    """create_dataset keywords (filters and chunks) for an array of this shape"""
+    if profile is None or len(shape) == 0 or np.prod(shape) <= 1:
+        return {}
+    options = {}
+    if profile.get('compression', None) is not None:
+        options['compression'] = profile['compression']
+        if profile.get('compression_opts', None) is not None and profile['compression'] == 'gzip':
+            options['compression_opts'] = profile['compression_opts']
+        options['shuffle'] = profile.get('shuffle', True)
+    if len(shape) >= 2:
+        options['chunks'] = (max(1, min(profile.get('time_chunks', 8), shape[0])),) + tuple(shape[1:])
+    elif options:
+        options['chunks'] = True
+    return options
+
+def save_item(h5file, name, key, item, profile):
+    if profile is not None and isinstance(item, np.ndarray) and item.dtype.kind in 'fc':
+        h5file.create_dataset(name, data=item.astype(storage_dtype(key, item.dtype, profile), copy=False), \
+                              **storage_options(item.shape, profile))
+    else:
+        h5file[name] = item
+
 def make_sure_path_exists(path):
     if not os.path.isdir(path):
         os.makedirs(path)
 
-def save_dict_to_hdf5(dic, filename, track=False):
-
+def save_dict_to_hdf5(dic, filename, track=False, profile=None):
+    """
+    profile : None (plain float64 datasets), a name in STORAGE_PROFILES
+              ('compact', 'fast', 'exact') or a dict with the same keys
+    """
+    profile = storage_profile(profile)
     with h5py.File(filename, 'w') as h5file:
-        recursively_save_dict_contents_to_group(h5file, '/', dic, track)
+        recursively_save_dict_contents_to_group(h5file, '/', dic, track, profile)
 
 def load_dict_from_hdf5(filename, track=False):
 
@@ -19,16 +76,16 @@ def load_dict_from_hdf5(filename, track=False):
         return recursively_load_dict_contents_from_group(h5file, '/', track)
 
 
-def recursively_save_dict_contents_to_group(h5file, path, dic, track):
+def recursively_save_dict_contents_to_group(h5file, path, dic, track, profile=None):
     """
     ....
     """
     if track :
         for key, item in tqdm(dic.items()):
             if isinstance(item, (np.ndarray, np.int64, np.float64, str, bytes, int, float, list, tuple)):
-                h5file[path + key] = item
+                save_item(h5file, path + key, key, item, profile)
             elif isinstance(item, dict):
-                recursively_save_dict_contents_to_group(h5file, path + key + '/', item, track)
+                recursively_save_dict_contents_to_group(h5file, path + key + '/', item, track, profile)
             else:
                 raise ValueError('Cannot save %s type'%type(item))
                 
@@ -36,9 +93,9 @@ def recursively_save_dict_contents_to_group(h5file, path, dic, track):
         
         for key, item in dic.items():
             if isinstance(item, (np.ndarray, np.int64, np.float64, str, bytes, int, float, list, tuple)):
-                h5file[path + key] = item
+                save_item(h5file, path + key, key, item, profile)
             elif isinstance(item, dict):
-                recursively_save_dict_contents_to_group(h5file, path + key + '/', item, track)
+                recursively_save_dict_contents_to_group(h5file, path + key + '/', item, track, profile)
             else:
                 raise ValueError('Cannot save %s type'%type(item))
                 
@@ -69,3 +126,98 @@ def recursively_load_dict_contents_from_group(h5file, path, track):
 
                     
         
+
+
+class history_writer(object):
+    """
+    Appends one output step at a time to resizable, chunked datasets, so a
+    run never keeps its history in memory and what was written survives a
+    crash. The finished file loads with load_dict_from_hdf5 like a dict
+    saved in one go.
+
+        writer = history_writer(filename)
+        writer.write({'lats': lats, 'lons': lons})        #### written once
+        writer.append({'U': ug, 'V': vg, 'T_in_days': t}) #### one row per call
+        writer.close()
+
+    mode='a' reopens an existing file; truncate(nrows) then drops rows
+    written after the last checkpoint. profile is a storage profile as in
+    save_dict_to_hdf5; its time_chunks sets the chunk length.
+
+    The file is not in SWMR mode: datasets are created on their first
+    append and write() replaces datasets, neither of which SWMR allows.
+    Instead flush() has to follow the last append before every checkpoint,
+    so the rows the checkpoint counts (nrows) are on disk. A kill during a
+    later append can still leave a file HDF5 cannot open; readable() tells,
+    and the run then has to start again.
+    """
+    def __init__(self, filename, mode='w', chunk_steps=8, cache_bytes=32*1024**2, profile=None):
+        self.filename    = filename
+        self.profile     = storage_profile(profile)
+        self.chunk_steps = self.profile.get('time_chunks', chunk_steps) if self.profile is not None else chunk_steps
+        #### a chunk cache larger than one chunk, so rows fill a chunk in memory before it is written
+        self.h5file      = h5py.File(filename, mode, rdcc_nbytes=cache_bytes)
+
+    def append(self, fields):
+        for key, item in fields.items():
+            item = np.asarray(item)
+            if key not in self.h5file:
+                options = storage_options((self.chunk_steps,)+item.shape, self.profile)
+                options['chunks'] = (self.chunk_steps,)+item.shape
+                self.h5file.create_dataset(key, shape=(0,)+item.shape, maxshape=(None,)+item.shape, \
+                                           dtype=storage_dtype(key.split('/')[-1], item.dtype, self.profile), **options)
+                self.h5file[key].attrs['time_series'] = True
+            dataset = self.h5file[key]
+            nrows   = dataset.shape[0]
+            dataset.resize(nrows+1, axis=0)
+            dataset[nrows] = item
+
+    def write(self, fields, path='/'):
+        for key, item in fields.items():
+            if isinstance(item, dict):
+                self.write(item, path + key + '/')
+            else:
+                if path + key in self.h5file:
+                    del self.h5file[path + key]
+                save_item(self.h5file, path + key, key, item, self.profile)
+
+    def time_series(self):
+        names = []
+        self.h5file.visititems(lambda name, item: names.append(name) \
+                               if isinstance(item, h5py.Dataset) and item.attrs.get('time_series', False) else None)
+        return names
+
+    @property
+    def nrows(self):
+        """number of complete output steps (rows present in every time series)"""
+        lengths = [self.h5file[name].shape[0] for name in self.time_series()]
+        return min(lengths) if lengths else 0
+
+    def truncate(self, nrows):
+        for name in self.time_series():
+            if self.h5file[name].shape[0] > nrows:
+                self.h5file[name].resize(nrows, axis=0)
+
+    def flush(self):
+        self.h5file.flush()
+
+    def close(self):
+        self.h5file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def readable(filename):
+    """whether filename exists and HDF5 can open it and list its datasets"""
+    if not os.path.exists(filename):
+        return False
+    try:
+        with h5py.File(filename, 'r') as h5file:
+            h5file.visit(lambda name: None)
+        return True
+    except (OSError, RuntimeError, KeyError):
+        return False
@@ -0,0 +1,139 @@
+import h5py
+import numpy as np
+
+import swe_stepper as swe_stepper
+
+
+#### fields a spectral-only history file can give back on the grid, and what they are made of
+SYNTHESIZED = {'U'          : ('VRT_spec', 'DIV_spec'), \
+               'V'          : ('VRT_spec', 'DIV_spec'), \
+               'vrt'        : ('VRT_spec',), \
+               'div'        : ('DIV_spec',), \
+               'PHI'        : ('PHI_spec',), \
+               'phi_forcing': ('phi_forcing_spec',), \
+               'vrt_forcing': ('vrt_forcing_spec',), \
+               'div_forcing': ('div_forcing_spec',)}
+
+
+def spectral_fields(stepper):
+    """one output step of a spectral-only history (no transforms needed)"""
+    return {'VRT_spec': stepper.vrtspec, 'DIV_spec': stepper.divspec, 'PHI_spec': stepper.phispec}
+
+
+def spectral_forcing_fields(stepper):
+    #### phi_forcing_spec is the tendency, i.e. the forcing over K_T (K_T is kept in 'grid')
+    return {'phi_forcing_spec': stepper.phi_forcing_spec, \
+            'vrt_forcing_spec': stepper.f_vrt_forcing_spec, \
+            'div_forcing_spec': stepper.f_div_forcing_spec}
+
+
+class lazy_field(object):
+    """reader[key][time_index] synthesizes only the requested snapshots"""
+    def __init__(self, reader, key):
+        self.reader = reader
+        self.key    = key
+
+    def __len__(self):
+        return self.reader.ntimes(self.key)
+
+    @property
+    def shape(self):
+        return (len(self), self.reader.sp_harmonic.nlats, self.reader.sp_harmonic.nlons)
+
+    def __getitem__(self, index):
+        return self.reader.read(self.key, index)
+
+
+class spectral_history(object):
+    """
+    Reader for spatial_data.hdf5 written with only the prognostic spectra
+    (spectral_history=True in the run dictionary). Grid fields are made on
+    read, only for the time indices asked for:
+
+        data = spectral_history(path2+'spatial_data.hdf5')
+        U    = data['U'][-8:]            #### last day, (8, nlats, nlons)
+        PHI  = data.read('PHI', [0, 100])
+        T    = data['T_in_days']
+
+    Datasets that are in the file (grid fields of a full history, T_in_days,
+    lats, ...) are returned as they are, so the reader works for both kinds
+    of files. phi_T is H0(t) phi_T_unit.
+    """
+    def __init__(self, filename, sp_harmonic=None):
+        self.filename = filename
+        self.h5file   = h5py.File(filename, 'r')
+
+        if sp_harmonic is None and 'grid' in self.h5file:
+            grid        = self.h5file['grid']
+            sp_harmonic = swe_stepper.get_spharmt(int(grid['nlons'][()]), int(grid['nlats'][()]), int(grid['ntrunc'][()]), \
+                                                  float(grid['rsphere'][()]), gridtype="gaussian")
+        self.sp_harmonic = sp_harmonic
+        self.K_T         = float(self.h5file['grid/K_T'][()]) if 'grid/K_T' in self.h5file else 1.
+
+    def keys(self):
+        keys = set(self.h5file.keys())
+        keys.update(key for key, parts in SYNTHESIZED.items() if all(part in self.h5file for part in parts))
+        if 'H0' in self.h5file and 'phi_T_unit' in self.h5file:
+            keys.add('phi_T')
+        return sorted(keys)
+
+    def ntimes(self, key):
+        if key in self.h5file:
+            return self.h5file[key].shape[0]
+        if key == 'phi_T':
+            return self.h5file['H0'].shape[0]
+        return self.h5file[SYNTHESIZED[key][0]].shape[0]
+
+    def __getitem__(self, key):
+        if key in self.h5file:
+            item = self.h5file[key]
+            return item[()] if isinstance(item, h5py.Dataset) and item.ndim < 2 else item
+        if key in SYNTHESIZED or key == 'phi_T':
+            return lazy_field(self, key)
+        raise KeyError('%s is neither stored in nor synthesizable from %s'%(key, self.filename))
+
+    def rows(self, key, index):
+        #### h5py only takes strictly increasing index lists, so read each row once, in
+        #### order, and put them back (repeated and negative indices included)
+        if isinstance(index, (list, tuple, np.ndarray)):
+            nrows  = self.h5file[key].shape[0]
+            index  = np.asarray(index, dtype=np.int64)
+            if index.size and (index.min() < -nrows or index.max() >= nrows):
+                raise IndexError('index out of range for %s with %d rows'%(key, nrows))
+            unique, inverse = np.unique(index % max(nrows, 1), return_inverse=True)
+            return self.h5file[key][unique.tolist()][inverse.ravel()]
+        return self.h5file[key][index]
+
+    def read(self, key, index=slice(None)):
+        if key in self.h5file:
+            return self.rows(key, index)
+
+        if key == 'phi_T':
+            H0 = np.asarray(self.rows('H0', index), dtype=np.float64)
+            return H0[..., None, None]*self.h5file['phi_T_unit'][()]
+
+        if key not in SYNTHESIZED:
+            raise KeyError('%s is neither stored in nor synthesizable from %s'%(key, self.filename))
+        if self.sp_harmonic is None:
+            raise ValueError('%s has no grid information, pass sp_harmonic'%(self.filename))
+
+        single  = isinstance(index, (int, np.integer))
+        spectra = [np.atleast_2d(self.rows(part, index)) for part in SYNTHESIZED[key]]
+
+        if key in ['U', 'V']:
+            uv   = [self.sp_harmonic.getuv(vrt, div) for vrt, div in zip(*spectra)]
+            grid = np.array([x[0] if key == 'U' else x[1] for x in uv])
+        else:
+            grid = np.array([self.sp_harmonic.spectogrd(spec) for spec in spectra[0]])
+        if key == 'phi_forcing':
+            grid = grid*self.K_T
+        return grid[0] if single else grid
+
+    def close(self):
+        self.h5file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,147 @@
+import os
+import glob
+import json
+import shutil
+import hashlib
+import h5py
+import numpy as np
+
+import save_and_load_hdf5_files as h5saveload
+
+
+#### branch points of every sweep go here unless a directory is given
+LIBRARY_DIR = os.environ.get('SWE_STATE_LIBRARY', os.path.join(os.path.expanduser('~'), '.cache', 'swe_state_library'))
+
+#### input_file keys a fork has to agree on with the branch by default (the model itself)
+MODEL_KEYS  = ['nlons', 'nlats', 'ntrunc', 'rsphere', 'omega', 'grav', 'dt', 'Hmean', 'K_M', 'K_T']
+
+
+def json_config(config, keys=None):
+    """the scalar items of an input_file (or only keys), as they come back from the library"""
+    keys   = keys if keys is not None else config.keys()
+    config = {key: config.get(key, None) for key in keys}
+    config = {key: value for key, value in config.items() if value is None or np.ndim(value) == 0}
+    return json.loads(json.dumps(config, sort_keys=True, default=str))
+
+
+def config_key(config, keys=None):
+    """short hash of json_config, to tell apart branches of different settings with the same description"""
+    return hashlib.sha1(json.dumps(json_config(config, keys), sort_keys=True).encode()).hexdigest()[:10]
+
+
+class state_library(object):
+    """
+    Named branch points of runs: the full state of a SWE_stepper
+    (save_checkpoint: spectra, AB3 history, clock, grids, running budget
+    means, dt_control), the input_file it was run with and, optionally,
+    files that belong to it (e.g. the history written so far). A spin-up
+    that every member of a sweep shares is then run once, and the other
+    members start where it ended, with their own forcing or perturbation:
+
+        library = state_library('/data/.../branches/')
+        name    = 'basic state spun up for Hmean=500, H0=5000'
+        if not library.has(name):
+            spin_up.run(nsteps)
+            library.save(name, spin_up, attach={'history': history_file})
+        extra   = library.fork(name, stepper, perturbation={'vrtspec': vrt_perturbation})
+
+    fork() continues the branch's AB3 history and clock (so forcing and
+    H0_values go on from the branch time), or starts them again at t = 0
+    with restart_clock. The stepper has to be built with the same model;
+    load_checkpoint checks nlm and dt, fork() the check keys of the
+    input_file as well.
+
+    A branch is written to a temporary file and moved into place after
+    its attachments, so members of a parallel sweep that save the same
+    branch leave one complete copy, and has() never sees half a branch.
+    """
+    def __init__(self, directory=None):
+        self.directory = directory if directory is not None else LIBRARY_DIR
+        h5saveload.make_sure_path_exists(self.directory)
+
+    def path(self, name, label='branch'):
+        """file of the branch name (or of its attachment label)"""
+        slug = ''.join(x if (x.isalnum() or x in '.=-') else '_' for x in name).strip('_')[:80]
+        return os.path.join(self.directory, '%s_%s.%s.hdf5'%(slug, hashlib.sha1(name.encode()).hexdigest()[:8], label))
+
+    def has(self, name):
+        return os.path.exists(self.path(name))
+
+    def names(self):
+        return sorted(self.info(filename)['name'] for filename in glob.glob(os.path.join(self.directory, '*.branch.hdf5')))
+
+    def info(self, name):
+        """name, day, input_file config and attachments of a branch (name or its file), without the state"""
+        filename = name if name.endswith('.branch.hdf5') else self.path(name)
+        if not os.path.exists(filename):
+            raise ValueError('no branch %s in %s'%(name, self.directory))
+        with h5py.File(filename, 'r') as h5file:
+            branch = h5saveload.recursively_load_dict_contents_from_group(h5file, '/extra/branch/', False)
+        decode = lambda x: x.decode() if isinstance(x, bytes) else str(x)
+        return {'name': decode(branch['name']), 'day': float(branch['day']), \
+                'config': json.loads(decode(branch['config'])), \
+                'attachments': json.loads(decode(branch['attachments']))}
+
+    def save(self, name, stepper, extra=None, attach=None, config=None):
+        """
+        branch point name at the current state of stepper. extra: dict
+        stored with it (returned by fork), attach: {label: file} copied
+        into the library, config: input_file settings (default the
+        stepper's input_file)
+        """
+        attach = attach if attach is not None else {}
+        tmp    = '.tmp%d'%(os.getpid())
+        for label, filename in attach.items():
+            shutil.copyfile(filename, self.path(name, label)+tmp)
+            os.replace(self.path(name, label)+tmp, self.path(name, label))
+
+        config = json_config(config if config is not None else stepper.input_file)
+        branch = {'name': name, 'day': float(stepper.t/(24*3600)), 'config': json.dumps(config, sort_keys=True), \
+                  'attachments': json.dumps(sorted(attach))}
+        stepper.save_checkpoint(self.path(name)+tmp, {'branch': branch, 'extra': extra if extra is not None else {}})
+        os.replace(self.path(name)+tmp, self.path(name))
+
+    def fork(self, name, stepper, perturbation=None, restart_clock=False, check=MODEL_KEYS):
+        """
+        Put stepper at the branch point name and return the extra dict
+        saved with it.
+
+        perturbation  : dict with any of vrtspec, divspec, phispec, added to the state
+        restart_clock : t = 0 and a fresh AB3 start instead of the branch's clock
+        check         : input_file keys that have to be the same as at the branch
+        """
+        info     = self.info(name)
+        saved    = json_config(info['config'], check)
+        current  = json_config(stepper.input_file, check)
+        differ   = [key for key in check if key in info['config'] and saved[key] != current[key]]
+        if differ:
+            raise ValueError('branch %s was run with %s, not %s'%(name, \
+                             ', '.join('%s=%s'%(key, saved[key]) for key in differ), \
+                             ', '.join('%s=%s'%(key, current[key]) for key in differ)))
+
+        extra = stepper.load_checkpoint(self.path(name)).get('extra', {})
+        if perturbation is not None:
+            for key, value in perturbation.items():
+                if key not in ['vrtspec', 'divspec', 'phispec']:
+                    raise ValueError('perturbation of %s, only vrtspec, divspec and phispec can be perturbed'%(key))
+                getattr(stepper, key)[...] += value
+        if restart_clock:
+            stepper.ncycle, stepper.ab3_start, stepper.t_start = 0, 0, 0.
+        return extra
+
+    def attachment(self, name, label, copy_to=None):
+        """file attached to the branch as label, or a copy of it at copy_to (which the caller may change)"""
+        filename = self.path(name, label)
+        if label not in self.info(name)['attachments'] or not os.path.exists(filename):
+            raise ValueError('branch %s has no attachment %s'%(name, label))
+        if copy_to is None:
+            return filename
+        shutil.copyfile(filename, copy_to)
+        return copy_to
+
+    def remove(self, name):
+        attachments = self.info(name)['attachments']
+        os.remove(self.path(name))
+        for label in attachments:
+            if os.path.exists(self.path(name, label)):
+                os.remove(self.path(name, label))
@@ -0,0 +1,68 @@
+import time
+
+
+class null_timer(object):
+    """the default timer of SWE_stepper: does nothing"""
+
+    def lap(self, stage):
+        pass
+
+    def start(self):
+        pass
+
+    def step_done(self):
+        pass
+
+
+class stage_timer(object):
+    """
+    Wall time per stage of the time loop. Every lap(stage) adds the time
+    since the previous lap (or start) to stage, so laps are put at the end
+    of each stage:
+
+        timer = stage_timer()
+        stepper.timer = timer            #### laps inside tendencies() and step()
+        timer.start()
+        for ncycle in range(itmax):
+            history.append(...)
+            timer.lap('history_io')
+            stepper.step()
+            ...
+            if new_day:
+                logging_object.write('Calculated day %d | %s'%(day, timer.report()))
+
+    report() gives the totals since the last report and starts over.
+    """
+    def __init__(self):
+        self.totals = {}
+        self.steps  = 0
+        self.start()
+
+    def start(self):
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now  = time.perf_counter()
+        self.totals[stage] = self.totals.get(stage, 0.) + now - self.last
+        self.last = now
+
+    def step_done(self):
+        self.steps += 1
+
+    def summary(self):
+        """totals in seconds (plus 'total' and 'steps') since the last report"""
+        summary = dict(self.totals)
+        summary['total'] = sum(self.totals.values())
+        summary['steps'] = self.steps
+        return summary
+
+    def report(self):
+        """one line with the time per stage, longest first; resets the totals"""
+        total  = sum(self.totals.values())
+        stages = sorted(self.totals.items(), key=lambda x: x[1], reverse=True)
+        line   = 'total %1.2f s in %d steps: '%(total, self.steps) + \
+                 ', '.join('%s %1.2f s (%d%%)'%(stage, seconds, 100*seconds/total if total > 0 else 0) \
+                           for stage, seconds in stages)
+        self.totals = {}
+        self.steps  = 0
+        return line
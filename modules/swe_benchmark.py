@@ -0,0 +1,259 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+import numpy as np
+
+import swe_stepper as swe_stepper
+import swe_ensemble as swe_ensemble
+import forcing_engine as forcing_engine
+import save_and_load_hdf5_files as h5saveload
+
+
+#### nlons of the benchmarked resolutions (ntrunc = nlons/3, nlats = nlons/2 like the run scripts)
+RESOLUTIONS    = [128, 256, 512]
+
+#### one JSON record per benchmark run is appended here
+BENCHMARK_FILE = './swe_benchmark.jsonl'
+
+PHASES = ['grdtospec', 'spectogrd', 'getuv', 'getvrtdivspec', 'nonlinear_products', \
+          'forcing', 'diagnostics', 'output_append', 'step']
+
+
+def may16_input_file(nlons=256):
+    """
+    run dictionary of the May_16 transient forcing runs (Q0 = 10, Hmean = 200,
+    Hmax = 2500, dipole moving at 5 m/s), dt scaled with the resolution
+    (150 s at nlons = 256), and the storage profile the driver saves with
+    """
+    return {'nlons'  : nlons, 'ntrunc': int(nlons/3), 'nlats': int(nlons/2), \
+            'dt'     : int(150*256/nlons), \
+            'rsphere': 6.37122e6, 'omega': 7.292e-5, 'grav': 9.80616, \
+            'y0'     : 0, 'N': 2, 'Hmax': 2500, 'Hmean': 200, \
+            'Q0'     : 10, 'yp': 0, 'Ly': 10, 'FUo': 0, 'FVo': 0, \
+            'K_M'    : 20*24*3600, 'K_T': 10*24*3600, \
+            'forcing_phase_speed': 5, 'forcing_wave_number': 2, 'DIPOLE': True, \
+            'switch_on_day': 0, 'alpha': 25, 'storage_profile': 'exact'}
+
+
+def make_forcing(sp_harmonic, input_file):
+    return forcing_engine.propagating_heating(sp_harmonic, Q0=input_file['Q0'], yp=input_file['yp'], \
+                                              Ly=input_file['Ly'], c=input_file['forcing_phase_speed'], \
+                                              wave_number=input_file['forcing_wave_number'], \
+                                              DIPOLE=input_file['DIPOLE'], switch_on_day=input_file['switch_on_day'], \
+                                              alpha=input_file['alpha'], grav=input_file['grav'])
+
+
+def best_time(func, repeats=10):
+    """shortest wall time of repeats calls of func, in seconds"""
+    best = np.inf
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+
+def history_fields(stepper, sp_harmonic):
+    """the 3 hourly output of the May_16 driver"""
+    return {'U'  : stepper.ug,   'V'  : stepper.vg,   'PHI': stepper.phig, \
+            'vrt': stepper.vrtg, 'div': stepper.divg, \
+            'phi_T': np.max(stepper.H0)*stepper.phi_T_unit, 'phi_forcing': stepper.phi_forcing}
+
+
+def scalar_diagnostics(stepper):
+    return (np.max(stepper.ug.mean(axis=-1)), np.max(np.abs(stepper.phi_forcing)), \
+            np.max(np.abs(stepper.divg - stepper.divg.mean(axis=-1, keepdims=True))))
+
+
+def time_phases(sp_harmonic, input_file, repeats=10, work_dir='.'):
+    """
+    seconds per call of each phase of a time step (PHASES), on the state
+    after a few forced steps. 'step' is a whole SWE_stepper.step().
+    """
+    sp          = sp_harmonic
+    new_stepper = lambda: swe_stepper.SWE_stepper(input_file, H0_values=input_file['Hmax'], sp_harmonic=sp, \
+                                                  spectral_phi_forcing=make_forcing(sp, input_file))
+    stepper     = new_stepper()
+    stepper.run(3)
+    #### a stepper of its own for the diagnostics, whose lazy grids are reset on every call
+    probe       = new_stepper()
+    probe.run(3)
+
+    grids   = np.zeros((3,)+stepper.ug.shape)
+    specs   = np.zeros((3, sp.nlm), np.complex128)
+    ug, vg  = stepper.ug.copy(), stepper.vg.copy()
+
+    def analysis():
+        np.copyto(grids[0], stepper.phig)
+        sp.grdtospec(grids[0], out=specs[0])
+
+    def vector_analysis():
+        np.copyto(grids[1], ug)
+        np.copyto(grids[2], vg)
+        sp.getvrtdivspec(grids[1], grids[2], out=(specs[0], specs[1]))
+
+    def nonlinear_products():
+        #### the grid arithmetic of SWE_stepper.tendencies()
+        abs_vrt, flux_u, flux_v = stepper.work_grid
+        np.add(stepper.vrtg, stepper.f, out=abs_vrt)
+        np.multiply(ug, abs_vrt, out=flux_u)
+        np.multiply(vg, abs_vrt, out=flux_v)
+        np.multiply(ug, stepper.phig, out=flux_u)
+        np.multiply(vg, stepper.phig, out=flux_v)
+        np.multiply(ug, ug, out=flux_u)
+        np.multiply(vg, vg, out=flux_v)
+        flux_u += flux_v
+        flux_u *= 0.5
+
+    def diagnostics():
+        #### as on a save step after a new tendency call: divg and phi_forcing synthesized again
+        probe.divg        = None
+        probe.phi_forcing = None
+        probe.budget_terms()
+        scalar_diagnostics(probe)
+
+    history_file = os.path.join(work_dir, 'benchmark_history.hdf5')
+    history      = h5saveload.history_writer(history_file, profile=input_file.get('storage_profile', None))
+
+    seconds = {}
+    seconds['grdtospec']          = best_time(analysis, repeats)
+    seconds['spectogrd']          = best_time(lambda: sp.spectogrd(stepper.phispec, out=grids[0]), repeats)
+    seconds['getuv']              = best_time(lambda: sp.getuv(stepper.vrtspec, stepper.divspec, out=(grids[1], grids[2])), repeats)
+    seconds['getvrtdivspec']      = best_time(vector_analysis, repeats)
+    seconds['nonlinear_products'] = best_time(nonlinear_products, repeats)
+    seconds['forcing']            = best_time(lambda: stepper.spectral_phi_forcing(stepper.t), repeats)
+    seconds['diagnostics']        = best_time(diagnostics, repeats)
+    seconds['output_append']      = best_time(lambda: history.append(history_fields(stepper, sp)), repeats)
+    seconds['step']               = best_time(stepper.step, repeats)
+    history.close()
+    os.remove(history_file)
+    return seconds
+
+
+def end_to_end(sp_harmonic, input_file, steps=200, work_dir='.'):
+    """
+    a short forced integration like integrate_model of the May_16 driver:
+    H0 ramped up, the moving dipole, 3 hourly output streamed to disk (with
+    the input_file storage_profile) and the scalar diagnostics on output steps
+    """
+    sp         = sp_harmonic
+    dt         = input_file['dt']
+    save_every = max(1, int(3*3600/dt))
+    stepper    = swe_stepper.SWE_stepper(input_file, H0_values=np.linspace(0, input_file['Hmax'], steps), \
+                                         sp_harmonic=sp, spectral_phi_forcing=make_forcing(sp, input_file))
+    history_file = os.path.join(work_dir, 'benchmark_end_to_end.hdf5')
+
+    start_time = time.perf_counter()
+    with h5saveload.history_writer(history_file, profile=input_file.get('storage_profile', None)) as history:
+        for ncycle in range(steps):
+            stepper.step()
+            if ncycle % save_every == 0:
+                history.append(history_fields(stepper, sp))
+                scalar_diagnostics(stepper)
+    seconds = time.perf_counter() - start_time
+    os.remove(history_file)
+    return {'steps': steps, 'seconds': seconds, 'seconds_per_step': seconds/steps, \
+            'transforms_per_step': stepper.transforms_per_step}
+
+
+def ensemble_vs_single(sp_harmonic, input_file, nmembers=4, steps=20):
+    """
+    seconds per member and step of nmembers forced runs (Q0 and phase
+    speed differ) advanced as one SWE_ensemble, against the same members
+    run one after the other as SWE_steppers. speedup > 1 means the
+    ensemble is cheaper per member.
+    """
+    sp          = sp_harmonic
+    input_files = [dict(input_file, Q0=input_file['Q0']*(1+i), forcing_phase_speed=input_file['forcing_phase_speed']+5*i) \
+                   for i in range(nmembers)]
+
+    steppers = [swe_stepper.SWE_stepper(inp, H0_values=inp['Hmax'], sp_harmonic=sp, \
+                                        spectral_phi_forcing=make_forcing(sp, inp)) for inp in input_files]
+    start_time = time.perf_counter()
+    for stepper in steppers:
+        stepper.run(steps)
+    single = (time.perf_counter() - start_time)/(nmembers*steps)
+
+    ensemble = swe_ensemble.SWE_ensemble(input_files, H0_values=[inp['Hmax'] for inp in input_files], sp_harmonic=sp, \
+                                         spectral_phi_forcings=[make_forcing(sp, inp) for inp in input_files])
+    start_time = time.perf_counter()
+    ensemble.run(steps)
+    batched = (time.perf_counter() - start_time)/(nmembers*steps)
+    return {'nmembers': nmembers, 'steps': steps, 'single_seconds_per_member_step': single, \
+            'ensemble_seconds_per_member_step': batched, 'speedup': single/batched}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), \
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(resolutions=RESOLUTIONS, max_threads=None, repeats=10, end_to_end_steps=200,
+                   benchmark_file=BENCHMARK_FILE, logging_object=None, ensemble_members=4):
+    """
+    Time the phases of a step (time_phases), a short end-to-end run
+    (end_to_end) and an ensemble of ensemble_members against as many
+    single runs (ensemble_vs_single, skipped if 0) for every resolution
+    and shtns thread count of swe_stepper.thread_counts(max_threads), and
+    append the results as one JSON line to benchmark_file:
+
+        {"date", "host", "commit", "numpy", "python",
+         "results": [{"nlons", "nlats", "ntrunc", "dt", "nthreads", "grid_flag",
+                      "seconds": {phase: seconds per call}, "end_to_end": {...},
+                      "ensemble": {...}}, ...]}
+
+    Runs of different commits in the same file can be compared phase by phase.
+    """
+    record = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'host': platform.node(), 'commit': git_commit(), \
+              'numpy': np.__version__, 'python': platform.python_version(), 'results': []}
+    work_dir = tempfile.mkdtemp(prefix='swe_benchmark_')
+    try:
+        for nlons in resolutions:
+            input_file = may16_input_file(nlons)
+            for nthreads in swe_stepper.thread_counts(max_threads):
+                sp = swe_stepper.Spharmt(input_file['nlons'], input_file['nlats'], input_file['ntrunc'], \
+                                         input_file['rsphere'], gridtype="gaussian", nthreads=nthreads)
+                result = {'nlons': nlons, 'nlats': input_file['nlats'], 'ntrunc': input_file['ntrunc'], \
+                          'dt': input_file['dt'], 'nthreads': sp.nthreads, 'grid_flag': sp.grid_flag, \
+                          'seconds': time_phases(sp, input_file, repeats, work_dir), \
+                          'end_to_end': end_to_end(sp, input_file, end_to_end_steps, work_dir)}
+                if ensemble_members:
+                    result['ensemble'] = ensemble_vs_single(sp, input_file, ensemble_members)
+                record['results'].append(result)
+                if logging_object is not None:
+                    logging_object.write('benchmark nlons=%d nthreads=%s: step %1.2f ms, end to end %1.2f ms/step'%( \
+                                         nlons, sp.nthreads, 1e3*result['seconds']['step'], \
+                                         1e3*result['end_to_end']['seconds_per_step']))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(benchmark_file, 'a') as f:
+        f.write(json.dumps(record, sort_keys=True, default=str)+'\n')
+    return record
+
+
+def print_record(record):
+    print('%s  %s  commit %s'%(record['date'], record['host'], record['commit']))
+    print('%6s %8s '%('nlons', 'threads') + ' '.join('%19s'%(phase) for phase in PHASES) + '%19s'%('end_to_end') + \
+          '%19s'%('ensemble_speedup'))
+    for result in record['results']:
+        print('%6d %8s '%(result['nlons'], result['nthreads']) + \
+              ' '.join('%19.3f'%(1e3*result['seconds'][phase]) for phase in PHASES) + \
+              '%19.3f'%(1e3*result['end_to_end']['seconds_per_step']) + \
+              ('%19.2f'%(result['ensemble']['speedup']) if 'ensemble' in result else '%19s'%('-')))
+    print('(milliseconds per call, ensemble_speedup: single runs / ensemble time per member step)')
+
+
+if __name__ == "__main__":
+
+    #### python swe_benchmark.py [benchmark_file]
+    benchmark_file = sys.argv[1] if len(sys.argv) > 1 else BENCHMARK_FILE
+    print_record(run_benchmarks(benchmark_file=benchmark_file))
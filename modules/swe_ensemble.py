@@ -0,0 +1,187 @@
+import numpy as np
+
+import swe_stepper as swe_stepper
+
+
+#### these have to be the same for every member of an ensemble
+SHARED_KEYS = ['nlons', 'nlats', 'ntrunc', 'rsphere', 'omega', 'grav', 'dt', 'K_M', 'K_T', 'y0', 'N', \
+               'semi_implicit', 'hyperdiffusion', 'efold', 'ndiss', 'phi_T_type', 'phi_T_file', 'tune_transforms']
+
+
+class batched_Spharmt(object):
+    """
+    Spharmt with a leading member axis on every grid and spectral array.
+    out= buffers are filled member by member.
+
+    The shtns python interface transforms one field per call, so the
+    transforms loop over members; everything else in the ensemble step
+    (nonlinear products, damping, forcing, AB3 update) is one numpy call
+    on the stacked arrays. Arrays without the member axis (a single grid
+    or spectrum) are passed straight through.
+    """
+    def __init__(self, sp_harmonic):
+        self.sp_harmonic = sp_harmonic
+        for key in ['lats', 'lons', 'nlons', 'nlats', 'ntrunc', 'nlm', 'degree', 'm', 'lap', 'invlap', 'rsphere', 'counts']:
+            setattr(self, key, getattr(sp_harmonic, key))
+
+    def grdtospec(self, data, out=None):
+        """compute spectral coefficients from gridded data"""
+        if np.ndim(data) == 2:
+            return self.sp_harmonic.grdtospec(data, out)
+        if out is None:
+            return np.array([self.sp_harmonic.grdtospec(x) for x in data])
+        for x, x_out in zip(data, out):
+            self.sp_harmonic.grdtospec(x, x_out)
+        return out
+
+    def spectogrd(self, dataspec, out=None):
+        """compute gridded data from spectral coefficients"""
+        if np.ndim(dataspec) == 1:
+            return self.sp_harmonic.spectogrd(dataspec, out)
+        if out is None:
+            return np.array([self.sp_harmonic.spectogrd(x) for x in dataspec])
+        for x, x_out in zip(dataspec, out):
+            self.sp_harmonic.spectogrd(x, x_out)
+        return out
+
+    def getuv(self, vrtspec, divspec, out=None):
+        """compute wind vector from spectral coeffs of vorticity and divergence"""
+        if np.ndim(vrtspec) == 1:
+            return self.sp_harmonic.getuv(vrtspec, divspec, out)
+        if out is None:
+            uv = [self.sp_harmonic.getuv(vrt, div) for vrt, div in zip(vrtspec, divspec)]
+            return np.array([x[0] for x in uv]), np.array([x[1] for x in uv])
+        for vrt, div, u, v in zip(vrtspec, divspec, out[0], out[1]):
+            self.sp_harmonic.getuv(vrt, div, (u, v))
+        return out
+
+    def getvrtdivspec(self, u, v, out=None):
+        """compute spectral coeffs of vorticity and divergence from wind vector"""
+        if np.ndim(u) == 2:
+            return self.sp_harmonic.getvrtdivspec(u, v, out)
+        if out is None:
+            vd = [self.sp_harmonic.getvrtdivspec(uu, vv) for uu, vv in zip(u, v)]
+            return np.array([x[0] for x in vd]), np.array([x[1] for x in vd])
+        for uu, vv, vrt, div in zip(u, v, out[0], out[1]):
+            self.sp_harmonic.getvrtdivspec(uu, vv, (vrt, div))
+        return out
+
+    def getgrad(self, divspec):
+        """compute gradient vector from spectral coeffs"""
+        if np.ndim(divspec) == 1:
+            return self.sp_harmonic.getgrad(divspec)
+        uv = [self.sp_harmonic.getgrad(div) for div in divspec]
+        return np.array([x[0] for x in uv]), np.array([x[1] for x in uv])
+
+
+class SWE_ensemble(swe_stepper.SWE_stepper):
+    """
+    N members of the shallow water model advanced together, with every
+    spectral and grid array stacked along a leading member axis.
+
+    Members can differ in Hmean, the H0 ramp and the forcing (Q0, phase
+    speed, DIPOLE, alpha ...). Grid, time step and damping times must be
+    shared (SHARED_KEYS).
+
+    The transforms still run once per member (batched_Spharmt), so this
+    is a way to run and keep together a set of members, not a speed-up:
+    swe_benchmark.ensemble_vs_single measures it against single runs.
+
+    input_files    : list of run dictionaries, one per member
+    H0_values      : list with one H0 schedule (array or scalar) per member
+    phi_forcings   : list with one callable t -> grid (or None) per member
+    uv_forcings    : list with one callable t -> (fu, fv) (or None) per member
+    spectral_phi_forcings : list with one callable t -> spectrum (or None) per
+                     member (forcing_engine.spectral_forcing), used instead of
+                     phi_forcings
+    initial_states : list of initial state dicts (or None) per member
+
+    e.g.
+        ens = SWE_ensemble([input_file_Q0_10, input_file_Q0_50], \
+                           H0_values    = [H0_values, H0_values], \
+                           phi_forcings = [forcing_Q0_10, forcing_Q0_50])
+        ens.run(itmax)
+        ens.member(1)['phispec']
+    """
+
+    def __init__(self, input_files, H0_values=None, phi_forcings=None, uv_forcings=None,
+                 initial_states=None, sp_harmonic=None, budget_mean_every=None, spectral_phi_forcings=None):
+
+        nmembers = len(input_files)
+        for key in SHARED_KEYS:
+            values = [inp.get(key, None) for inp in input_files]
+            if any(value != values[0] for value in values):
+                raise ValueError('%s has to be the same for all members, got %s'%(key, values))
+
+        self.member_shape = (nmembers,)
+        self.input_files  = input_files
+
+        if sp_harmonic is None:
+            inp0        = input_files[0]
+            sp_harmonic = swe_stepper.get_spharmt(inp0['nlons'], inp0['nlats'], inp0['ntrunc'], \
+                                                  inp0['rsphere'], gridtype="gaussian", \
+                                                  tune=inp0.get('tune_transforms', False))
+        if not isinstance(sp_harmonic, batched_Spharmt):
+            sp_harmonic = batched_Spharmt(sp_harmonic)
+
+        if initial_states is not None:
+            initial_states = [state if state is not None else {} for state in initial_states]
+            nlm            = sp_harmonic.nlm
+            initial_state  = {key: [state.get(key, np.zeros(nlm, np.complex128)) for state in initial_states] \
+                              for key in ['vrtspec', 'divspec', 'phispec']}
+        else:
+            initial_state  = None
+
+        swe_stepper.SWE_stepper.__init__(self, input_files[0], initial_state=initial_state, \
+                                         sp_harmonic=sp_harmonic, budget_mean_every=budget_mean_every)
+
+        ######## per member parameters ########
+        self.Hmean       = np.array([inp['Hmean'] for inp in input_files], dtype=np.float64)
+        self.phi_B       = swe_stepper.phi_B(self.Hmean, self.grav)
+        self.H_ref       = np.array([inp.get('H_ref', inp['Hmean']) for inp in input_files], dtype=np.float64)
+        self.build_time_operators()
+
+        if H0_values is None:
+            H0_values    = [0.]*nmembers
+        self.H0_values   = H0_values
+
+        phi_forcings     = phi_forcings if phi_forcings is not None else [None]*nmembers
+        uv_forcings      = uv_forcings  if uv_forcings  is not None else [None]*nmembers
+        self.phi_forcing_funcs = phi_forcings
+        self.uv_forcing_funcs  = uv_forcings
+        self.phi_forcing_func  = self.stacked_phi_forcing if any(x is not None for x in phi_forcings) else None
+        self.uv_forcing_func   = self.stacked_uv_forcing  if any(x is not None for x in uv_forcings)  else None
+        if spectral_phi_forcings is not None and any(x is not None for x in spectral_phi_forcings):
+            self.spectral_phi_forcings = spectral_phi_forcings
+            self.spectral_phi_forcing  = self.stacked_spectral_phi_forcing
+
+    def member_grid(self, value):
+        return np.reshape(np.broadcast_to(value, self.member_shape), self.member_shape+(1, 1))
+
+    def member_spec(self, value):
+        return np.reshape(np.broadcast_to(value, self.member_shape), self.member_shape+(1,))
+
+    def current_H0(self, ncycle):
+        return np.array([H0 if np.ndim(H0) == 0 else H0[ncycle] for H0 in self.H0_values], dtype=np.float64)
+
+    def stacked_phi_forcing(self, t):
+        zeros = np.zeros(self.lats.shape)
+        return np.array([func(t) if func is not None else zeros for func in self.phi_forcing_funcs])
+
+    def stacked_spectral_phi_forcing(self, t):
+        zeros = np.zeros(self.sp_harmonic.nlm, np.complex128)
+        return np.array([func(t) if func is not None else zeros for func in self.spectral_phi_forcings])
+
+    def stacked_uv_forcing(self, t):
+        zeros  = np.zeros(self.lats.shape)
+        fu, fv = [], []
+        for func in self.uv_forcing_funcs:
+            fu_member, fv_member = func(t) if func is not None else (zeros, zeros)
+            fu.append(fu_member)
+            fv.append(fv_member)
+        return np.array(fu), np.array(fv)
+
+    def member(self, i):
+        """state of one member, same layout as SWE_stepper.state"""
+        return {'vrtspec': self.vrtspec[i].copy(), 'divspec': self.divspec[i].copy(), \
+                'phispec': self.phispec[i].copy(), 'ncycle': self.ncycle, 't': self.t}
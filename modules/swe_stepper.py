@@ -0,0 +1,849 @@
+import os
+import time
+import platform
+import numpy as np
+import shtns
+
+import save_and_load_hdf5_files as h5saveload
+import basic_state as basic_state
+import sweep_runner as sweep_runner
+import step_timers as step_timers
+
+
+TRANSFORMS = ['analysis', 'synthesis', 'vector_analysis', 'vector_synthesis']
+
+#### shtns grid/precompute modes tune_spharmt tries, the first is the default
+GRID_FLAGS = {'gaussian': ['sht_quick_init', 'sht_gauss', 'sht_gauss_fly'], \
+              'regular' : ['sht_reg_dct', 'sht_reg_fast']}
+
+#### tuned plans, one entry per machine and resolution
+PLAN_CACHE_FILE = os.environ.get('SWE_PLAN_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'swe_shtns_plans.json'))
+
+
+class Spharmt(object):
+    """
+    wrapper class for commonly used spectral transform operations in
+    atmospheric models.  Provides an interface to shtns compatible
+    with pyspharm (pyspharm.googlecode.com).
+    """
+    def __init__(self, nlons, nlats, ntrunc, rsphere, gridtype="gaussian", grid_flag=None, nthreads=None):
+        """initialize
+        nlons:  number of longitudes
+        nlats:  number of latitudes
+        grid_flag: name of the shtns grid flag (default GRID_FLAGS[gridtype][0])
+        nthreads:  OpenMP threads of the shtns plan (default_threads(): OMP_NUM_THREADS
+                   when the plan is built, e.g. threads_per_job of a sweep worker, or every core)"""
+        if gridtype not in GRID_FLAGS:
+            raise ValueError('gridtype has to be one of %s, got %s'%(list(GRID_FLAGS), gridtype))
+        if grid_flag is None:
+            grid_flag = GRID_FLAGS[gridtype][0]
+        #### always an explicit count: shtns' own default (0) is every core, also in a
+        #### forked worker whose OMP_NUM_THREADS was set after OpenMP was loaded
+        nthreads    = nthreads or default_threads()
+        self._shtns = shtns.sht(ntrunc, ntrunc, 1,
+                                shtns.sht_orthonormal+shtns.SHT_NO_CS_PHASE, nthreads)
+        self._shtns.set_grid(nlats, nlons,
+                getattr(shtns, grid_flag) | shtns.SHT_PHI_CONTIGUOUS, 1.e-10)
+        self.gridtype  = gridtype
+        self.grid_flag = grid_flag
+        self.nthreads  = nthreads
+
+        self.lats = np.arcsin(self._shtns.cos_theta)
+        self.lons = (2.*np.pi/nlons)*np.arange(nlons)
+        self.nlons = nlons
+        self.nlats = nlats
+        self.ntrunc = ntrunc
+        self.nlm = self._shtns.nlm
+        self.degree = self._shtns.l
+        self.m      = self._shtns.m
+        self.lap    = -self.degree*(self.degree+1.0).astype(np.complex128)
+        self.invlap = np.zeros(self.lap.shape, self.lap.dtype)
+        self.invlap[1:] = 1./self.lap[1:]
+        self.rsphere = rsphere
+        self.lap     = self.lap/rsphere**2
+        self.invlap  = self.invlap*rsphere**2
+        self.invlap_r = self.invlap/rsphere
+        self.lap_r    = self.lap*rsphere
+        #### number of transforms done so far (vector ones cost about two scalar ones)
+        self.counts  = {key: 0 for key in TRANSFORMS}
+        #### scratch spectra of getuv(..., out=)
+        self.work_spec = np.zeros((2, self.nlm), np.complex128)
+
+    #### With out= the result is written into preallocated C contiguous
+    #### arrays (the in-place shtns calls) and nothing is allocated; the
+    #### input of an analysis should then be a scratch array.
+
+    def grdtospec(self, data, out=None):
+        """compute spectral coefficients from gridded data"""
+        self.counts['analysis'] += 1
+        if out is None:
+            return self._shtns.analys(data)
+        self._shtns.spat_to_SH(data, out)
+        return out
+
+    def spectogrd(self, dataspec, out=None):
+        """compute gridded data from spectral coefficients"""
+        self.counts['synthesis'] += 1
+        if out is None:
+            return self._shtns.synth(dataspec)
+        self._shtns.SH_to_spat(dataspec, out)
+        return out
+
+    def getuv(self, vrtspec, divspec, out=None):
+        """compute wind vector from spectral coeffs of vorticity and divergence"""
+        self.counts['vector_synthesis'] += 1
+        if out is None:
+            return self._shtns.synth(self.invlap_r*vrtspec, self.invlap_r*divspec)
+        np.multiply(self.invlap_r, vrtspec, out=self.work_spec[0])
+        np.multiply(self.invlap_r, divspec, out=self.work_spec[1])
+        self._shtns.SHsphtor_to_spat(self.work_spec[0], self.work_spec[1], out[0], out[1])
+        return out
+
+    def getvrtdivspec(self, u, v, out=None):
+        """compute spectral coeffs of vorticity and divergence from wind vector"""
+        self.counts['vector_analysis'] += 1
+        if out is None:
+            vrtspec, divspec = self._shtns.analys(u, v)
+            return self.lap_r*vrtspec, self.lap_r*divspec
+        vrtspec, divspec = out
+        self._shtns.spat_to_SHsphtor(u, v, vrtspec, divspec)
+        vrtspec *= self.lap_r
+        divspec *= self.lap_r
+        return out
+
+    def getgrad(self, divspec):
+        """compute gradient vector from spectral coeffs"""
+        self.counts['vector_synthesis'] += 1
+        vrtspec = np.zeros(divspec.shape, dtype=np.complex128)
+        u, v = self._shtns.synth(vrtspec, divspec)
+        return u/self.rsphere, v/self.rsphere
+
+
+######## transform plans ########
+
+#### Spharmt instances of this process, see get_spharmt
+_spharmt_instances = {}
+
+
+def time_transforms(sp_harmonic, repeats=5):
+    """
+    best wall time of the transforms of one model step (1 analysis,
+    2 syntheses, 2 vector analyses, 1 vector synthesis), done with out=
+    like SWE_stepper does
+    """
+    sp     = sp_harmonic
+    grids  = np.zeros((3, sp.nlats, sp.nlons))
+    specs  = np.zeros((3, sp.nlm), np.complex128)
+    spec   = sp.grdtospec(np.random.RandomState(0).standard_normal((sp.nlats, sp.nlons)))
+    best   = np.inf
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        sp.spectogrd(spec, out=grids[0])
+        sp.getuv(spec, spec, out=(grids[1], grids[2]))
+        sp.spectogrd(spec, out=grids[0])
+        sp.getvrtdivspec(grids[1], grids[2], out=(specs[0], specs[1]))
+        sp.getvrtdivspec(grids[1], grids[2], out=(specs[0], specs[1]))
+        sp.grdtospec(grids[0], out=specs[2])
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+
+def default_threads():
+    """threads of a plan built without nthreads: OMP_NUM_THREADS (as it is now) or the available cores"""
+    return int(os.environ.get('OMP_NUM_THREADS', 0)) or sweep_runner.available_cores()
+
+
+def thread_counts(max_threads=None):
+    """1, 2, 4, ... up to max_threads (default OMP_NUM_THREADS or the available cores)"""
+    if max_threads is None:
+        max_threads = default_threads()
+    counts = [1]
+    while counts[-1]*2 <= max_threads:
+        counts.append(counts[-1]*2)
+    if counts[-1] != max_threads:
+        counts.append(max_threads)
+    return counts
+
+
+def tune_spharmt(nlons, nlats, ntrunc, rsphere, gridtype="gaussian", max_threads=None, repeats=5):
+    """
+    Time every grid flag of GRID_FLAGS[gridtype] with every thread count
+    of thread_counts(max_threads) and return the plan with the fastest
+    step transforms: {'grid_flag', 'nthreads', 'step_time', 'init_time',
+    'timings'}, times in seconds.
+    """
+    timings = []
+    for grid_flag in GRID_FLAGS[gridtype]:
+        if not hasattr(shtns, grid_flag):
+            continue
+        for nthreads in thread_counts(max_threads):
+            start_time  = time.perf_counter()
+            sp_harmonic = Spharmt(nlons, nlats, ntrunc, rsphere, gridtype, grid_flag, nthreads)
+            init_time   = time.perf_counter() - start_time
+            timings.append({'grid_flag': grid_flag, 'nthreads': nthreads, 'init_time': init_time, \
+                            'step_time': time_transforms(sp_harmonic, repeats)})
+
+    plan = dict(min(timings, key=lambda x: x['step_time']))
+    plan['timings'] = timings
+    return plan
+
+
+def plan_key(nlons, nlats, ntrunc, gridtype="gaussian", max_threads=None):
+    threads = thread_counts(max_threads)[-1]
+    return '%s %s %dx%d T%d %s threads'%(platform.node(), gridtype, nlons, nlats, ntrunc, threads)
+
+
+def cached_plan(nlons, nlats, ntrunc, rsphere, gridtype="gaussian", cache_file=None, max_threads=None):
+    """the tuned plan of this machine and resolution, tuned and added to cache_file if it is not there yet"""
+    cache_file = cache_file if cache_file is not None else PLAN_CACHE_FILE
+    key        = plan_key(nlons, nlats, ntrunc, gridtype, max_threads)
+    plans      = sweep_runner.load_state(cache_file)
+    if key not in plans:
+        plans[key] = tune_spharmt(nlons, nlats, ntrunc, rsphere, gridtype, max_threads)
+        if os.path.dirname(cache_file):
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        #### other processes may have added plans meanwhile
+        plans = dict(sweep_runner.load_state(cache_file), **{key: plans[key]})
+        sweep_runner.save_state(plans, cache_file)
+    return plans[key]
+
+
+def get_spharmt(nlons, nlats, ntrunc, rsphere, gridtype="gaussian", tune=False, cache_file=None):
+    """
+    Spharmt shared by every caller of this process with the same
+    arguments, so a sweep worker builds the shtns plan of a resolution
+    only once. With tune=True the grid flag and the thread count are the
+    fastest ones of this machine (cached_plan; the first call for a
+    resolution times them, later calls and processes read the cache).
+    """
+    key = (nlons, nlats, ntrunc, rsphere, gridtype, tune)
+    if key not in _spharmt_instances:
+        plan = cached_plan(nlons, nlats, ntrunc, rsphere, gridtype, cache_file) if tune else {}
+        _spharmt_instances[key] = Spharmt(nlons, nlats, ntrunc, rsphere, gridtype, \
+                                          plan.get('grid_flag'), plan.get('nthreads'))
+    return _spharmt_instances[key]
+
+
+######## changing the truncation ########
+
+def spectral_index_map(sp_from, sp_to):
+    """position in sp_to of every (l, m) coefficient of sp_from (sp_from.ntrunc <= sp_to.ntrunc)"""
+    if sp_from.ntrunc > sp_to.ntrunc:
+        raise ValueError('T%d coefficients do not all exist at T%d'%(sp_from.ntrunc, sp_to.ntrunc))
+    size    = sp_to.ntrunc+1
+    keys_to = sp_to.degree*size + sp_to.m
+    order   = np.argsort(keys_to)
+    return order[np.searchsorted(keys_to[order], sp_from.degree*size + sp_from.m)]
+
+
+def regrid_spectrum(spec, sp_from, sp_to):
+    """
+    spectra (last axis over the sp_from coefficients) at the truncation of
+    sp_to: zero padded going up, truncated going down. The coefficients
+    are orthonormal, so they are the same at any truncation.
+    """
+    spec = np.asarray(spec)
+    if sp_from.ntrunc <= sp_to.ntrunc:
+        out = np.zeros(spec.shape[:-1]+(sp_to.nlm,), np.complex128)
+        out[..., spectral_index_map(sp_from, sp_to)] = spec
+        return out
+    return spec[..., spectral_index_map(sp_to, sp_from)]
+
+
+phi_T = basic_state.phi_T
+
+
+def phi_B(Hmean, grav=9.80616):
+    phi = grav*Hmean
+    return phi
+
+
+#### third-order Adams-Bashforth weights for the (nnew, nnow, nold) tendencies
+AB3_coeffs = (23./12., -16./12., 5./12.)
+
+#### names of the budget terms, same as the lists in the run scripts
+BUDGET_TERMS = ['VRT_term1', 'VRT_term1a', 'VRT_term1b', 'VRT_term2', \
+                'DIV_term1', 'DIV_term1a', 'DIV_term1b', 'DIV_term2', 'DIV_term3', 'DIV_term4', 'DIV_term5', \
+                'PHI_term1', 'PHI_term1a', 'PHI_term1b', 'PHI_term2', 'PHI_term3']
+
+
+class running_mean(object):
+    """running time mean of a dictionary of arrays"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean  = {}
+
+    def add(self, fields):
+        self.count += 1
+        for key, item in fields.items():
+            if key not in self.mean:
+                self.mean[key]  = np.array(item, dtype=np.float64)
+            else:
+                self.mean[key] += (item - self.mean[key])/self.count
+
+
+class SWE_stepper(object):
+    """
+    Forced, damped nonlinear shallow water model on the sphere (vorticity,
+    divergence, geopotential form) advanced with third-order Adams-Bashforth.
+
+    Everything that does not change in time (spherical harmonic instance,
+    grid, coriolis parameter, phi_B, phi_T pattern, inverse damping times,
+    AB3 weights) is built once here, so that step() only does the work
+    that actually depends on the model state.
+
+    input_file     : the usual run dictionary (nlons, nlats, ntrunc, rsphere,
+                     omega, grav, dt, Hmean, K_M, K_T, y0, N)
+    H0_values      : phi_T amplitude for every time step (indexed by ncycle).
+                     A scalar is held fixed; None means no phi_T.
+    phi_forcing    : callable t -> geopotential forcing on the grid. It is
+                     divided by K_T, like in the run scripts.
+    uv_forcing     : callable t -> (fu, fv) momentum forcing on the grid
+    spectral_phi_forcing : callable t -> spectrum of the geopotential forcing
+                     (e.g. forcing_engine.spectral_forcing), used instead of
+                     phi_forcing without any transform per step. The grid
+                     self.phi_forcing is then only synthesized when asked for.
+    spectral_uv_forcing  : callable t -> (vrt, div) spectra of the momentum forcing
+    initial_state  : dict with vrtspec, divspec, phispec (default: rest, phi=0)
+    phi_T_provider : basic_state.phi_T_provider of the imposed phi_T per metre
+                     of H0 (default from input_file['phi_T_type'], symmetric)
+    budget_mean_every : if set, the budget terms are accumulated into
+                     self.budget_mean every so many steps. Otherwise they
+                     are only evaluated when budget_terms() is called.
+
+    The grids (ug, vg, phig, vrtg), the spectra of the latest tendency
+    evaluation and the AB3 tendencies, a (3, nlm) ring buffer indexed by
+    nnew/nnow/nold, are allocated once and overwritten in place by every
+    step; copy them to keep them.
+
+    tune_transforms: build the default sp_harmonic with the tuned shtns plan
+                     of the machine (get_spharmt)
+
+    Optional input_file keys for the time scheme:
+    semi_implicit  : treat the gravity wave terms (-lap(phi) in the divergence
+                     equation, -phi_ref*div in the phi equation) with
+                     Crank-Nicolson and everything else with AB3 (AB3-CN).
+                     Solved per total wavenumber, so it costs nothing extra
+                     and removes the sqrt(g*Hmean) limit on dt.
+    H_ref          : reference depth of the implicit terms (default Hmean)
+    hyperdiffusion : damp vrt and div with exp(-dt/efold*(l(l+1)/L(L+1))**(ndiss/2))
+                     every step (the hyperdiff_fact of the run scripts)
+    efold, ndiss   : e-folding time of the smallest scale and the order
+                     (default 3 hours and 8)
+
+    dt can be changed during a run with set_dt() (see cfl_control); the
+    clock t then no longer is ncycle*dt, and H0_values stays indexed in
+    steps of the input_file dt (step_index).
+    """
+
+    #### leading axes of every spectral and grid array (see swe_ensemble)
+    member_shape = ()
+
+    #### set to a step_timers.stage_timer to time the stages of a step
+    timer        = step_timers.null_timer()
+
+    #### set to a cfl_control.cfl_controller to adapt dt after every step
+    dt_control   = None
+
+    def __init__(self, input_file, H0_values=None, phi_forcing=None, uv_forcing=None,
+                 initial_state=None, sp_harmonic=None, budget_mean_every=None,
+                 spectral_phi_forcing=None, spectral_uv_forcing=None, phi_T_provider=None):
+
+        self.input_file  = input_file
+        self.dt          = input_file['dt']
+        self.base_dt     = input_file['dt']
+        self.grav        = input_file['grav']
+        self.Hmean       = input_file['Hmean']
+
+        # setup up spherical harmonic instance, set lats/lons of grid
+        if sp_harmonic is None:
+            sp_harmonic  = get_spharmt(input_file['nlons'], input_file['nlats'], input_file['ntrunc'], \
+                                       input_file['rsphere'], gridtype="gaussian", \
+                                       tune=input_file.get('tune_transforms', False))
+        self.sp_harmonic = sp_harmonic
+        self.lons, self.lats = np.meshgrid(sp_harmonic.lons, sp_harmonic.lats)
+
+        ######## time invariant arrays ########
+        self.f           = 2.*input_file['omega']*np.sin(self.lats)   # coriolis
+        self.phi_B       = phi_B(self.Hmean, self.grav)
+        self.inv_K_M     = 1./input_file['K_M']
+        self.inv_K_T     = 1./input_file['K_T']
+
+        #### phi_T is linear in H0: pattern, spectrum and laplacian are made once
+        if phi_T_provider is None:
+            phi_T_provider   = basic_state.from_input_file(sp_harmonic, input_file)
+        self.phi_T_provider      = phi_T_provider
+        self.phi_T_unit          = phi_T_provider.unit
+        self.phi_T_unit_spec     = phi_T_provider.unit_spec
+        self.lap_phi_T_unit_grid = phi_T_provider.lap_unit_grid
+        #### spectrum of a constant 1 (only the l=0 coefficient), for phi - phi_B in spectral space
+        self.one_spec    = sp_harmonic.grdtospec(np.ones(self.lats.shape))
+
+        self.semi_implicit  = input_file.get('semi_implicit', False)
+        self.hyperdiffusion = input_file.get('hyperdiffusion', False)
+        self.H_ref          = input_file.get('H_ref', self.Hmean)
+        self.build_time_operators()
+
+        if H0_values is None:
+            H0_values    = 0.
+        self.H0_values   = H0_values
+        self.phi_forcing_func = phi_forcing
+        self.uv_forcing_func  = uv_forcing
+        self.spectral_phi_forcing = spectral_phi_forcing
+        self.spectral_uv_forcing  = spectral_uv_forcing
+        self.budget_mean_every = budget_mean_every
+        self.budget_mean       = running_mean()
+        self.checkpoint_file   = None
+        self.checkpoint_every  = None
+        self.checkpoint_extra  = None
+
+        ######## prognostic spectral state ########
+        nlm        = sp_harmonic.nlm
+        spec_shape = self.member_shape + (nlm,)
+        grid_shape = self.member_shape + (sp_harmonic.nlats, sp_harmonic.nlons)
+        if initial_state is None:
+            self.vrtspec = np.zeros(spec_shape, np.complex128)
+            self.divspec = np.zeros(spec_shape, np.complex128)
+            self.phispec = np.zeros(spec_shape, np.complex128)
+        else:
+            self.vrtspec = np.array(initial_state['vrtspec'], dtype=np.complex128)
+            self.divspec = np.array(initial_state['divspec'], dtype=np.complex128)
+            self.phispec = np.array(initial_state['phispec'], dtype=np.complex128)
+
+        #### AB3 tendencies, dspec[nnew] is one contiguous spectrum
+        self.dvrtdtspec  = np.zeros((3,)+spec_shape, np.complex128)
+        self.ddivdtspec  = np.zeros((3,)+spec_shape, np.complex128)
+        self.dphidtspec  = np.zeros((3,)+spec_shape, np.complex128)
+        self.nnew, self.nnow, self.nold = 0, 1, 2
+        self.ncycle      = 0
+        #### step and time of the last (re)start of AB3, i.e. of the last change of dt
+        self.ab3_start   = 0
+        self.t_start     = 0.
+
+        ######## fields of the latest tendency evaluation (buffers) ########
+        self.ug, self.vg, self.phig, self.vrtg = np.zeros((4,)+grid_shape, np.float64)
+        self.divg        = np.zeros(grid_shape, np.float64)
+        self.divspec_tendency, self.phispec_tendency, self.KE_spec, self.KE_plus_phi_spec, \
+        self.curl_NL_spec, self.div_NL_spec, self.curl_uvphi_NL_spec, self.div_uvphi_NL_spec, \
+        self.phi_forcing_spec = np.zeros((9,)+spec_shape, np.complex128)
+        self.f_vrt_forcing_spec, self.f_div_forcing_spec = np.zeros((2,)+spec_shape, np.complex128)
+        self.phi_forcing = np.zeros(grid_shape, np.float64)
+        self.transforms_per_step = {key: 0 for key in TRANSFORMS}
+        self.active_terms        = None   #### built by the first tendencies() call
+        self.H0          = 0.
+
+        ######## scratch arrays of tendencies() and step() ########
+        self.work_grid   = np.zeros((3,)+grid_shape, np.float64)
+        self.work_spec   = np.zeros((3,)+spec_shape, np.complex128)
+
+    def build_active_terms(self):
+        """
+        Decide once which optional tendency terms this run has, from the
+        arguments and the run dictionary: a forcing with Q0 = 0 or
+        FUo = FVo = 0, or an H0 schedule that is zero throughout, only adds
+        zeros, so tendencies() skips it. Done at the first tendency call;
+        call it again after changing forcings or H0_values later on.
+        """
+        input_files = self.input_files if self.member_shape else [self.input_file]
+        H0_values   = self.H0_values   if self.member_shape else [self.H0_values]
+
+        def nonzero(key):
+            #### a key that is not there could be anything, so it counts as active
+            return any(inp.get(key, 1) != 0 for inp in input_files)
+
+        active = set()
+        if any(np.any(np.asarray(H0) != 0) for H0 in H0_values):
+            active.add('phi_T')
+        if (self.spectral_phi_forcing is not None or self.phi_forcing_func is not None) and nonzero('Q0'):
+            active.add('phi_forcing')
+        if (self.spectral_uv_forcing is not None or self.uv_forcing_func is not None) and \
+           (nonzero('FUo') or nonzero('FVo')):
+            active.add('uv_forcing')
+        self.active_terms = active
+
+    def build_time_operators(self):
+        """everything that depends on dt; called again if dt or H_ref change"""
+        sp = self.sp_harmonic
+        self.ab3_new, self.ab3_now, self.ab3_old = [self.dt*c for c in AB3_coeffs]
+
+        if self.semi_implicit:
+            self.half_dt     = 0.5*self.dt
+            self.minus_lap   = -sp.lap.real
+            self.phi_ref     = self.member_spec(phi_B(self.H_ref, self.grav))
+            self.si_inv      = 1./(1. + self.half_dt**2*self.minus_lap*self.phi_ref)
+            self.half_dt_minus_lap = self.half_dt*self.minus_lap
+            self.half_dt_phi_ref   = self.half_dt*self.phi_ref
+
+        if self.hyperdiffusion:
+            efold = self.input_file.get('efold', 3.*3600.)
+            ndiss = self.input_file.get('ndiss', 8)
+            self.hyperdiff_fact = np.exp((-self.dt/efold)*(sp.lap.real/sp.lap.real[-1])**(ndiss/2))
+
+    def set_dt(self, dt):
+        """
+        continue with time step dt: the dt operators are rebuilt and AB3
+        restarts (forward Euler, AB2, then AB3) from the current state,
+        since the stored tendencies are not dt apart any more
+        """
+        self.t_start   = self.t
+        self.ab3_start = self.ncycle
+        self.dt        = dt
+        self.build_time_operators()
+
+    @property
+    def t(self):
+        return self.t_start + (self.ncycle - self.ab3_start)*self.dt
+
+    @property
+    def step_index(self):
+        """index of H0_values at t (steps of the input_file dt, ncycle if dt never changed)"""
+        return int(self.t//self.base_dt)
+
+    @property
+    def state(self):
+        """copy of the prognostic spectral state and the model clock"""
+        return {'vrtspec': self.vrtspec.copy(), 'divspec': self.divspec.copy(), \
+                'phispec': self.phispec.copy(), 'ncycle': self.ncycle, 't': self.t}
+
+    def current_H0(self, ncycle):
+        if np.ndim(self.H0_values) == 0:
+            return self.H0_values
+        return self.H0_values[ncycle]
+
+    @property
+    def divg(self):
+        """divergence on the grid of the latest tendency evaluation (not needed by the step itself)"""
+        if self._divg is None:
+            self._divg = self.sp_harmonic.spectogrd(self.divspec_tendency)
+        return self._divg
+
+    @divg.setter
+    def divg(self, value):
+        self._divg = value
+
+    @property
+    def phi_forcing(self):
+        """geopotential forcing on the grid of the latest tendency evaluation"""
+        if self._phi_forcing is None:
+            self._phi_forcing = self.sp_harmonic.spectogrd(self.phi_forcing_spec/self.inv_K_T)
+        return self._phi_forcing
+
+    @phi_forcing.setter
+    def phi_forcing(self, value):
+        self._phi_forcing = value
+
+    def member_grid(self, value):
+        """broadcast a scalar parameter against grid arrays"""
+        return value
+
+    def member_spec(self, value):
+        """broadcast a scalar parameter against spectral arrays"""
+        return value
+
+    def tendencies(self):
+        """fill the nnew slot of the tendency arrays from the current state"""
+        if self.active_terms is None:
+            self.build_active_terms()
+        sp   = self.sp_harmonic
+        t    = self.t
+        dvrt, ddiv, dphi = self.dvrtdtspec[self.nnew], self.ddivdtspec[self.nnew], self.dphidtspec[self.nnew]
+        abs_vrt, flux_u, flux_v = self.work_grid
+        tmp  = self.work_spec[0]
+        timer = self.timer
+
+        # get vort, u, v, phi on grid (div only when it is asked for)
+        np.copyto(self.divspec_tendency, self.divspec)
+        np.copyto(self.phispec_tendency, self.phispec)
+        self.divg        = None
+        sp.spectogrd(self.vrtspec, out=self.vrtg)
+        sp.getuv(self.vrtspec, self.divspec, out=(self.ug, self.vg))
+        sp.spectogrd(self.phispec, out=self.phig)
+        ug, vg, phig     = self.ug, self.vg, self.phig
+        self.H0          = self.current_H0(self.step_index) if 'phi_T' in self.active_terms else 0.
+        timer.lap('transforms')
+
+        # compute tendencies.
+        np.add(self.vrtg, self.f, out=abs_vrt)
+        np.multiply(ug, abs_vrt, out=flux_u)
+        np.multiply(vg, abs_vrt, out=flux_v)
+        timer.lap('nonlinear_products')
+        sp.getvrtdivspec(flux_u, flux_v, out=(self.curl_NL_spec, self.div_NL_spec))
+        timer.lap('transforms')
+        np.copyto(ddiv, self.curl_NL_spec)
+        np.negative(self.div_NL_spec, out=dvrt)
+
+        np.multiply(ug, phig, out=flux_u)
+        np.multiply(vg, phig, out=flux_v)
+        timer.lap('nonlinear_products')
+        sp.getvrtdivspec(flux_u, flux_v, out=(self.curl_uvphi_NL_spec, self.div_uvphi_NL_spec))
+        timer.lap('transforms')
+        np.negative(self.div_uvphi_NL_spec, out=dphi)
+        #### phi and phi_T are already spectral, only KE has to be analysed
+        np.multiply(ug, ug, out=flux_u)
+        np.multiply(vg, vg, out=flux_v)
+        flux_u += flux_v
+        flux_u *= 0.5
+        timer.lap('nonlinear_products')
+        sp.grdtospec(flux_u, out=self.KE_spec)
+        timer.lap('transforms')
+        np.add(self.phispec_tendency, self.KE_spec, out=self.KE_plus_phi_spec)
+        if 'phi_T' in self.active_terms:
+            np.multiply(self.member_spec(self.H0), self.phi_T_unit_spec, out=tmp)
+            self.KE_plus_phi_spec += tmp
+        np.multiply(sp.lap, self.KE_plus_phi_spec, out=tmp)
+        ddiv -= tmp
+
+        #### Diffusion term, on the spectra (phi_B only sits in the l=0 coefficient) ####
+        np.multiply(self.vrtspec, self.inv_K_M, out=tmp)
+        dvrt -= tmp
+        np.multiply(self.divspec, self.inv_K_M, out=tmp)
+        ddiv -= tmp
+        np.multiply(self.phispec, self.inv_K_T, out=tmp)
+        dphi -= tmp
+        dphi[..., :1] += self.member_spec(self.phi_B)*(self.one_spec[0]*self.inv_K_T)
+        timer.lap('tendencies')
+
+        ##### EXTERNAL FORCING (only the ones in active_terms) ######
+        if 'phi_forcing' in self.active_terms:
+            if self.spectral_phi_forcing is not None:
+                self.phi_forcing  = None
+                np.multiply(self.spectral_phi_forcing(t), self.inv_K_T, out=self.phi_forcing_spec)
+            else:
+                self.phi_forcing  = self.phi_forcing_func(t)
+                np.multiply(sp.grdtospec(self.phi_forcing), self.inv_K_T, out=self.phi_forcing_spec)
+            dphi += self.phi_forcing_spec
+
+        if 'uv_forcing' in self.active_terms:
+            if self.spectral_uv_forcing is not None:
+                self.f_vrt_forcing_spec, self.f_div_forcing_spec = self.spectral_uv_forcing(t)
+            else:
+                fu_forcing, fv_forcing = self.uv_forcing_func(t)
+                self.f_vrt_forcing_spec, self.f_div_forcing_spec = sp.getvrtdivspec(fu_forcing, fv_forcing)
+            dvrt += self.f_vrt_forcing_spec
+            ddiv += self.f_div_forcing_spec
+        timer.lap('forcing')
+
+        #### the gravity wave terms are added back implicitly in step()
+        if self.semi_implicit:
+            np.multiply(self.minus_lap, self.phispec, out=tmp)
+            ddiv -= tmp
+            np.multiply(self.phi_ref, self.divspec, out=tmp)
+            dphi += tmp
+            timer.lap('tendencies')
+
+    def ab3_increment(self, dspec, out, tmp):
+        """dt*(23 dspec[nnew] - 16 dspec[nnow] + 5 dspec[nold])/12 into out, without temporaries"""
+        np.multiply(dspec[self.nnew], self.ab3_new, out=out)
+        np.multiply(dspec[self.nnow], self.ab3_now, out=tmp)
+        out += tmp
+        np.multiply(dspec[self.nold], self.ab3_old, out=tmp)
+        out += tmp
+        return out
+
+    def step(self):
+        """advance the model by one time step"""
+        counts_before = dict(self.sp_harmonic.counts)
+        self.tendencies()
+        self.transforms_per_step = {key: self.sp_harmonic.counts[key] - counts_before[key] for key in TRANSFORMS}
+
+        nnew, nnow, nold = self.nnew, self.nnow, self.nold
+        # forward euler, then 2nd-order adams-bashforth time steps to start.
+        if self.ncycle == self.ab3_start:
+            for dspec in (self.dvrtdtspec, self.ddivdtspec, self.dphidtspec):
+                dspec[nnow] = dspec[nnew]
+                dspec[nold] = dspec[nnew]
+        elif self.ncycle == self.ab3_start + 1:
+            for dspec in (self.dvrtdtspec, self.ddivdtspec, self.dphidtspec):
+                dspec[nold] = dspec[nnew]
+
+        # update vort, div, phiv with third-order adams-bashforth.
+        ddiv, dphi, tmp = self.work_spec
+        self.vrtspec += self.ab3_increment(self.dvrtdtspec, ddiv, tmp)
+        self.ab3_increment(self.ddivdtspec, ddiv, tmp)
+        self.ab3_increment(self.dphidtspec, dphi, tmp)
+        if self.semi_implicit:
+            #### AB3 plus the explicit half of the Crank-Nicolson terms ...
+            #### (div_star and phi_star are built in the ddiv and dphi buffers)
+            np.multiply(self.half_dt_minus_lap, self.phispec, out=tmp)
+            ddiv += tmp
+            ddiv += self.divspec
+            np.multiply(self.half_dt_phi_ref, self.divspec, out=tmp)
+            dphi -= tmp
+            dphi += self.phispec
+            #### ... then the implicit half, which decouples per total wavenumber
+            np.multiply(self.half_dt_minus_lap, dphi, out=tmp)
+            ddiv += tmp
+            np.multiply(ddiv, self.si_inv, out=self.divspec)
+            np.multiply(self.half_dt_phi_ref, self.divspec, out=tmp)
+            np.subtract(dphi, tmp, out=self.phispec)
+        else:
+            self.divspec += ddiv
+            self.phispec += dphi
+
+        # implicit hyperdiffusion for vort and div.
+        if self.hyperdiffusion:
+            self.vrtspec *= self.hyperdiff_fact
+            self.divspec *= self.hyperdiff_fact
+
+        # switch indices, do next time step.
+        self.nnew, self.nnow, self.nold = nold, nnew, nnow
+        self.ncycle += 1
+        self.timer.lap('ab3_update')
+        self.timer.step_done()
+
+        if self.dt_control is not None:
+            self.dt_control.update(self)
+            self.timer.lap('dt_control')
+
+        if self.budget_mean_every and (self.ncycle % self.budget_mean_every == 0):
+            self.budget_mean.add(self.budget_terms())
+            self.timer.lap('diagnostics')
+
+        if self.checkpoint_every and (self.ncycle % self.checkpoint_every == 0):
+            extra = self.checkpoint_extra() if self.checkpoint_extra is not None else None
+            self.save_checkpoint(self.checkpoint_file, extra)
+            self.timer.lap('checkpoint')
+
+    def take_state_from(self, other):
+        """
+        Continue the run of other, a stepper at another truncation with the
+        same dt (e.g. a cheap low resolution spin-up): the spectral state
+        and the three AB3 tendency levels are zero padded (or truncated)
+        and the clock and nnew/nnow/nold are taken over, so the AB3
+        history carries on without a restart. The grids of other's last
+        tendency call are regridded as well; the running budget mean is not.
+        Both have to step with the same dt (also if a dt_control changed
+        other's), since the AB3 tendencies and the clock are in steps of it.
+        """
+        if float(other.base_dt) != float(self.base_dt) or float(other.dt) != float(self.dt):
+            raise ValueError('the AB3 history needs the same dt, got %s (input_file %s) and %s (input_file %s)'%( \
+                             other.dt, other.base_dt, self.dt, self.base_dt))
+
+        sp_from, sp_to = other.sp_harmonic, self.sp_harmonic
+        for key in ['vrtspec', 'divspec', 'phispec', 'dvrtdtspec', 'ddivdtspec', 'dphidtspec', \
+                    'divspec_tendency', 'phispec_tendency']:
+            getattr(self, key)[...] = regrid_spectrum(getattr(other, key), sp_from, sp_to)
+        self.nnew, self.nnow, self.nold = other.nnew, other.nnow, other.nold
+        self.ncycle, self.ab3_start, self.t_start = other.ncycle, other.ab3_start, other.t_start
+
+        regrid = lambda spec: regrid_spectrum(spec, sp_from, sp_to)
+        self.vrtg[...]          = sp_to.spectogrd(regrid(sp_from.grdtospec(other.vrtg)))
+        self.phig[...]          = sp_to.spectogrd(regrid(sp_from.grdtospec(other.phig)))
+        vrt_spec, div_spec      = sp_from.getvrtdivspec(other.ug, other.vg)
+        self.ug[...], self.vg[...] = sp_to.getuv(regrid(vrt_spec), regrid(div_spec))
+        self.divg   = None
+        self.H0     = other.H0
+
+    def enable_checkpoints(self, checkpoint_file, every, extra=None):
+        """
+        write a checkpoint every so many steps. extra is an optional
+        callable returning a dict that is stored with it (e.g. run
+        bookkeeping of the driver)
+        """
+        self.checkpoint_file  = checkpoint_file
+        self.checkpoint_every = every
+        self.checkpoint_extra = extra
+
+    def save_checkpoint(self, filename, extra=None):
+        """
+        Everything step() needs to continue bit for bit: the spectral state,
+        the three AB3 tendency levels, the nnew/nnow/nold indices and the
+        clock (plus the running budget means and the grids of the last
+        tendency call, which drivers save before stepping). Written to a temporary file
+        first, so a crash while writing keeps the previous checkpoint.
+        """
+        checkpoint = {'vrtspec'   : self.vrtspec,    'divspec'   : self.divspec,    'phispec'   : self.phispec, \
+                      'dvrtdtspec': self.dvrtdtspec, 'ddivdtspec': self.ddivdtspec, 'dphidtspec': self.dphidtspec, \
+                      'nnew': self.nnew, 'nnow': self.nnow, 'nold': self.nold, \
+                      'ncycle': self.ncycle, 'dt': float(self.dt), 'nlm': self.sp_harmonic.nlm, \
+                      'base_dt': float(self.base_dt), 'ab3_start': self.ab3_start, 't_start': float(self.t_start), \
+                      'budget_mean_count': self.budget_mean.count, \
+                      'grids': {'ug': self.ug, 'vg': self.vg, 'phig': self.phig, 'vrtg': self.vrtg, 'divg': self.divg}}
+        if self.budget_mean.count > 0:
+            checkpoint['budget_mean'] = self.budget_mean.mean
+        if extra is not None:
+            checkpoint['extra'] = extra
+        if self.dt_control is not None:
+            checkpoint['dt_control'] = self.dt_control.saved_state()
+
+        tmp_file = filename+'.tmp'
+        h5saveload.save_dict_to_hdf5(checkpoint, tmp_file)
+        os.replace(tmp_file, filename)
+
+    def load_checkpoint(self, filename):
+        """restore the state written by save_checkpoint and return its extra dict"""
+        checkpoint = h5saveload.load_dict_from_hdf5(filename)
+
+        #### dt may have been changed by dt_control, the run's input_file dt has to match
+        base_dt = float(checkpoint.get('base_dt', checkpoint['dt']))
+        if int(checkpoint['nlm']) != self.sp_harmonic.nlm or base_dt != float(self.base_dt):
+            raise ValueError('checkpoint %s has nlm=%d, dt=%s but the model has nlm=%d, dt=%s'%( \
+                             filename, checkpoint['nlm'], base_dt, self.sp_harmonic.nlm, self.base_dt))
+        if float(checkpoint['dt']) != float(self.dt):
+            self.dt = float(checkpoint['dt'])
+            self.build_time_operators()
+
+        for key in ['vrtspec', 'divspec', 'phispec', 'dvrtdtspec', 'ddivdtspec', 'dphidtspec']:
+            value = np.asarray(checkpoint[key])
+            if key.endswith('dtspec') and value.shape != getattr(self, key).shape:
+                value = np.moveaxis(value, -1, 0)     #### (nlm, 3) layout of older checkpoints
+            getattr(self, key)[...] = value
+        self.nnew, self.nnow, self.nold = int(checkpoint['nnew']), int(checkpoint['nnow']), int(checkpoint['nold'])
+        self.ncycle    = int(checkpoint['ncycle'])
+        self.ab3_start = int(checkpoint.get('ab3_start', 0))
+        self.t_start   = float(checkpoint.get('t_start', 0.))
+        if self.dt_control is not None and 'dt_control' in checkpoint:
+            self.dt_control.restore(checkpoint['dt_control'])
+        for key, value in checkpoint['grids'].items():
+            if key == 'divg':
+                self.divg = value
+            else:
+                getattr(self, key)[...] = value
+
+        self.budget_mean       = running_mean()
+        self.budget_mean.count = int(checkpoint['budget_mean_count'])
+        self.budget_mean.mean  = checkpoint.get('budget_mean', {})
+        return checkpoint.get('extra', {})
+
+    def budget_terms(self):
+        """
+        Terms of the vorticity, divergence and geopotential budgets for the
+        latest tendency evaluation (the state at the start of the last step).
+
+        Everything is rebuilt from spectra that step() already has, so
+        this costs 5 syntheses (6 with div), and only when it is called.
+        """
+        sp       = self.sp_harmonic
+        abs_vrt  = self.vrtg + self.f
+
+        #### spectra of the tendency call (phispec has been stepped since)
+        KE_spec  = self.KE_spec
+        phi_spec = self.phispec_tendency
+
+        budget = {}
+        budget['VRT_term1']  = -sp.spectogrd(self.div_NL_spec)          ## vrt advection (div of u(abs vrt))
+        budget['VRT_term1a'] = -self.divg*abs_vrt
+        budget['VRT_term1b'] =  budget['VRT_term1'] - budget['VRT_term1a']
+        budget['VRT_term2']  = -self.vrtg*self.inv_K_M                  ## vrt damping
+
+        budget['DIV_term1']  =  sp.spectogrd(self.curl_NL_spec)         ## div advection (curl of u(abs vrt))
+        budget['DIV_term1a'] =  self.vrtg*abs_vrt
+        budget['DIV_term1b'] =  budget['DIV_term1'] - budget['DIV_term1a']
+        budget['DIV_term2']  = -sp.spectogrd(sp.lap*phi_spec)           ## laplacian phi
+        budget['DIV_term3']  = -self.member_grid(self.H0)*self.lap_phi_T_unit_grid   ## laplacian phiT
+        budget['DIV_term4']  = -sp.spectogrd(sp.lap*KE_spec)            ## laplacian KE
+        budget['DIV_term5']  = -self.divg*self.inv_K_M                  ## div damping
+
+        budget['PHI_term1']  = -sp.spectogrd(self.div_uvphi_NL_spec)    ## phi advection
+        budget['PHI_term1a'] = -self.divg*self.phig
+        budget['PHI_term1b'] =  budget['PHI_term1'] - budget['PHI_term1a']
+        budget['PHI_term2']  = -(self.phig - self.member_grid(self.phi_B))*self.inv_K_T   ## phi damping
+        budget['PHI_term3']  =  self.phi_forcing*self.inv_K_T           ## phi forcing
+        return budget
+
+    def run(self, n):
+        """advance the model by n time steps and return the state"""
+        for _ in range(n):
+            self.step()
+        return self.state
@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import itertools
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+
+#### job states kept in the state file
+PENDING, RUNNING, DONE, ABORTED, FAILED = 'pending', 'running', 'done', 'aborted', 'failed'
+
+
+def expand_grid(param_grid):
+    """
+    Cartesian product of a parameter grid, e.g.
+
+        expand_grid({'Q0': [10, 50], ('Hmean', 'Hmax'): [(200, 2500), (500, 5000)]})
+
+    gives 4 dicts. A tuple key keeps its values paired (like zip in the run scripts).
+    """
+    keys   = list(param_grid.keys())
+    combos = []
+    for values in itertools.product(*[param_grid[key] for key in keys]):
+        params = {}
+        for key, value in zip(keys, values):
+            if isinstance(key, tuple):
+                params.update(dict(zip(key, value)))
+            else:
+                params[key] = value
+        combos.append(params)
+    return combos
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def default_cost(job):
+    """rough cost of a run: time steps x (spectral transform cost ~ nlons^2 ntrunc)"""
+    return job.get('itmax', 1)*job.get('nlons', 1)**2*job.get('ntrunc', 1)
+
+
+def load_state(state_file):
+    if os.path.exists(state_file):
+        with open(state_file) as f:
+            return json.load(f)
+    return {}
+
+
+def save_state(state, state_file):
+    #### write to a temporary file first so a crash never leaves half a state file
+    tmp_file = state_file+'.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True, default=str)
+    os.replace(tmp_file, state_file)
+
+
+def _init_worker(threads_per_job):
+    #### too late for OpenMP itself (the worker is forked from a parent that has loaded
+    #### it), but swe_stepper.Spharmt builds its shtns plans with this many threads
+    os.environ['OMP_NUM_THREADS'] = str(threads_per_job)
+
+
+def _run_one(job_function, job):
+    start_time = time.time()
+    result     = job_function(job)
+    return result, time.time() - start_time
+
+
+def run_sweep(jobs, job_function, state_file='./sweep_state.json', job_name=None, cost=default_cost,
+              n_workers=None, threads_per_job=1, is_done=None, logging_object=None):
+    """
+    Run job_function(job) for every job (a dict, usually an input_file) on a
+    local process pool and keep track of each job in state_file.
+
+    job_function   : module level function (it has to be picklable). A return
+                     value of True or 'True' (the abort_status of
+                     integrate_model) marks the job as aborted.
+    job_name       : job -> unique name used as key in the state file
+                     (default: the sorted parameters)
+    cost           : job -> estimated run time. Jobs are started longest
+                     first so that the pool drains evenly.
+    n_workers      : default is the number of available cores // threads_per_job
+    threads_per_job: OpenMP threads of the shtns plans (swe_stepper.Spharmt) of a job
+    is_done        : job -> bool, e.g. lambda job: os.path.exists(output path).
+                     Such jobs are marked done without running.
+
+    Jobs that are done or aborted in an existing state file are skipped, so
+    rerunning the same sweep resumes it. Jobs left 'running' by a crashed
+    sweep and failed jobs are run again.
+
+    A worker that dies (OOM kill, segfault) breaks the whole pool: every job
+    running at that moment is marked failed, since which one killed it is
+    not known, and the remaining jobs go on in a new pool.
+    """
+    if job_name is None:
+        job_name = lambda job: json.dumps(job, sort_keys=True, default=str)
+    if n_workers is None:
+        n_workers = max(1, available_cores()//threads_per_job)
+
+    def log(line):
+        if logging_object is not None:
+            logging_object.write(line)
+
+    state = load_state(state_file)
+    todo  = []
+    for job in jobs:
+        name = job_name(job)
+        if name in state and state[name]['status'] in (DONE, ABORTED):
+            continue
+        if is_done is not None and is_done(job):
+            state[name] = {'status': DONE, 'params': job, 'note': 'output exists'}
+            continue
+        state[name] = {'status': PENDING, 'params': job}
+        todo.append((cost(job), name, job))
+    save_state(state, state_file)
+
+    todo.sort(key=lambda x: x[0], reverse=True)   #### longest first
+    log('sweep: %d jobs to run on %d workers, %d already finished'%(len(todo), n_workers, len(jobs)-len(todo)))
+
+    new_pool = lambda: concurrent.futures.ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, \
+                                                              initargs=(threads_per_job,))
+
+    #### only hand out as many jobs as there are workers, so that 'running'
+    #### in the state file means running and the longest-first order holds
+    pool    = new_pool()
+    running = {}
+    try:
+        while todo or running:
+            broken = False
+            while todo and len(running) < n_workers:
+                job_cost, name, job = todo[0]
+                try:
+                    future = pool.submit(_run_one, job_function, job)
+                except BrokenProcessPool:
+                    broken = True     #### the jobs still running fail below, then a new pool
+                    break
+                todo.pop(0)
+                running[future] = name
+                state[name]['status']  = RUNNING
+                state[name]['started'] = time.strftime('%Y-%m-%d %H:%M:%S')
+                save_state(state, state_file)
+
+            finished    = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)[0] \
+                          if running else []
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    result, duration = future.result()
+                    aborted = (result is True) or (result == 'True')
+                    state[name]['status']   = ABORTED if aborted else DONE
+                    state[name]['duration'] = duration
+                except BrokenProcessPool as error:
+                    broken = True
+                    state[name]['status']   = FAILED
+                    state[name]['error']    = 'a worker of the pool died: %r'%(error)
+                except Exception as error:
+                    state[name]['status']   = FAILED
+                    state[name]['error']    = repr(error)
+                state[name]['finished'] = time.strftime('%Y-%m-%d %H:%M:%S')
+                save_state(state, state_file)
+                log('sweep: %s %s'%(state[name]['status'], name))
+
+            if broken and not running:
+                log('sweep: a worker died, %d jobs left for a new pool'%(len(todo)))
+                pool.shutdown(wait=True)
+                pool = new_pool()
+    finally:
+        pool.shutdown(wait=True)
+
+    return state
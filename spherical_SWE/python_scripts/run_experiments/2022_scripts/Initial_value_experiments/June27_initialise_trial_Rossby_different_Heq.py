@@ -15,7 +15,7 @@ import eulerian_fluxes as eflux
 import netcdf_utilities as ncutil
 from obspy.geodetics import kilometers2degrees
 import momentum_advection_class as momentum_advect
-import calc_matsuno_modes as mm
+import matsuno_bank as matsuno_bank
 
 
 import os
@@ -624,13 +624,11 @@ if __name__ == "__main__":
                             
                             ###########################################################################
                             ################### To initialise with a given matsuno mode ###############
-                            params = mm.params
-                            params['Hmean'] = input_file['Hmean']
-                            params['c'] = np.sqrt(input_file['grav']*input_file['Hmean'])
-
-                            matsuno_modes= mm.MODE_N(t = 0, params=params, grids=mm.grids)
-                            h5saveload.save_dict_to_hdf5(matsuno_modes, './matsuno_modes_%d.hdf5'%(params['Hmean']))
-                            input_file['matsuno_mode']       = matsuno_modes['Rossby']['(n=1)']['(kn=-1)']
+                            #### all modes at once from the disk cached bank (matsuno_bank), on the model grid, with
+                            #### the parameters of calc_matsuno_modes (legacy_params: only c follows grav and Hmean)
+                            mode_lats, mode_lons = matsuno_bank.gaussian_lats_lons(input_file['nlons'], input_file['nlats'])
+                            bank       = matsuno_bank.load_bank(input_file['Hmean'], mode_lats, grav=input_file['grav'], omega=input_file['omega'])
+                            input_file['matsuno_mode']       = bank.mode('Rossby', kn=-1, n=1, lons=mode_lons)
                             input_file['matsuno_amp_factor'] = 0.01
                             ############################################################################
                             ############################################################################
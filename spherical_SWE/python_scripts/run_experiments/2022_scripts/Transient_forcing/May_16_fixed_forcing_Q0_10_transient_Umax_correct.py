@@ -1,6 +1,4 @@
 import numpy as np
-import shtns
-import pylab as py
 import matplotlib
 from tqdm import tqdm
 import sys
@@ -13,73 +11,19 @@ import eulerian_fluxes as eflux
 import netcdf_utilities as ncutil
 from obspy.geodetics import kilometers2degrees
 import momentum_advection_class as momentum_advect
+import swe_stepper as swe_stepper
+import sweep_runner as sweep_runner
+import spectral_history as spectral_history
+import forcing_engine as forcing_engine
+import step_timers as step_timers
+import cfl_control as cfl_control
+import diagnostic_plots as diagnostic_plots
+import state_library as state_library
 
 import os
 os.environ["HDF5_USE_FILE_LOCKING"] = 'FALSE'  ### This is because NOAA PSL lab computers are somehow not able to use 
 
 
-class Spharmt(object):
-    """
-    wrapper class for commonly used spectral transform operations in
-    atmospheric models.  Provides an interface to shtns compatible
-    with pyspharm (pyspharm.googlecode.com).
-    """
-    def __init__(self, nlons, nlats, ntrunc, rsphere, gridtype="gaussian"):
-        """initialize
-        nlons:  number of longitudes
-        nlats:  number of latitudes"""
-        self._shtns = shtns.sht(ntrunc, ntrunc, 1,
-                                shtns.sht_orthonormal+shtns.SHT_NO_CS_PHASE)
-
-        if gridtype == "gaussian":
-            # self._shtns.set_grid(nlats, nlons,
-            #         shtns.sht_gauss_fly | shtns.SHT_PHI_CONTIGUOUS, 1.e-10)
-            self._shtns.set_grid(nlats, nlons,
-                    shtns.sht_quick_init | shtns.SHT_PHI_CONTIGUOUS, 1.e-10)
-        elif gridtype == "regular":
-            self._shtns.set_grid(nlats, nlons,
-                    shtns.sht_reg_dct | shtns.SHT_PHI_CONTIGUOUS, 1.e-10)
-
-        self.lats = np.arcsin(self._shtns.cos_theta)
-        self.lons = (2.*np.pi/nlons)*np.arange(nlons)
-        self.nlons = nlons
-        self.nlats = nlats
-        self.ntrunc = ntrunc
-        self.nlm = self._shtns.nlm
-        self.degree = self._shtns.l
-        self.m      = self._shtns.m
-        self.lap    = -self.degree*(self.degree+1.0).astype(np.complex128)
-        self.invlap = np.zeros(self.lap.shape, self.lap.dtype)
-        self.invlap[1:] = 1./self.lap[1:]
-        self.rsphere = rsphere
-        self.lap     = self.lap/rsphere**2
-        self.invlap  = self.invlap*rsphere**2
-
-    def grdtospec(self, data):
-        """compute spectral coefficients from gridded data"""
-        return self._shtns.analys(data)
-
-    def spectogrd(self, dataspec):
-        """compute gridded data from spectral coefficients"""
-        return self._shtns.synth(dataspec)
-
-    def getuv(self, vrtspec, divspec):
-        """compute wind vector from spectral coeffs of vorticity and divergence"""
-        return self._shtns.synth((self.invlap/self.rsphere)*vrtspec, (self.invlap/self.rsphere)*divspec)
-
-    def getvrtdivspec(self, u, v):
-        """compute spectral coeffs of vorticity and divergence from wind vector"""
-        vrtspec, divspec = self._shtns.analys(u, v)
-        return self.lap*self.rsphere*vrtspec, self.lap*rsphere*divspec
-
-    def getgrad(self, divspec):
-        """compute gradient vector from spectral coeffs"""
-        vrtspec = np.zeros(divspec.shape, dtype=np.complex128)
-        u, v = self._shtns.synth(vrtspec, divspec)
-        return u/rsphere, v/rsphere
-    
-      
-import matplotlib.pyplot as plt
 import time
 cmap = matplotlib.colors.LinearSegmentedColormap.from_list("", 
       [  "darkred", "darkorange", "pink", "white", "white","skyblue", "dodgerblue", "navy"][::-1])
@@ -226,103 +170,31 @@ def F_uv_perturb(lons, lats, Fo=100, yp=0, xp=90, Lx=30, Ly=10, time = 0, switch
 def A(Z):
     return np.array(Z)
 
-def initial_conditions(sp_harmonic):
-        
-    vg   =               np.zeros((nlats, nlons), np.float64)
-    ug   =               np.zeros((nlats, nlons), np.float64)
-    phig =               np.zeros((nlats, nlons), np.float64)
-
-    # initial vorticity, divergence in spectral space
-    vrtspec, divspec = sp_harmonic.getvrtdivspec(ug, vg)
-    vrtg = sp_harmonic.spectogrd(vrtspec)
-    divg = sp_harmonic.spectogrd(divspec)
-
-    # Nonlinear terms on the RHS
-    u_f_plus_vort = ug*(vrtg+f)
-    v_f_plus_vort = vg*(vrtg+f)
-
-    curl_NL_spec, div_NL_spec = sp_harmonic.getvrtdivspec(u_f_plus_vort, v_f_plus_vort)
-    KE_spec = sp_harmonic.grdtospec(0.5*(ug**2+vg**2))
-    phispec = sp_harmonic.grdtospec(phig)
-
-
-    ### Try this part later. Where you start from a balanced condition with a perturbation
-    # balanced_phispec = sp_harmonic.invlap*curl_NL_spec - KE_spec
-    # phig    = phi_B(Hmean)+ \
-    #           perturb(lons, lats, Q0=100, yp=0, xp=90, Lx=30, Ly=10)[1] + \
-    #           sp_harmonic.spectogrd(balanced_phispec)
-    # phispec = x.grdtospec(phig)
-    
-    return ug, vg, phig, vrtg, divg, vrtspec, divspec, KE_spec, phispec
-
-
-
 def integrate_model(input_file2):
     
     abort_status = 'False'
     
-    U   = []; 
-    V   = [];
-    PHI = [];
-    VRT = [];
-    DIV = [];    
-    PHI_forcing   = []
-    F_vrt_forcing = []
-    F_div_forcing = []
-    PHI_T  = []
-
-    
-    U_spec   = []; 
-    V_spec   = [];
-    PHI_spec = [];
-    VRT_spec = [];
-    DIV_spec = [];
-    PHI_forcing_spec   = []
-    F_vrt_forcing_spec = []
-    F_div_forcing_spec = []
-    
-    T = [];
-    
-    VRT_term1  = [] ## vrt advection
-    VRT_term1a = []
-    VRT_term1b = []
-    VRT_term2  = [] ## damping vrt
-    
-    DIV_term1  = [] ## div advection (curl of u(abs vrt))
-    DIV_term1a = []
-    DIV_term1b = []
-    DIV_term2 = [] ## laplacian phi
-    DIV_term3 = [] ## laplacian phiT
-    DIV_term4 = [] ## laplacian KE
-    DIV_term5 = [] ## damping div
-    
-    PHI_term1 = [] ## phi advection
-    PHI_term1a = []
-    PHI_term1b = []
-    PHI_term2 = [] ## damping phi
-    PHI_term3 = [] ## forcing phi
+    #### the 3 hourly fields are streamed to disk (h5saveload.history_writer), only
+    #### the scalars needed for the diagnostic plots are kept in memory:
+    #### T, FORCING_max (max |phi_forcing|), U_max (max zonal mean U) and
+    #### EDDY_DIV_max (max |div - zonal mean div| away from the poles)
+    scalar_names = ['T', 'FORCING_max', 'U_max', 'EDDY_DIV_max']
+    scalars      = diagnostic_plots.scalar_series(scalar_names)
     
-        
-    for key in input_file.keys():
-        globals()[key] = input_file2[key] 
+    #### the figures are drawn by a background thread from views of the scalars
+    plots        = diagnostic_plots.plot_worker()
     
-    # setup up spherical harmonic instance, set lats/lons of grid
-    sp_harmonic = Spharmt(nlons, nlats, ntrunc, rsphere, gridtype="gaussian")
-    lons, lats  = np.meshgrid(sp_harmonic.lons, sp_harmonic.lats)
-    global f
-    f           = 2.*omega*np.sin(lats)   # coriolis
+    #### budget terms (VRT_term1 ... PHI_term3), only evaluated on save steps when asked for
+    save_budget_terms = input_file2.get('save_budget_terms', False)
+    
+    #### only the prognostic spectra (no grids, no extra transforms); read the grids
+    #### back with spectral_history.spectral_history(path2+'spatial_data.hdf5')
+    spectral_only     = input_file2.get('spectral_history', False)
     
         
-    ug, vg, phig, vrtg, divg, vrtspec, divspec, KE_spec, phispec = initial_conditions(sp_harmonic)
-
-    ddivdtspec = np.zeros(vrtspec.shape+(3,), np.complex128)
-    dvrtdtspec = np.zeros(vrtspec.shape+(3,), np.complex128)
-    dphidtspec = np.zeros(vrtspec.shape+(3,), np.complex128)
-    nnew = 0
-    nnow = 1
-    nold = 2
+    for key in input_file2.keys():
+        globals()[key] = input_file2[key] 
     
-
     H0_values     = np.zeros(itmax)
     
     Q_spinup_time = int(alpha*3)*int(86400/dt)    
@@ -335,167 +207,159 @@ def integrate_model(input_file2):
     H0_values[tmax_25 + Q_spinup_time : tmin_25 + tmax_25 + Q_spinup_time   ]         = np.linspace(Hmax, 0, tmin_25)
     H0_values[tmin_25 + tmax_25 + Q_spinup_time : ]                                   = 0
     
-    for ncycle in tqdm(range(itmax)):
-        
-        t = ncycle*dt
+    #### the low resolution spin-up (below) saves nothing, so it has to end by day 6 where saving starts
+    if input_file2.get('spinup_nlons', None) and input_file2.get('spinup_days', 6) > 6:
+        raise ValueError('spinup_days = %s is past day 6, where saving starts: days 6 to %s would be missing from the history'%( \
+                         input_file2['spinup_days'], input_file2['spinup_days']))
+    
+    # setup up spherical harmonic instance, set lats/lons of grid
+    #### one plan per resolution and process, the fastest shtns setup of the machine if tune_transforms
+    sp_harmonic = swe_stepper.get_spharmt(nlons, nlats, ntrunc, rsphere, gridtype="gaussian", \
+                                          tune=input_file2.get('tune_transforms', False))
+    
+    #### PHI_perturb_propagating, transformed once and rotated in longitude every step
+    make_forcing = lambda sp: forcing_engine.propagating_heating(sp, Q0=Q0, yp=yp, Ly=Ly, c=forcing_phase_speed, \
+                                                                 wave_number=forcing_wave_number, DIPOLE=DIPOLE, \
+                                                                 switch_on_day=switch_on_day, alpha=alpha, grav=grav)
+    forcing     = make_forcing(sp_harmonic)
+    
+    # setup up the stepper (grid, coriolis, damping, AB3 weights) once
+    stepper = swe_stepper.SWE_stepper(input_file2, H0_values = H0_values, sp_harmonic = sp_harmonic, \
+                                      budget_mean_every = input_file2.get('budget_mean_every', None), \
+                                      spectral_phi_forcing = forcing)
+    lons, lats  = stepper.lons, stepper.lats
+    
+    #### opt-in adaptive dt: powers of two of dt from the Courant number of every step,
+    #### larger steps while the flow is quiet, and an abort with diagnostics before NaNs.
+    #### The 3 hourly saves stay on time; H0_values stays indexed in steps of dt
+    if input_file2.get('adaptive_dt', False):
+        stepper.dt_control = cfl_control.cfl_controller(stepper, max_dt = input_file2.get('max_dt', None), \
+                                                        logging_object = logging_object)
+    
+    #### periodic checkpoints of the model state and of how much history was written;
+    #### a crashed or killed run continues from the last one when restarted
+    h5saveload.make_sure_path_exists(input_file2['path'])
+    checkpoint_file  = checkpoint_path(input_file2)
+    history_file     = history_path(input_file2)
+    checkpoint_every = input_file2.get('checkpoint_days', 25)*int(86400/dt)
+    #### also when the file is reopened, for datasets first created after a restart
+    storage          = input_file2.get('storage_profile', None)
+    
+    #### opt-in shared spin-up: members that only differ in Hmax are the same run until
+    #### the H0 ramp starts (Q_spinup_time). A spin_up_only job (the first stage of the
+    #### sweep, see __main__) runs until then and saves its state and history as a branch
+    #### of the state library in branch_library; the members fork from it
+    library       = state_library.state_library(input_file2['branch_library']) if input_file2.get('branch_library', None) else None
+    branch_time   = Q_spinup_time*dt
+    branch        = spinup_branch(input_file2)
+    spin_up_only  = input_file2.get('spin_up_only', False)
+    if os.path.exists(checkpoint_file) and not h5saveload.readable(history_file):
+        #### killed while appending after the last checkpoint: nothing left to truncate
+        logging_object.write("History %s is unreadable, starting again"%(history_file))
+        os.remove(checkpoint_file)
+    if os.path.exists(checkpoint_file):
+        saved   = stepper.load_checkpoint(checkpoint_file)
+        history = h5saveload.history_writer(history_file, mode='a', profile=storage)
+        history.truncate(int(saved['nrows']))
+        scalars = diagnostic_plots.scalar_series(scalar_names, initial=saved)
+        logging_object.write("Restarted from checkpoint at day %d"%(stepper.t/(24*3600)))
+    elif library is not None and library.has(branch) and not spin_up_only:
+        saved   = library.fork(branch, stepper, check=SPINUP_KEYS)
+        history = h5saveload.history_writer(library.attachment(branch, 'history', copy_to=history_file), mode='a', \
+                                            profile=storage)
+        history.truncate(int(saved['nrows']))
+        scalars = diagnostic_plots.scalar_series(scalar_names, initial=saved)
+        logging_object.write("Forked from branch '%s' at day %d"%(branch, stepper.t/(24*3600)))
+    else:
+        history = h5saveload.history_writer(history_file, profile=storage)
+        history.write({'lats': sp_harmonic.lats, 'lons': sp_harmonic.lons, 'phi_B': phi_B(Hmean), \
+                       'grid': {'nlons': nlons, 'nlats': nlats, 'ntrunc': ntrunc, 'rsphere': rsphere, 'K_T': K_T}})
+        if spectral_only:
+            history.write({'phi_T_unit': stepper.phi_T_unit})
+    
+        #### optional spin-up at a lower resolution (same dt): the first spinup_days run at
+        #### spinup_nlons, then the spectra and the AB3 history are zero padded to ntrunc and
+        #### the run continues at full resolution. Nothing is saved during the spin-up, so it
+        #### can be at most 6 days long (the default), where saving starts
+        spinup_nlons = input_file2.get('spinup_nlons', None)
+        if spinup_nlons:
+            spinup_steps  = int(input_file2.get('spinup_days', 6)*86400/dt)
+            input_spinup  = dict(input_file2, nlons=spinup_nlons, nlats=int(spinup_nlons/2), ntrunc=int(spinup_nlons/3))
+            sp_spinup     = swe_stepper.get_spharmt(spinup_nlons, int(spinup_nlons/2), int(spinup_nlons/3), rsphere, \
+                                                    gridtype="gaussian", tune=input_file2.get('tune_transforms', False))
+            stepper_spinup = swe_stepper.SWE_stepper(input_spinup, H0_values = H0_values, sp_harmonic = sp_spinup, \
+                                                     spectral_phi_forcing = make_forcing(sp_spinup))
+            stepper_spinup.run(spinup_steps)
+            stepper.take_state_from(stepper_spinup)
+            logging_object.write("Spun up %d days at nlons = %d"%(stepper.t/(24*3600), spinup_nlons))
+    
+    #### opt-in wall time per stage (transforms, tendencies, forcing, diagnostics, history I/O ...),
+    #### summed over each simulated day and written with the "Calculated day" line
+    profile_timers = input_file2.get('profile_timers', False)
+    timer          = step_timers.stage_timer() if profile_timers else step_timers.null_timer()
+    stepper.timer  = timer
+    timer.start()
+    
+    progress = tqdm(total=itmax, initial=stepper.step_index)
+    while stepper.t < (branch_time if spin_up_only else itmax*dt):
         
-        H0     = H0_values[ncycle]
+        t      = stepper.t
+        ncycle = stepper.step_index   #### = the step number unless adaptive_dt changed dt
         
+        #### every row of the history is the model at T_in_days = t: the spectra before
+        #### the step, the grids of the step's tendency call (the same state) after it
         if int(t/(24*3600)) > 5 :
             
             if t % (3*3600) == 0: ### Save every 3 hours
-                U.  append(ug)
-                V.  append(vg)
-                PHI.append(phig)
-                VRT.append(vrtg)
-                DIV.append(divg)
-                
-                U_spec.  append(sp_harmonic.grdtospec(ug))
-                V_spec.  append(sp_harmonic.grdtospec(vg))
-                PHI_spec.append(phispec)
-                VRT_spec.append(vrtspec)
-                DIV_spec.append(divspec)
-                
-                T.append(t/(24*3600)) 
-                PHI_T.append(phi_T(lats, y0, H0,  N, ))
-        
-        # get vort, u, v, phi on grid
-        divg   = sp_harmonic.spectogrd(divspec)
-        vrtg   = sp_harmonic.spectogrd(vrtspec)
-        ug, vg = sp_harmonic.getuv(vrtspec, divspec)
-        phig   = sp_harmonic.spectogrd(phispec)
-        phig_plus_phiT = phig + phi_T(lats, y0, H0,  N, )
-
-        
-        # compute tendencies.
-        u_f_plus_vort = ug*(vrtg+f)
-        v_f_plus_vort = vg*(vrtg+f)
-        curl_NL_spec, div_NL_spec =   sp_harmonic.getvrtdivspec(u_f_plus_vort, v_f_plus_vort)
-        ddivdtspec[:, nnew]       =   curl_NL_spec
-        dvrtdtspec[:, nnew]       = - div_NL_spec
-        
-        
-        u_phi = ug*phig
-        v_phi = vg*phig
-        curl_uvphi_NL_spec, div_uvphi_NL_spec = sp_harmonic.getvrtdivspec(u_phi, v_phi)
-
-        dphidtspec[:, nnew]   = -div_uvphi_NL_spec
-        KE_plus_phi_spec      =  sp_harmonic.grdtospec(phig_plus_phiT+0.5*(ug**2+vg**2))
-        ddivdtspec[:, nnew]  += -sp_harmonic.lap*KE_plus_phi_spec
-
-        #### Diffusion term ####
-        vrtg_diffuse_spec, div_diffuse_spec   =  sp_harmonic.getvrtdivspec(ug, vg)
-        phi_diffuse_spec                      =  sp_harmonic.grdtospec(phig - phi_B(Hmean))
-        dvrtdtspec[:, nnew]   += -vrtg_diffuse_spec/K_M
-        ddivdtspec[:, nnew]   += -div_diffuse_spec/K_M
-        dphidtspec[:, nnew]   += -phi_diffuse_spec/K_T
-        
-
-        ##### EXTERNAL FORCING ######
-        time_component        = 0 #np.sin(2*np.pi*t/(time_period*24*3600))
-
-        phi_forcing           = PHI_perturb_propagating(lons, lats, Q0, yp, xp, Lx, Ly, t, switch_on_day, \
-                                                        c=forcing_phase_speed, wave_number=forcing_wave_number, DIPOLE = DIPOLE, switch_off_day=switch_off_day)[0]
-
-#       phi_forcing           = (PHI_perturb_from_file(external_data, time = 0, switch_on_day=None)[0])
-        fu_forcing            = (F_uv_perturb(lons, lats, FUo, yp, xp, Lx, Ly, t, switch_on_day)[0])*time_component 
-        fv_forcing            = (F_uv_perturb(lons, lats, FVo, yp, xp, Lx, Ly, t, switch_on_day)[0])*time_component 
-        
-        f_vrt_forcing_spec, f_div_forcing_spec    =   sp_harmonic.getvrtdivspec(fu_forcing, fv_forcing)
-        f_vrt_forcing    =   sp_harmonic.spectogrd(f_vrt_forcing_spec)
-        f_div_forcing    =   sp_harmonic.spectogrd(f_div_forcing_spec)
-
-        phi_forcing_spec       = sp_harmonic.grdtospec(phi_forcing)/K_T
-        dphidtspec[:, nnew]   += phi_forcing_spec
-        dvrtdtspec[:, nnew]   += f_vrt_forcing_spec
-        ddivdtspec[:, nnew]   += f_div_forcing_spec   
-        
+                if spectral_only:
+                    history.append(dict(spectral_history.spectral_fields(stepper), \
+                                        T_in_days = t/(24*3600), H0 = H0_values[ncycle]))
+                    timer.lap('history_io')
         
-        ################################## SAVE THOSE EXTRA ADVECTION TERMS ################################
-        div_NL_grid                   = -sp_harmonic.spectogrd(div_NL_spec)  #### RHS of vorticity equation
-        damping_vrt                   = -vrtg/K_M
-        
-        curl_NL_grid                  =  sp_harmonic.spectogrd(curl_NL_spec) #### RHS of divergence equation
-        laplacian_phi_grid            = -sp_harmonic.spectogrd(sp_harmonic.lap*sp_harmonic.grdtospec(phig)) ###  RHS of divergence equation
-        laplacian_phiT_grid           = -sp_harmonic.spectogrd(sp_harmonic.lap*sp_harmonic.grdtospec(phi_T(lats, y0, H0,  N))) ###  RHS of divergence equation
-        laplacian_KE_grid             = -sp_harmonic.spectogrd(sp_harmonic.lap*sp_harmonic.grdtospec(0.5*(ug**2+vg**2)))  ###  RHS of divergence equation
-        damping_div                   = -divg/K_M
+        #### tendencies, forcing and the AB3 update all happen inside the stepper
+        try:
+            stepper.step()
+        except cfl_control.runaway_error as error:
+            logging_object.write("ABORTING for Q0 = %d: %s"%(Q0, error))
+            print ("ABORTING for Q0 = %d: %s"%(Q0, error))
+            abort_status='True'
+            break
+        progress.update(stepper.step_index - ncycle)
+        ug = stepper.ug   #### not divg, which would synthesize it every step
         
-        div_uvphi_NL_grid             = -sp_harmonic.spectogrd(div_uvphi_NL_spec)  ###  RHS of phi equation
-        damping_phi                   = -(phig - phi_B(Hmean))/K_T
-        forcing_phi                   = +(phi_forcing)/K_T
-        ####################################################################################################
 
         
         if int(t/(24*3600)) > 5 :           
             if t % (3*3600) == 0: ### Save every 6 hours
                 
-                PHI_forcing       .append(phi_forcing)
-                PHI_forcing_spec  .append(phi_forcing_spec)
-                
-                F_vrt_forcing     .append(f_vrt_forcing)
-                F_vrt_forcing_spec.append(f_vrt_forcing_spec)
-                
-                F_div_forcing     .append(f_div_forcing)
-                F_div_forcing_spec.append(f_div_forcing_spec)
-                
-                
-#                 VRT_term1         .append(div_NL_grid)    ## vrt advection (div of u(abs vrt))
-#                 VRT_term1a        .append(-divg*(vrtg+f))
-#                 VRT_term1b        .append(div_NL_grid - (-divg*(vrtg+f)))
+                if spectral_only:
+                    history.append(spectral_history.spectral_forcing_fields(stepper))
+                else:
+                    history.append({'U'  : stepper.ug,   'V'  : stepper.vg,   'PHI': stepper.phig, \
+                                    'vrt': stepper.vrtg, 'div': stepper.divg, \
+                                    'T_in_days': t/(24*3600), 'phi_T': H0_values[ncycle]*stepper.phi_T_unit, \
+                                    'phi_forcing': stepper.phi_forcing, \
+                                    'vrt_forcing': sp_harmonic.spectogrd(stepper.f_vrt_forcing_spec), \
+                                    'div_forcing': sp_harmonic.spectogrd(stepper.f_div_forcing_spec)})
+                timer.lap('history_io')
                 
-#                 VRT_term2         .append(damping_vrt)    ## vrt damping
+                scalars.append(T = t/(24*3600), U_max = np.max(stepper.ug.mean(axis=-1)), \
+                               EDDY_DIV_max = np.max(np.abs(stepper.divg[50:-50,:] - stepper.divg[50:-50,:].mean(axis=-1, keepdims=True))), \
+                               FORCING_max = np.max(np.abs(stepper.phi_forcing)))
+                timer.lap('diagnostics')
                 
-#                 DIV_term1         .append(curl_NL_grid)   ## div advection (curl of u(abs vrt))
-#                 DIV_term1a        .append(vrtg*(vrtg+f))
-#                 DIV_term1b        .append(curl_NL_grid - vrtg*(vrtg+f))                
-#                 DIV_term2         .append(laplacian_phi_grid)  ## laplacian phi
-#                 DIV_term3         .append(laplacian_phiT_grid) ## laplacian phiT
-#                 DIV_term4         .append(laplacian_KE_grid)   ## laplacian KE
-#                 DIV_term5         .append(damping_div)    ## damping vrt
-                
-#                 PHI_term1         .append(div_uvphi_NL_grid) ## phi advection
-#                 PHI_term1a        .append(-divg*(vrtg+f))
-#                 PHI_term1b        .append(div_uvphi_NL_grid - (-divg*(vrtg+f)))
-#                 PHI_term2         .append(damping_phi)       ## phi damping  
-#                 PHI_term3         .append(forcing_phi)       ## phi forcing
-      
-        # update vort, div, phiv with third-order adams-bashforth.
-        # forward euler, then 2nd-order adams-bashforth time steps to start.
-        if ncycle == 0:
-            dvrtdtspec[:, nnow] = dvrtdtspec[:, nnew]
-            dvrtdtspec[:, nold] = dvrtdtspec[:, nnew]
-            ddivdtspec[:, nnow] = ddivdtspec[:, nnew]
-            ddivdtspec[:, nold] = ddivdtspec[:, nnew]
-            dphidtspec[:, nnow] = dphidtspec[:, nnew]
-            dphidtspec[:, nold] = dphidtspec[:, nnew]
-        elif ncycle == 1:
-            dvrtdtspec[:, nold] = dvrtdtspec[:, nnew]
-            ddivdtspec[:, nold] = ddivdtspec[:, nnew]
-            dphidtspec[:, nold] = dphidtspec[:, nnew]
-
-        vrtspec += dt*(
-            (23./12.)*dvrtdtspec[:, nnew] - (16./12.)*dvrtdtspec[:, nnow]
-            + (5./12.)*dvrtdtspec[:, nold])
-        divspec += dt*(
-            (23./12.)*ddivdtspec[:, nnew] - (16./12.)*ddivdtspec[:, nnow]
-            + (5./12.)*ddivdtspec[:, nold])
-        phispec += dt*(
-            (23./12.)*dphidtspec[:, nnew] - (16./12.)*dphidtspec[:, nnow]
-            + (5./12.)*dphidtspec[:, nold])
-        # implicit hyperdiffusion for vort and div.
-        # vrtspec *= hyperdiff_fact
-        # divspec *= hyperdiff_fact
-
-        # switch indices, do next time step.
-        nsav1 = nnew
-        nsav2 = nnow
-        nnew = nold
-        nnow = nsav1
-        nold = nsav2
+                if save_budget_terms:
+                    budget = stepper.budget_terms()
+                    timer.lap('diagnostics')
+                    history.append({'budget/'+key: term for key, term in budget.items()})
+                    timer.lap('history_io')
+
         
         if t/(24*3600) % 1 == 0 :
-            logging_object.write("Calculated day %d"%(t/(24*3600)))
+            if profile_timers:
+                logging_object.write("Calculated day %d | %s"%(t/(24*3600), timer.report()))
+            else:
+                logging_object.write("Calculated day %d"%(t/(24*3600)))
             
             
         if np.isnan(ug).any():  #### this is to make sure that the model which doesn't run stably is aborted immediately
@@ -503,40 +367,45 @@ def integrate_model(input_file2):
             print ("ABORTING for Q0 = %d because of a runaway scenario at %d"%(Q0, t/(24*3600)))
             abort_status='True'
             break
-
-        if np.isclose( (t/(24*3600)), input_file['U_up_days'] ) :
+        
+        #### at the end of the step, once everything of this step is written
+        #### (flushed first, so the nrows the checkpoint counts are on disk)
+        if stepper.t % (checkpoint_every*dt) == 0:
+            history.flush()
+            stepper.save_checkpoint(checkpoint_file, dict(scalars.arrays(), nrows = history.nrows))
+            timer.lap('checkpoint')
+        
+        #### (also done by a member if the spin-up stage did not leave the branch)
+        if library is not None and stepper.t == branch_time and not library.has(branch):
+            history.flush()
+            library.save(branch, stepper, extra = dict(scalars.arrays(), nrows = history.nrows), \
+                         attach = {'history': history_file})
+            logging_object.write("Saved branch '%s'"%(branch))
+            timer.lap('checkpoint')
+
+        if np.isclose( (t/(24*3600)), input_file2['U_up_days'] ) :
             
             direc = './Hmean_%d_ps_%d_Q0_%d/'%(Hmean,forcing_phase_speed, Q0)
-            
-            h5saveload.make_sure_path_exists(direc)
-            fig = py.figure(figsize=(15,4))
-            py.plot(A(T), np.max(np.abs(A(PHI_forcing)), axis=(-1,-2)), 'g-', lw=4, label='forcing'); 
-            py.twinx()
-            py.plot(A(T), np.max(A(U).mean(axis=-1), axis=(-1)),     'b-', lw=4, label='U'); 
-            py.xlabel('days', fontsize=20)
-            py.ylabel('forcing & U', fontsize=20)
-            py.tick_params(labelsize=20)
-            py.title('Hmean_%d_ps_%d - forcing & U'%(Hmean,forcing_phase_speed), fontsize=20)
-            py.savefig(direc+'forcing.png', dpi=300)
-            py.close(fig)
-            
-            fig = py.figure(figsize=(15,4))
-            py.plot(np.max(A(U).mean(axis=-1), axis=(-1)), \
-                    np.max( np.abs(    A(DIV)[:,50:-50,:] - (A(DIV)[:,50:-50,None,:]).mean(axis=-1)   ), axis=(-1, -2)), 'k-', lw=4) 
-            py.tick_params(labelsize=20)
-            py.xlabel('U', fontsize=20)
-            py.ylabel('eddy div', fontsize=20)
-            py.title('Hmean_%d_ps_%d - eddy div'%(Hmean,forcing_phase_speed), fontsize=20)
-            py.savefig(direc+'div_U.png', dpi=300)
-            py.close(fig)
+            plots.submit(diagnostic_plots.forcing_and_U_figures, direc, 'Hmean_%d_ps_%d'%(Hmean,forcing_phase_speed), \
+                         **scalars.arrays())
+            timer.lap('plots')
 
 
      
-    spatial_data   =  {'U': A(U),      'V': A(V),      'PHI': A(PHI),  \
-                       'lats': sp_harmonic.lats, 'lons': sp_harmonic.lons, 'T_in_days':A(T),  \
-                       'phi_T': np.array(PHI_T), 'phi_B': phi_B(Hmean), 'phi_forcing': A(PHI_forcing), \
-                       'vrt_forcing': A(F_vrt_forcing), 'div_forcing': A(F_div_forcing), 'abort_status':abort_status,\
-                       'div': A(DIV), 'vrt': A(VRT)}
+    progress.close()
+    if spin_up_only:
+        #### the branch is the result, nothing else is kept
+        history.close()
+        for filename in [history_file, checkpoint_file]:
+            if os.path.exists(filename):
+                os.remove(filename)
+        plots.close()
+        return abort_status
+    
+    history.write({'abort_status': abort_status})
+    if stepper.budget_mean.count > 0:
+        history.write({'budget_mean': stepper.budget_mean.mean})
+    history.close()
     
         
     path2 = path +'/H0_%s/'%(Hmax)
@@ -544,51 +413,96 @@ def integrate_model(input_file2):
     
             
     direc = './June13_22_Hmean_%d_ps_%d_Q0_%d/'%(Hmean,forcing_phase_speed, Q0)
-    h5saveload.make_sure_path_exists(direc)
-
-    fig = py.figure(figsize=(15,4))
-    py.plot(A(T), np.max(np.abs(A(PHI_forcing)), axis=(-1,-2)), 'g-', lw=4, label='forcing'); 
-    py.ylabel('forcing', fontsize=20)
-    py.twinx()
-    py.plot(A(T), np.max(A(U).mean(axis=-1), axis=(-1)),     'b-', lw=4, label='U'); 
-    py.xlabel('days', fontsize=20)
-    py.ylabel('U', fontsize=20)
-    py.tick_params(labelsize=20)
-    py.title('Hmean_%d_ps_%d - forcing & U'%(Hmean,forcing_phase_speed), fontsize=20)
-    py.savefig(direc+'forcing.png', dpi=300)
-    py.close(fig)
-
-    fig = py.figure(figsize=(15,4))
-    py.plot(np.max(A(U).mean(axis=-1), axis=(-1)), \
-            np.max( np.abs(    A(DIV)[:,50:-50,:] - (A(DIV)[:,50:-50,None,:]).mean(axis=-1)   ), axis=(-1, -2)), 'k-', lw=4) 
-    py.tick_params(labelsize=20)
-    py.xlabel('U', fontsize=20)
-    py.ylabel('eddy div', fontsize=20)
-    py.title('Hmean_%d_ps_%d - eddy div'%(Hmean,forcing_phase_speed), fontsize=20)
-    py.savefig(direc+'div_U.png', dpi=300)
-    py.close(fig)
+    plots.submit(diagnostic_plots.forcing_and_U_figures, direc, 'Hmean_%d_ps_%d'%(Hmean,forcing_phase_speed), \
+                 **scalars.arrays())
     
     if abort_status == 'False':
         h5saveload.make_sure_path_exists(path2)  
-        h5saveload.save_dict_to_hdf5(spatial_data,     path2+'spatial_data.hdf5')
-        h5saveload.save_dict_to_hdf5(input_file2,      path2+'input_file.hdf5')
+        os.replace(history_file, path2+'spatial_data.hdf5')
+        #### an option set to None means unset
+        h5saveload.save_dict_to_hdf5({key: value for key, value in input_file2.items() if value is not None}, \
+                                     path2+'input_file.hdf5')
 
         logging_object.write("Saved data in %s"%(path2))
+    else:
+        os.remove(history_file)
+    
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    
+    for error in plots.close():
+        logging_object.write("Plotting failed: %r"%(error))
+    
+    return abort_status
+
+
+#### everything the run depends on up to the start of the H0 ramp (not Hmax)
+SPINUP_KEYS = ['nlons', 'nlats', 'ntrunc', 'dt', 'rsphere', 'omega', 'grav', 'y0', 'N', 'Hmean', 'K_M', 'K_T', \
+               'Q0', 'yp', 'Ly', 'forcing_phase_speed', 'forcing_wave_number', 'DIPOLE', 'switch_on_day', 'alpha', \
+               'phi_T_type', 'semi_implicit', 'H_ref', 'hyperdiffusion', 'efold', 'ndiss', 'budget_mean_every', \
+               'spinup_nlons', 'spinup_days', 'adaptive_dt', 'max_dt', 'spectral_history', 'save_budget_terms', \
+               'storage_profile']
+
+
+def spinup_branch(input_file):
+    """name of the state_library branch at the start of the H0 ramp, the same for every Hmax"""
+    Q_spinup_time = int(input_file['alpha']*3)*int(86400/input_file['dt'])
+    return 'spin-up to day %d, Hmean=%s, ps=%s, Q0=%s [%s]'%(Q_spinup_time*input_file['dt']/(24*3600), \
+                                                        input_file['Hmean'], input_file['forcing_phase_speed'], \
+                                                        input_file['Q0'], state_library.config_key(input_file, SPINUP_KEYS))
+
+
+def output_path(input_file):
+    return input_file['path'] +'/H0_%s/'%(input_file['Hmax'])
+
+
+def checkpoint_path(input_file):
+    #### next to (not inside) the output directory, whose existence marks a finished run
+    return input_file['path'] +'/checkpoint_H0_%s.hdf5'%(input_file['Hmax'])
+
+
+def history_path(input_file):
+    #### spatial_data while the run is going, moved into output_path when it finishes
+    return input_file['path'] +'/spatial_data_H0_%s.partial.hdf5'%(input_file['Hmax'])
+
+
+def run_job(input_file):
+    """one member of the sweep, run in a worker process of sweep_runner"""
+    global logging_object
+    start_time=ti.time() 
     
+    logging_object = logruns.default_log(logfilename   = 'June13_2022_Hmean_%d_ps_%d_Q0_%d'%(\
+                                                          input_file['Hmean'], input_file['forcing_phase_speed'], \
+                                                          input_file['Q0']),  \
+                                         log_directory = './log/')
+
+    logging_object.write('**********************************')
+    logging_object.write(input_file['path'])
+    logging_object.write('**********************************')
+
+    print (' %s integrating'%(output_path(input_file)))
+    abort_status = integrate_model(input_file)
+
+    end_time=ti.time() 
+
+    logging_object.write(' ========== CODE RAN SUCCESSFULLY, congrats! ================')
+    logging_object.write(' -----> Total Time taken = %1.3f  <----'%(end_time-start_time))
+    return abort_status
     
     
 if __name__ == "__main__": 
     
+    input_files = []
+    h5saveload.make_sure_path_exists('./log/')
     for Q0 in [10]:  ### 0.1, 10, 50, 100, 125, 250, 500
-        for HMEAN, H0 in zip([200, 500], [2500, 5000]):  ##50   
+        #### every H0 for each Hmean, so the members of one Hmean share their spin-up (branch_library)
+        for HMEAN, H0 in [(HMEAN, H0) for HMEAN in [200, 500] for H0 in [2500, 5000]]:  ##50   
             for forcing_y_loc in [0]:  
                 for forcing_phase_speed in [0, 5, 15]: ##0                                            
                     for DIPOLE_or_MONOPOLE in [True]:
 
                         for alphas, switch_on_days, keep_forcing_const_for_days  in zip([25], [0], [350]):
 
-                            start_time=ti.time() 
-
                             input_file = {  'nlons'          : 256        , \
                                             'ntrunc'         : int(256/3) , \
                                             'nlats'          : int(256/2) , \
@@ -609,8 +523,17 @@ if __name__ == "__main__":
                                             'switch_on_day'  : switch_on_days, \
                                             'alpha'          : alphas, \
                                             'keep_forcing_const_for_day' : keep_forcing_const_for_days,\
+                                            'storage_profile': 'exact', \
+                                            'tune_transforms': True, \
+                                            'profile_timers' : False, \
+                                            'spinup_days'    : 6, \
+                                            'adaptive_dt'    : False, \
                                             'path'           : '/data/pbarpanda/spherical_SWE/evaluate_final_budget/transient_U_propagate_forcing_diff_Heq/' } ; 
 
+                            #### options that are off unless set (save_dict_to_hdf5 cannot store None,
+                            #### so leave them out rather than setting them to None):
+                            ####     'spinup_nlons': 64 (low resolution spin-up), 'max_dt': 600 (adaptive_dt),
+                            ####     'branch_library': '/data/.../branches/' (spin-up shared by every Hmax, below)
                             input_file['ntrunc']           = int(input_file['nlons']/3)
                             input_file['nlats']            = int(input_file['nlons']/2)
                             input_file['itmax']            = 600*int(86400/int(input_file['dt']))   #### Here 150 is in the units of days
@@ -630,32 +553,29 @@ if __name__ == "__main__":
                                                                             input_file['U_up_days'])
 
 
-                            logging_object = logruns.default_log(logfilename   = 'June13_2022_Hmean_%d_ps_%d_Q0_%d'%(\
-                                                                                  input_file['Hmean'], input_file['forcing_phase_speed'], \
-                                                                                  input_file['Q0']),  \
-                                                                 log_directory = './log/')
-
-
-
-                            logging_object.write('**********************************')
-                            logging_object.write(input_file['path'])
-                            logging_object.write('**********************************')
-                            path2 = input_file['path'] +'/H0_%s/'%(input_file['Hmax'])
-
-                            if not os.path.exists(path2):
-                                print (' %s integrating'%(path2))
-                                integrate_model(input_file)
-                            else:
-                                logging_object.write( ' %s exists'%(path2) )
-                                print (' %s exists'%(path2))
-
-                            end_time=ti.time() 
-
-                            logging_object.write(' ========== CODE RAN SUCCESSFULLY, congrats! ================')
-                            logging_object.write(' -----> Total Time taken = %1.3f  <----'%(end_time-start_time))
-
-
-
-
-
-
+                            input_files.append(input_file)
+
+    #### with a branch_library, one spin_up_only job per branch runs first (up to the start
+    #### of the H0 ramp) and every member then forks from its branch, so the shared
+    #### spin-up is paid once per sweep. It runs in its own directory of the library, and
+    #### only for branches that more than one member starts from
+    spin_ups, members = {}, {}
+    for input_file in input_files:
+        if input_file.get('branch_library', None):
+            branch = spinup_branch(input_file)
+            members[branch] = members.get(branch, 0) + 1
+            spin_ups.setdefault(branch, dict(input_file, spin_up_only = True, \
+                                             path = os.path.join(input_file['branch_library'], 'spin_up', \
+                                                                 state_library.config_key(input_file, SPINUP_KEYS))))
+    spin_ups = {branch: job for branch, job in spin_ups.items() if members[branch] > 1}
+    if spin_ups:
+        sweep_runner.run_sweep(list(spin_ups.values()), run_job, state_file = './log/sweep_state_spin_up.json', \
+                               job_name = spinup_branch, \
+                               is_done  = lambda input_file: state_library.state_library(input_file['branch_library']).has( \
+                                                             spinup_branch(input_file)))
+    
+    #### all members go to a process pool, longest first; finished, aborted and
+    #### existing outputs are skipped so the same command resumes the sweep
+    sweep_runner.run_sweep(input_files, run_job, state_file = './log/sweep_state.json', \
+                           job_name = output_path, \
+                           is_done  = lambda input_file: os.path.exists(output_path(input_file)))
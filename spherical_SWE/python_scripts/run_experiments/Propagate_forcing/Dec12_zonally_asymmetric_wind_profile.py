@@ -15,7 +15,7 @@ import eulerian_fluxes as eflux
 import netcdf_utilities as ncutil
 from obspy.geodetics import kilometers2degrees
 import momentum_advection_class as momentum_advect
-from scipy.interpolate import interp2d
+import basic_state as basic_state
 
 import os
 os.environ["HDF5_USE_FILE_LOCKING"] = 'FALSE'  ### This is because NOAA PSL lab computers are somehow not able to use
@@ -137,13 +137,9 @@ def phi_T_asymmetric(x, y, y0=0, H0=100,  N=2, \
 #     return grav*H0*phi_T
 
 
-def phi_T_empirical(lon, lat, H0):
-    path        = '/Users/pbarpanda/Work/spherical_SWE/empirical_data_reanalysis/'
-    phi_T_data  =  h5saveload.load_dict_from_hdf5(path+'phi_T_data.hdf5')
-    f     = interp2d(phi_T_data['lon'], phi_T_data['lat'], phi_T_data['geopot_Z_mean'], kind='cubic')
-    phi_T = f(lon, lat[::-1])[::-1,:]   #### this is because
-#     phi_T = (phi_T/np.max(phi_T) - np.min(phi_T/np.max(phi_T)))
-    return phi_T*grav*H0
+#### phi_T_empirical (geopot_Z_mean of phi_T_data.hdf5 times grav*H0) is read and
+#### interpolated once per run by basic_state.empirical, see integrate_model
+phi_T_path = '/Users/pbarpanda/Work/spherical_SWE/empirical_data_reanalysis/'
 
 def phi_B(Hmean):
     phi = grav*Hmean
@@ -345,6 +341,24 @@ def integrate_model(input_file2):
     H0_spinup = np.linspace(0, Hmax, tmax_25)
     H0_values[:tmax_25] = H0_spinup
     
+    #### the basic state is H0 times a fixed pattern: pattern, spectrum (and laplacian)
+    #### are made once here, every step only scales them by H0
+#     phi_T_basic = basic_state.asymmetric(sp_harmonic, y0=y0, N=N, grav=grav, \
+#                                          xN = xN,   yN = yN, \
+#                                          delta_xN = delta_xN, delta_yN = delta_yN, \
+#                                          xS = xS,   yS = yS, \
+#                                          delta_xS = delta_xS, delta_yS = delta_yS, \
+#                                          AN=AN, AS=AS)
+    phi_T_basic = basic_state.empirical(sp_harmonic, phi_T_path+'phi_T_data.hdf5', grav=grav)
+    
+    #### the momentum forcing is switched off (no time dependence) or has no amplitude
+    #### (FUo = FVo = 0) in most runs; it is then left out of the loop instead of
+    #### being computed and transformed every step only to add zeros
+    uv_time_component = None   #### lambda t: np.sin(2*np.pi*t/(time_period*24*3600))
+    uv_forcing_active = (uv_time_component is not None) and (FUo != 0 or FVo != 0)
+    f_vrt_forcing_spec = f_div_forcing_spec = np.zeros(vrtspec.shape, np.complex128)
+    f_vrt_forcing      = f_div_forcing      = np.zeros((nlats, nlons), np.float64)
+    
     for ncycle in tqdm(range(itmax)):
         
         t = ncycle*dt
@@ -383,10 +397,6 @@ def integrate_model(input_file2):
 #                                                  delta_xS = delta_xS, delta_yS = delta_yS, \
 #                                                  AN=AN, AS=AS)
         
-        phiT = phi_T_empirical( np.rad2deg(sp_harmonic.lons), np.rad2deg(sp_harmonic.lats), H0)
-        
-        phig_plus_phiT = phig + phiT
-        
         # compute tendencies.
         u_f_plus_vort = ug*(vrtg+f)
         v_f_plus_vort = vg*(vrtg+f)
@@ -410,7 +420,7 @@ def integrate_model(input_file2):
 #         ########################################
         
         dphidtspec[:, nnew]   = -div_uvphi_NL_spec
-        KE_plus_phi_spec      = +sp_harmonic.grdtospec(phig_plus_phiT+0.5*(ug**2+vg**2))
+        KE_plus_phi_spec      = +sp_harmonic.grdtospec(phig+0.5*(ug**2+vg**2)) + phi_T_basic.spec(H0)
         ddivdtspec[:, nnew]  += -sp_harmonic.lap*KE_plus_phi_spec
 
         #### Diffusion term ####
@@ -422,24 +432,25 @@ def integrate_model(input_file2):
 
 
         ##### EXTERNAL FORCING ######
-        time_component        = 0 #np.sin(2*np.pi*t/(time_period*24*3600))
-
         phi_forcing           = PHI_perturb_propagating(lons, lats, Q0, yp, xp, Lx, Ly, t, switch_on_day, \
                                                         c=forcing_phase_speed, wave_number=forcing_wave_number, \
                                                         DIPOLE = DIPOLE, switch_off_day=switch_off_day)[0]
         
 #       phi_forcing           = (PHI_perturb_from_file(external_data, time = 0, switch_on_day=None)[0])
-        fu_forcing            = (F_uv_perturb(lons, lats, FUo, yp, xp, Lx, Ly, t, switch_on_day)[0])*time_component 
-        fv_forcing            = (F_uv_perturb(lons, lats, FVo, yp, xp, Lx, Ly, t, switch_on_day)[0])*time_component 
-        
-        f_vrt_forcing_spec, f_div_forcing_spec    =   sp_harmonic.getvrtdivspec(fu_forcing, fv_forcing)
-        f_vrt_forcing    =   sp_harmonic.spectogrd(f_vrt_forcing_spec)
-        f_div_forcing    =   sp_harmonic.spectogrd(f_div_forcing_spec)
-
         phi_forcing_spec      = sp_harmonic.grdtospec(phi_forcing)/K_T
         dphidtspec[:, nnew]   += phi_forcing_spec
-        dvrtdtspec[:, nnew]   += f_vrt_forcing_spec
-        ddivdtspec[:, nnew]   += f_div_forcing_spec        
+        
+        if uv_forcing_active:
+            time_component        = uv_time_component(t)
+            fu_forcing            = (F_uv_perturb(lons, lats, FUo, yp, xp, Lx, Ly, t, switch_on_day)[0])*time_component 
+            fv_forcing            = (F_uv_perturb(lons, lats, FVo, yp, xp, Lx, Ly, t, switch_on_day)[0])*time_component 
+            
+            f_vrt_forcing_spec, f_div_forcing_spec    =   sp_harmonic.getvrtdivspec(fu_forcing, fv_forcing)
+            f_vrt_forcing    =   sp_harmonic.spectogrd(f_vrt_forcing_spec)
+            f_div_forcing    =   sp_harmonic.spectogrd(f_div_forcing_spec)
+            
+            dvrtdtspec[:, nnew]   += f_vrt_forcing_spec
+            ddivdtspec[:, nnew]   += f_div_forcing_spec        
         
         if int(t/(24*3600)) > 5 :           
             if t % (3*3600) == 0: ### Save every 6 hours
@@ -499,6 +510,7 @@ def integrate_model(input_file2):
             break
 
     
+    phiT = phi_T_basic.grid(H0)
     spatial_data  =  {'U': A(U),      'V': A(V),      'PHI': A(PHI),     'VRT': A(VRT),      'DIV': A(DIV),      \
                       'lats': sp_harmonic.lats, 'lons': sp_harmonic.lons, 'T_in_days':A(T),  \
                       'phi_T': phiT, 'phi_B': phi_B(Hmean), 'phi_forcing': A(PHI_forcing), \
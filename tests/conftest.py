@@ -0,0 +1,29 @@
+import os
+import sys
+
+#### the modules are imported flat, as the run scripts do
+MODULES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules')
+if MODULES not in sys.path:
+    sys.path.insert(0, MODULES)
+
+SPECTRA = ['vrtspec', 'divspec', 'phispec']
+
+
+def small_input_file(**changes):
+    """the May_16 run dictionary of swe_benchmark at T10 (nlons = 32), small enough for tests"""
+    import swe_benchmark as swe_benchmark
+    return dict(swe_benchmark.may16_input_file(32), **changes)
+
+
+def forced_stepper(input_file, H0_values=None, **kwargs):
+    """SWE_stepper with the input_file's Hmax and moving dipole (as the May_16 driver)"""
+    import swe_stepper as swe_stepper
+    import swe_benchmark as swe_benchmark
+    sp = swe_stepper.Spharmt(input_file['nlons'], input_file['nlats'], input_file['ntrunc'], input_file['rsphere'])
+    return swe_stepper.SWE_stepper(input_file, H0_values=H0_values if H0_values is not None else input_file['Hmax'], \
+                                   sp_harmonic=sp, spectral_phi_forcing=swe_benchmark.make_forcing(sp, input_file), **kwargs)
+
+
+def same_state(a, b):
+    """whether two steppers have bit for bit the same spectral state and clock"""
+    return all((getattr(a, key) == getattr(b, key)).all() for key in SPECTRA) and a.t == b.t
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('shtns')
+
+import cfl_control as cfl_control
+from conftest import SPECTRA, forced_stepper, same_state, small_input_file
+
+H0_VALUES = np.full(100000, 2500.)
+
+
+def controlled_stepper(**kwargs):
+    stepper = forced_stepper(small_input_file(dt=600), H0_VALUES)
+    stepper.dt_control = cfl_control.cfl_controller(stepper, **kwargs)
+    return stepper
+
+
+def test_dt_stays_on_the_save_times():
+    """dt only takes power of two multiples of the base dt that divide the sync interval"""
+    stepper = controlled_stepper(grow_after=20)
+    for _ in range(300):
+        stepper.step()
+        ratio = stepper.dt/stepper.base_dt
+        assert ratio == 2**np.round(np.log2(ratio))
+        assert stepper.dt_control.sync_interval % stepper.dt == 0
+    assert stepper.dt_control.changes
+    assert stepper.dt <= stepper.dt_control.max_dt
+
+
+def test_checkpoint_resume_after_dt_changes(tmp_path):
+    """a resume restores dt and the controller, and continues bit for bit"""
+    checkpoint = str(tmp_path/'checkpoint.h5')
+    whole      = controlled_stepper(grow_after=20)
+    whole.run(150)
+    assert whole.dt_control.changes
+    whole.save_checkpoint(checkpoint)
+    resumed    = controlled_stepper(grow_after=20)
+    resumed.load_checkpoint(checkpoint)
+    assert resumed.dt == whole.dt
+    whole.run(100)
+    resumed.run(100)
+    assert same_state(whole, resumed) and resumed.dt == whole.dt
+
+
+def test_runaway_aborts():
+    """a forcing too strong for even min_dt raises runaway_error instead of running on to NaNs"""
+    stepper = forced_stepper(small_input_file(dt=2400, Q0=20000), H0_VALUES)
+    stepper.dt_control = cfl_control.cfl_controller(stepper, sync_interval=3*3600*8)
+    with pytest.raises(cfl_control.runaway_error) as error:
+        with np.errstate(all='ignore'):
+            stepper.run(4000)
+    assert error.value.diagnostics
+    for key in SPECTRA:
+        assert np.isfinite(getattr(stepper, key)).all()
+
+
+def test_invalid_settings():
+    stepper = forced_stepper(small_input_file(dt=600), H0_VALUES)
+    with pytest.raises(ValueError):
+        cfl_control.cfl_controller(stepper, sync_interval=1000.)
+    with pytest.raises(ValueError):
+        cfl_control.cfl_controller(stepper, grow_at=0.3, shrink_at=0.5)
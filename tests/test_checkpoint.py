@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('shtns')
+
+import swe_stepper as swe_stepper
+from conftest import forced_stepper, same_state, small_input_file
+
+
+def test_restart_is_bit_identical(tmp_path):
+    """a run restarted from a checkpoint continues exactly as the uninterrupted run"""
+    input_file = small_input_file(semi_implicit=True)
+    H0_values  = np.linspace(0, 2500, 200)
+    checkpoint = str(tmp_path/'checkpoint.hdf5')
+
+    whole = forced_stepper(input_file, H0_values, budget_mean_every=3)
+    whole.run(60)
+
+    first = forced_stepper(input_file, H0_values, budget_mean_every=3)
+    first.enable_checkpoints(checkpoint, 20, extra=lambda: {'T': np.arange(3.)})
+    first.run(45)
+
+    restarted = forced_stepper(input_file, H0_values, budget_mean_every=3)
+    extra     = restarted.load_checkpoint(checkpoint)
+    assert restarted.ncycle == 40
+    np.testing.assert_array_equal(extra['T'], np.arange(3.))
+    restarted.run(60 - restarted.ncycle)
+
+    assert same_state(whole, restarted)
+    assert whole.budget_mean.count == restarted.budget_mean.count
+    for key in swe_stepper.BUDGET_TERMS:
+        np.testing.assert_array_equal(whole.budget_mean.mean[key], restarted.budget_mean.mean[key])
+
+
+def test_wrong_resolution(tmp_path):
+    checkpoint = str(tmp_path/'checkpoint.hdf5')
+    forced_stepper(small_input_file()).save_checkpoint(checkpoint)
+    with pytest.raises(ValueError):
+        forced_stepper(small_input_file(nlons=64, nlats=32, ntrunc=21)).load_checkpoint(checkpoint)
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('shtns')
+pytest.importorskip('scipy')
+
+import swe_stepper as swe_stepper
+import forcing_engine as forcing_engine
+import comoving_steady as comoving_steady
+from conftest import SPECTRA, small_input_file
+
+
+def test_steady_state_moves_with_the_forcing():
+    """started from the solution, a run only rotates it with the forcing"""
+    stepper = swe_stepper.SWE_stepper(small_input_file(), H0_values=np.full(100000, 500.))
+    stepper.spectral_phi_forcing = forcing_engine.propagating_heating(stepper.sp_harmonic, Q0=10, c=5, alpha=0.5)
+    solver  = comoving_steady.comoving_steady_solver(stepper, t=200*86400.)
+    state   = solver.solve()
+    assert stepper.t == 200*86400.
+
+    nsteps   = 20
+    stepper.run(nsteps)
+    rotation = np.exp(-1j*solver.angular_speed*stepper.sp_harmonic.m*nsteps*stepper.dt)
+    for key in SPECTRA:
+        assert np.abs(getattr(stepper, key) - state[key]*rotation).max() < 1e-6*np.abs(state[key]).max()
@@ -0,0 +1,51 @@
+import os
+
+import numpy as np
+import pytest
+
+from diagnostic_plots import forcing_and_U_figures, plot_worker, scalar_series
+
+
+def test_scalar_series_grows_and_keeps_old_views():
+    series = scalar_series(['T', 'U_max'], capacity=4)
+    for day in range(10):
+        series.append(T=day, U_max=2*day)
+        if day == 2:
+            early = series.arrays()
+    arrays = series.arrays()
+    np.testing.assert_array_equal(arrays['T'], np.arange(10))
+    np.testing.assert_array_equal(arrays['U_max'], 2*np.arange(10))
+    np.testing.assert_array_equal(early['T'], [0, 1, 2])
+
+    resumed = scalar_series(['T', 'U_max'], capacity=4, initial=arrays)
+    resumed.append(T=10, U_max=20)
+    np.testing.assert_array_equal(resumed.arrays()['T'], np.arange(11))
+
+
+def test_plot_worker_runs_jobs_in_order_and_keeps_errors():
+    done = []
+
+    def fail():
+        raise RuntimeError('bad job')
+
+    worker = plot_worker(max_queued=2)
+    worker.submit(done.append, 1)
+    worker.submit(fail)
+    for k in range(2, 6):
+        worker.submit(done.append, k)
+    errors = worker.close()
+    assert done == [1, 2, 3, 4, 5]
+    assert len(errors) == 1 and str(errors[0]) == 'bad job'
+
+
+def test_forcing_and_U_figures(tmp_path):
+    pytest.importorskip('matplotlib')
+    series = scalar_series(['T', 'FORCING_max', 'U_max', 'EDDY_DIV_max'])
+    for day in range(5):
+        series.append(T=day, FORCING_max=day, U_max=day**2, EDDY_DIV_max=1)
+    series.append(T=5)
+    direc  = str(tmp_path/'figures')
+    worker = plot_worker()
+    worker.submit(forcing_and_U_figures, direc, 'test', dpi=20, **series.arrays())
+    assert worker.close() == []
+    assert sorted(os.listdir(direc)) == ['div_U.png', 'forcing.png']
@@ -0,0 +1,50 @@
+import numpy as np
+
+import save_and_load_hdf5_files as h5saveload
+
+
+def test_append_write_and_load(tmp_path):
+    filename = str(tmp_path/'history.hdf5')
+    with h5saveload.history_writer(filename, chunk_steps=3) as history:
+        history.write({'lats': np.arange(4.), 'grid': {'nlons': 8}})
+        for i in range(7):
+            history.append({'U': np.full((4, 8), i), 'T_in_days': i/8.})
+        assert history.nrows == 7
+    data = h5saveload.load_dict_from_hdf5(filename)
+    np.testing.assert_array_equal(data['U'], np.arange(7.)[:, None, None]*np.ones((7, 4, 8)))
+    np.testing.assert_array_equal(data['T_in_days'], np.arange(7)/8.)
+    assert data['grid']['nlons'] == 8
+
+
+def test_truncate_after_restart(tmp_path):
+    """rows written after the last checkpoint are dropped on reopening, also half written steps"""
+    filename = str(tmp_path/'history.hdf5')
+    history  = h5saveload.history_writer(filename)
+    for i in range(5):
+        history.append({'U': np.full((2, 2), i), 'T_in_days': i})
+    history.flush()
+    nrows = history.nrows
+    history.append({'U': np.full((2, 2), 5)})          #### killed before T_in_days of step 5
+    history.close()
+
+    history = h5saveload.history_writer(filename, mode='a')
+    assert history.nrows == nrows
+    history.truncate(3)
+    history.append({'U': np.full((2, 2), 30), 'T_in_days': 30})
+    history.close()
+    data = h5saveload.load_dict_from_hdf5(filename)
+    np.testing.assert_array_equal(data['T_in_days'], [0, 1, 2, 30])
+    np.testing.assert_array_equal(data['U'][:, 0, 0], [0, 1, 2, 30])
+
+
+def test_readable(tmp_path):
+    filename = str(tmp_path/'history.hdf5')
+    with h5saveload.history_writer(filename) as history:
+        history.append({'U': np.zeros((2, 2))})
+    assert h5saveload.readable(filename)
+    assert not h5saveload.readable(str(tmp_path/'missing.hdf5'))
+
+    broken = str(tmp_path/'broken.hdf5')
+    with open(filename, 'rb') as f, open(broken, 'wb') as g:
+        g.write(f.read()[:200])
+    assert not h5saveload.readable(broken)
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('shtns')
+pytest.importorskip('scipy')
+
+import swe_stepper as swe_stepper
+import forcing_engine as forcing_engine
+import linear_steady as linear_steady
+from conftest import SPECTRA, small_input_file
+
+
+def test_linearization_and_blocks():
+    """the per-m blocks apply the linearized tendencies, which are the derivative of the tendencies"""
+    stepper = swe_stepper.SWE_stepper(small_input_file())
+    solver  = linear_steady.linear_steady_solver(stepper, H0=500.)
+    basic   = np.array([solver.basic_state[key] for key in SPECTRA])
+
+    residual = solver.zonal_mean(solver.tendencies(*basic, H0=500.))
+    assert max(np.abs(x).max() for x in residual) < 1e-8*np.abs(basic[0]).max()/stepper.dt
+
+    sp = stepper.sp_harmonic
+    x  = np.random.RandomState(1).standard_normal((3, sp.nlm))*np.array([[1e-6], [1e-7], [10.]]) + 0j
+    x[:, sp.m == 0] = x[:, sp.m == 0].real
+    eps    = 1e-3
+    finite = (solver.tendencies(*(basic + eps*x), H0=500.) - solver.tendencies(*(basic - eps*x), H0=500.))/(2*eps)
+    linear = solver.linear_tendencies(*x)
+    for k in range(3):
+        assert np.abs(finite[k] - linear[k]).max() < 1e-7*np.abs(linear[k]).max()
+
+    blocks = solver.blocks()
+    y      = np.zeros_like(linear)
+    for m, index in enumerate(solver.m_index):
+        y[:, index] = (blocks[m] @ x[:, index].ravel()).reshape(3, -1)
+    for k in range(3):
+        assert np.abs(y[k] - linear[k]).max() < 1e-10*np.abs(linear[k]).max()
+
+
+def test_linear_response_is_steady():
+    """the response to a standing heating makes the linearized tendencies vanish"""
+    stepper  = swe_stepper.SWE_stepper(small_input_file())
+    solver   = linear_steady.linear_steady_solver(stepper, H0=500.)
+    forcing  = forcing_engine.propagating_heating(stepper.sp_harmonic, Q0=0.01, c=0, alpha=1e-9)
+    F        = forcing(1.)*stepper.inv_K_T
+    response = solver.solve(phi_forcing_spec=F)
+    linear   = solver.linear_tendencies(*[response[key] for key in SPECTRA])
+    for k, key in enumerate(SPECTRA[:2]):
+        assert np.abs(linear[k]).max() < 1e-10*np.abs(response[key]).max()/stepper.dt
+    assert np.abs(linear[2] + F).max() < 1e-10*np.abs(F).max()
@@ -0,0 +1,87 @@
+import ast
+import os
+
+import numpy as np
+import pytest
+
+import matsuno_bank as matsuno_bank
+from conftest import MODULES
+
+
+def legacy_namespace():
+    """
+    solve_dispersion, Dn, vector, MODE_N and the import time params of
+    calc_matsuno_modes, taken from its source: importing it needs cartopy,
+    hickle and a data file under /data
+    """
+    scipy_optimize = pytest.importorskip('scipy.optimize')
+    matplotlib     = pytest.importorskip('matplotlib')
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as py
+
+    with open(os.path.join(MODULES, 'calc_matsuno_modes.py')) as f:
+        tree = ast.parse(f.read())
+    names = ['solve_dispersion', 'Dn', 'vector', 'MODE_N']
+    nodes = [node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name in names]
+    start = [i for i, node in enumerate(tree.body) if isinstance(node, ast.Assign) and ast.unparse(node.targets[0]) == 'Hmean'][0]
+    stop  = [i for i, node in enumerate(tree.body) if isinstance(node, ast.Assign) and ast.unparse(node.targets[0]) == 'source'][0]
+    nodes = nodes + tree.body[start:stop]
+
+    namespace = {'np': np, 'py': py, 'fsolve': scipy_optimize.fsolve}
+    exec(compile(ast.Module(body=nodes, type_ignores=[]), 'calc_matsuno_modes.py', 'exec'), namespace)
+    return namespace
+
+
+@pytest.mark.parametrize('Hmean', [200, 500])
+def test_bank_matches_MODE_N(Hmean):
+    """legacy_params: the modes the June27 scripts made with MODE_N after setting params['c']"""
+    legacy = legacy_namespace()
+    grav   = 9.80616
+    lats, lons = matsuno_bank.gaussian_lats_lons(64, 32)
+
+    params          = dict(legacy['params'])
+    params['Hmean'] = Hmean
+    params['c']     = np.sqrt(grav*Hmean)
+    grids           = dict(x = lons*params['R'], y = lats*params['R'])
+    old             = legacy['MODE_N'](t = 3600., params=params, grids=grids)
+    legacy['py'].close('all')
+
+    bank = matsuno_bank.matsuno_bank(Hmean, lats, grav=grav)
+    new  = bank.mode_dict(lons, t=3600.)
+    assert bank.yT == params['yT']
+
+    def leaves(old, new):
+        if 'un' in old:
+            yield old, new
+        else:
+            for key in old:
+                yield from leaves(old[key], new[key])
+
+    count = 0
+    for mode_old, mode_new in leaves(old, new):
+        count += 1
+        np.testing.assert_allclose(mode_new['wd'], np.squeeze(mode_old['wd']), rtol=1e-9, atol=1e-12)
+        for key in ['un', 'vn', 'phin', 'div']:
+            scale = np.max(np.abs(np.real(mode_old[key]))) + 1e-300
+            np.testing.assert_allclose(mode_new[key]/scale, np.real(mode_old[key])/scale, atol=1e-9)
+    assert count == len(bank.kn)
+
+
+def test_bank_physical_params():
+    """without legacy_params yT = sqrt(c/beta) of the given Hmean, omega and rsphere"""
+    lats, _ = matsuno_bank.gaussian_lats_lons(64, 32)
+    bank    = matsuno_bank.matsuno_bank(200, lats, grav=9.81, omega=7e-5, rsphere=6.4e6, legacy_params=False)
+    beta    = 2*7e-5/6.4e6
+    assert np.isclose(bank.yT, np.sqrt(np.sqrt(9.81*200)/beta))
+    assert matsuno_bank.matsuno_bank(200, lats, legacy_params=False, yT=1e6).yT == 1e6
+
+
+def test_load_bank_cache(tmp_path):
+    lats, _ = matsuno_bank.gaussian_lats_lons(64, 32)
+    built   = matsuno_bank.load_bank(200, lats, cache_dir=str(tmp_path))
+    loaded  = matsuno_bank.load_bank(200, lats, cache_dir=str(tmp_path))
+    other   = matsuno_bank.load_bank(200, lats, cache_dir=str(tmp_path), legacy_params=False)
+    assert len(os.listdir(str(tmp_path))) == 2
+    for key in ['wd', 'u', 'v', 'phi', 'div']:
+        np.testing.assert_array_equal(getattr(built, key), getattr(loaded, key))
+    assert other.yT != built.yT
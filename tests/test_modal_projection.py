@@ -0,0 +1,84 @@
+import h5py
+import numpy as np
+import pytest
+
+pytest.importorskip('scipy')
+
+import matsuno_bank as matsuno_bank
+import modal_projection as modal_projection
+
+MODES = [('Kelvin', -1, 1, 0.5), ('Rossby', 1, -1, 0.1+0.2j), ('MRG', 0, 3, 0.3), ('WIG', 2, -4, 0.05), \
+         ('EIG', 1, 2, 0.2j), ('Kelvin', -1, 2, 0.1)]
+
+
+@pytest.fixture(scope='module')
+def bank_and_lons():
+    lats, lons = matsuno_bank.gaussian_lats_lons(64, 32)
+    return matsuno_bank.matsuno_bank(25., lats, k_max=5), lons
+
+
+def combination_series(bank, lons, times):
+    fields = [bank.combination(MODES, lons, t) for t in times]
+    return [np.array([x[key] for x in fields]) for key in ('un', 'vn', 'phin')]
+
+
+def check_amplitudes(bank, result, times):
+    for family, n, kn, a in MODES:
+        i = bank.index(family, kn, n)
+        np.testing.assert_allclose(result['amplitudes'][:, i], a*np.exp(-1j*bank.w[i]*times), atol=1e-8)
+    others = np.ones(bank.kn.size, bool)
+    others[[bank.index(family, kn, n) for family, n, kn, _ in MODES]] = False
+    assert np.nanmax(np.abs(result['amplitudes'][:, others])) < 1e-8
+    assert result['residual'].max() < 1e-10
+
+
+def test_pure_combination_of_modes(bank_and_lons):
+    """the amplitudes of a combination of modes come back, with no residual"""
+    bank, lons = bank_and_lons
+    projection = modal_projection.modal_projection(bank, lons)
+    times      = np.arange(8)*3*3600.
+    result     = projection.project(*combination_series(bank, lons, times))
+    check_amplitudes(bank, result, times)
+
+    energy = projection.family_energy(result['amplitudes'])
+    assert sorted(energy) == sorted(matsuno_bank.FAMILIES)
+    assert all(np.allclose(energy[family], energy[family][0]) for family in energy)
+
+    single = projection.project(*[x[0] for x in combination_series(bank, lons, times[:1])])
+    np.testing.assert_allclose(single['amplitudes'], result['amplitudes'][0], atol=1e-12)
+
+    noise = np.random.RandomState(0).standard_normal((2, 32, 64))
+    assert projection.project(noise, 0*noise, 0*noise)['residual'].min() > 0.5
+
+
+def test_zonal_mean_eig(bank_and_lons):
+    bank, lons = bank_and_lons
+    projection = modal_projection.modal_projection(bank, lons, wavenumbers=[0, 1, 2])
+    x          = bank.combination([('EIG', 1, 0, 0.3+0.1j), ('EIG', 3, 0, 0.2)], lons, 0.)
+    result     = projection.project(x['un'], x['vn'], x['phin'])
+    np.testing.assert_allclose(result['amplitudes'][bank.index('EIG', 0, 1)], 0.3+0.1j, atol=1e-8)
+    np.testing.assert_allclose(result['amplitudes'][bank.index('EIG', 0, 3)], 0.2, atol=1e-8)
+
+
+def test_invalid_wavenumbers(bank_and_lons):
+    bank, lons = bank_and_lons
+    with pytest.raises(ValueError):
+        modal_projection.modal_projection(bank, lons, wavenumbers=[40])
+    with pytest.raises(ValueError):
+        modal_projection.modal_projection(bank, lons**1.01)
+
+
+def test_project_history(bank_and_lons, tmp_path):
+    """a history file is projected block by block, as one project() of all of it"""
+    pytest.importorskip('shtns')
+    bank, lons = bank_and_lons
+    times      = np.arange(10)*3*3600.
+    U, V, PHI  = combination_series(bank, lons, times)
+    filename   = str(tmp_path/'spatial_data.hdf5')
+    with h5py.File(filename, 'w') as h5file:
+        for key, value in [('U', U), ('V', V), ('PHI', PHI), ('T_in_days', times/86400.)]:
+            h5file[key] = value
+    projection = modal_projection.modal_projection(bank, lons)
+    result     = modal_projection.project_history(filename, projection, block=4)
+    check_amplitudes(bank, result, times)
+    np.testing.assert_array_equal(result['T_in_days'], times/86400.)
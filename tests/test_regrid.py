@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('shtns')
+
+import swe_stepper as swe_stepper
+from conftest import SPECTRA, forced_stepper, same_state, small_input_file
+
+
+def test_zero_pad_round_trip():
+    """T10 -> T21 zero pads by (l, m), T21 -> T10 gives the same coefficients back"""
+    sp_low  = swe_stepper.Spharmt(32, 16, 10, 6.37122e6)
+    sp_high = swe_stepper.Spharmt(64, 32, 21, 6.37122e6)
+    spec    = np.random.RandomState(0).standard_normal((2, sp_low.nlm)) + 0j
+    up      = swe_stepper.regrid_spectrum(spec, sp_low, sp_high)
+    index   = swe_stepper.spectral_index_map(sp_low, sp_high)
+    np.testing.assert_array_equal(sp_high.degree[index], sp_low.degree)
+    np.testing.assert_array_equal(sp_high.m[index], sp_low.m)
+    assert np.count_nonzero(up) == spec.size
+    np.testing.assert_array_equal(swe_stepper.regrid_spectrum(up, sp_high, sp_low), spec)
+
+    #### the grid field of a zero padded spectrum is the same function on the finer grid
+    grid_low = sp_low.spectogrd(spec[0])
+    back     = sp_low.grdtospec(grid_low)
+    np.testing.assert_allclose(sp_high.grdtospec(sp_high.spectogrd(up[0])), swe_stepper.regrid_spectrum(back, sp_low, sp_high), \
+                               atol=1e-12*np.abs(spec).max())
+    with pytest.raises(ValueError):
+        swe_stepper.spectral_index_map(sp_high, sp_low)
+
+
+def test_take_state_from_continues_the_run():
+    """handing over at the same truncation continues bit for bit, the AB3 history included"""
+    input_file = small_input_file()
+    H0_values  = np.linspace(0, 2500, 100)
+    whole      = forced_stepper(input_file, H0_values)
+    whole.run(30)
+    first      = forced_stepper(input_file, H0_values)
+    first.run(12)
+    second     = forced_stepper(input_file, H0_values)
+    second.take_state_from(first)
+    second.run(18)
+    assert same_state(whole, second)
+
+
+def test_spin_up_at_low_resolution():
+    """a T10 spin-up continued at T21 stays close to a T21 run from the start"""
+    high       = small_input_file(nlons=64, nlats=32, ntrunc=21)
+    H0_values  = np.linspace(0, 2500, 100)
+    full       = forced_stepper(high, H0_values)
+    full.run(40)
+    spin_up    = forced_stepper(small_input_file(), H0_values)
+    spin_up.run(20)
+    continued  = forced_stepper(high, H0_values)
+    continued.take_state_from(spin_up)
+    continued.run(20)
+    for key in SPECTRA:
+        reference = getattr(full, key)
+        assert np.abs(getattr(continued, key) - reference).max() < 0.05*np.abs(reference).max()
+
+
+def test_take_state_from_needs_the_same_dt():
+    spin_up = forced_stepper(small_input_file())
+    spin_up.run(3)
+    spin_up.set_dt(spin_up.dt/2)
+    with pytest.raises(ValueError, match='same dt'):
+        forced_stepper(small_input_file()).take_state_from(spin_up)
+    with pytest.raises(ValueError, match='same dt'):
+        forced_stepper(small_input_file(dt=600)).take_state_from(forced_stepper(small_input_file()))
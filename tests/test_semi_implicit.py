@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('shtns')
+
+from conftest import forced_stepper, small_input_file
+
+
+def run(dt, days=2, **changes):
+    stepper = forced_stepper(small_input_file(dt=dt, **changes), H0_values=1000.)
+    stepper.run(int(days*86400/dt))
+    return stepper
+
+
+def error(stepper, reference):
+    return np.abs(stepper.vrtspec - reference.vrtspec).max()/np.abs(reference.vrtspec).max()
+
+
+def test_semi_implicit_matches_explicit():
+    """AB3-CN converges to the explicit AB3 solution, at second order in dt"""
+    reference = run(75)
+    coarse    = error(run(1200, semi_implicit=True), reference)
+    fine      = error(run(600, semi_implicit=True), reference)
+    assert fine < 1e-2
+    assert coarse/fine > 3
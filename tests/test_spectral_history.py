@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('shtns')
+
+import save_and_load_hdf5_files as h5saveload
+import spectral_history as spectral_history
+from conftest import forced_stepper, small_input_file
+
+
+def write_histories(tmp_path, nsteps=12):
+    """the same run saved as a grid history and as a spectral-only history, like the May_16 driver"""
+    input_file = small_input_file()
+    stepper    = forced_stepper(input_file, np.linspace(0, 2500, 100))
+    sp         = stepper.sp_harmonic
+    grid_file, spec_file = str(tmp_path/'grid.hdf5'), str(tmp_path/'spectral.hdf5')
+    grid, spec = h5saveload.history_writer(grid_file), h5saveload.history_writer(spec_file)
+    spec.write({'lats': sp.lats, 'lons': sp.lons, 'phi_T_unit': stepper.phi_T_unit, \
+                'grid': {'nlons': sp.nlons, 'nlats': sp.nlats, 'ntrunc': sp.ntrunc, 'rsphere': sp.rsphere, \
+                         'K_T': input_file['K_T']}})
+    for _ in range(nsteps):
+        t  = stepper.t
+        H0 = stepper.current_H0(stepper.step_index)
+        spec.append(dict(spectral_history.spectral_fields(stepper), T_in_days=t/86400, H0=H0))
+        stepper.step()
+        spec.append(spectral_history.spectral_forcing_fields(stepper))
+        grid.append({'U': stepper.ug, 'V': stepper.vg, 'PHI': stepper.phig, 'vrt': stepper.vrtg, 'div': stepper.divg, \
+                     'phi_forcing': stepper.phi_forcing, 'phi_T': H0*stepper.phi_T_unit, 'T_in_days': t/86400})
+    grid.close()
+    spec.close()
+    return grid_file, spec_file
+
+
+def test_spectral_rows_match_grid_history(tmp_path):
+    grid_file, spec_file = write_histories(tmp_path)
+    grid = h5saveload.load_dict_from_hdf5(grid_file)
+    with spectral_history.spectral_history(spec_file) as data:
+        np.testing.assert_array_equal(data['T_in_days'], grid['T_in_days'])
+        for key in ['U', 'V', 'PHI', 'vrt', 'div', 'phi_forcing', 'phi_T']:
+            scale = np.abs(grid[key]).max() + 1e-300
+            np.testing.assert_allclose(data[key][:]/scale, grid[key]/scale, rtol=0, atol=1e-12, err_msg=key)
+
+
+def test_rows_with_repeated_and_negative_indices(tmp_path):
+    grid_file, spec_file = write_histories(tmp_path, nsteps=6)
+    grid = h5saveload.load_dict_from_hdf5(grid_file)
+    with spectral_history.spectral_history(spec_file) as data:
+        index = [3, 1, 3, -1]
+        np.testing.assert_allclose(data.read('U', index), grid['U'][index], rtol=0, atol=1e-12*np.abs(grid['U']).max())
+        np.testing.assert_array_equal(data.read('T_in_days', index), grid['T_in_days'][index])
+        np.testing.assert_allclose(data.read('PHI', 2), grid['PHI'][2], rtol=0, atol=1e-12*np.abs(grid['PHI']).max())
+        with pytest.raises(IndexError):
+            data.read('U', [0, 6])
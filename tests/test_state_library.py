@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('shtns')
+
+import state_library as state_library
+from conftest import forced_stepper, same_state, small_input_file
+
+NAME      = 'basic state spun up for Hmean=500, H0=5000'
+H0_VALUES = np.full(10000, 100.)
+
+
+def test_fork_continues_the_run(tmp_path):
+    """a branch forked from the library continues bit for bit as the run it was saved from"""
+    library = state_library.state_library(str(tmp_path/'library'))
+    history = str(tmp_path/'history.h5')
+    with open(history, 'w') as f:
+        f.write('history')
+
+    whole = forced_stepper(small_input_file(), H0_VALUES)
+    whole.run(50)
+    library.save(NAME, whole, extra={'nrows': 7}, attach={'history': history})
+    assert library.has(NAME) and library.names() == [NAME]
+    assert library.info(NAME)['day'] == whole.t/86400.
+
+    branch = forced_stepper(small_input_file(), H0_VALUES)
+    assert library.fork(NAME, branch) == {'nrows': 7}
+    whole.run(30)
+    branch.run(30)
+    assert same_state(whole, branch)
+
+    copied = library.attachment(NAME, 'history', copy_to=str(tmp_path/'copy.h5'))
+    with open(copied) as f:
+        assert f.read() == 'history'
+    with pytest.raises(ValueError):
+        library.attachment(NAME, 'spectra')
+
+    library.remove(NAME)
+    assert not library.has(NAME) and library.names() == []
+
+
+def test_fork_checks_the_model(tmp_path):
+    library = state_library.state_library(str(tmp_path))
+    stepper = forced_stepper(small_input_file(), H0_VALUES)
+    stepper.run(5)
+    library.save(NAME, stepper)
+    input_file = small_input_file()
+    with pytest.raises(ValueError, match='was run with'):
+        library.fork(NAME, forced_stepper(dict(input_file, K_T=2*input_file['K_T']), H0_VALUES))
+    with pytest.raises(ValueError):
+        library.info('no such branch')
+
+    perturbed = forced_stepper(small_input_file(), H0_VALUES)
+    with pytest.raises(ValueError, match='perturbation'):
+        library.fork(NAME, perturbed, perturbation={'ug': 1.})
+    library.fork(NAME, perturbed, perturbation={'vrtspec': 1e-6*np.ones_like(perturbed.vrtspec)}, restart_clock=True)
+    assert perturbed.t == 0
+    assert np.abs(perturbed.vrtspec - stepper.vrtspec).max() > 0
+    perturbed.run(3)
+    assert np.isfinite(perturbed.vrtspec).all()
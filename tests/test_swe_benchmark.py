@@ -0,0 +1,35 @@
+import json
+
+import pytest
+
+pytest.importorskip('shtns')
+
+import swe_benchmark as swe_benchmark
+
+
+def test_may16_input_file():
+    """the run dictionary of the May_16 driver, with the history stored as it writes it"""
+    input_file = swe_benchmark.may16_input_file(64)
+    assert input_file['storage_profile'] == 'exact'
+    assert (input_file['nlons'], input_file['nlats'], input_file['ntrunc']) == (64, 32, 21)
+
+
+def test_run_benchmarks_appends_a_record(tmp_path, capsys):
+    benchmark_file = str(tmp_path/'benchmarks.jsonl')
+    for _ in range(2):
+        swe_benchmark.run_benchmarks(resolutions=[32], max_threads=1, repeats=2, end_to_end_steps=10, \
+                                     benchmark_file=benchmark_file, ensemble_members=2)
+    with open(benchmark_file) as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 2
+    for record in records:
+        assert len(record['results']) == 1
+        result = record['results'][0]
+        assert result['nlons'] == 32 and result['nthreads'] == 1
+        assert sorted(result['seconds']) == sorted(swe_benchmark.PHASES)
+        assert all(seconds > 0 for seconds in result['seconds'].values())
+        assert result['end_to_end']['steps'] == 10
+        assert result['ensemble']['nmembers'] == 2 and result['ensemble']['speedup'] > 0
+
+    swe_benchmark.print_record(records[-1])
+    assert 'end_to_end' in capsys.readouterr().out
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('shtns')
+
+import swe_stepper as swe_stepper
+import swe_ensemble as swe_ensemble
+import swe_benchmark as swe_benchmark
+from conftest import SPECTRA, small_input_file
+
+
+def test_members_match_single_runs():
+    """every member of an ensemble is the run it would be on its own"""
+    input_files = [small_input_file(Hmean=200, Q0=10, forcing_phase_speed=5, Hmax=2500), \
+                   small_input_file(Hmean=500, Q0=50, forcing_phase_speed=0, Hmax=5000)]
+    H0_values   = [np.linspace(0, inp['Hmax'], 100) for inp in input_files]
+    sp          = swe_stepper.Spharmt(32, 16, 10, input_files[0]['rsphere'])
+
+    ensemble = swe_ensemble.SWE_ensemble(input_files, H0_values=H0_values, sp_harmonic=sp, budget_mean_every=5, \
+                                         spectral_phi_forcings=[swe_benchmark.make_forcing(sp, inp) for inp in input_files])
+    ensemble.run(40)
+    for i, inp in enumerate(input_files):
+        single = swe_stepper.SWE_stepper(inp, H0_values=H0_values[i], sp_harmonic=sp, budget_mean_every=5, \
+                                         spectral_phi_forcing=swe_benchmark.make_forcing(sp, inp))
+        single.run(40)
+        member = ensemble.member(i)
+        for key in SPECTRA:
+            np.testing.assert_allclose(member[key], getattr(single, key), rtol=0, atol=1e-12*np.abs(getattr(single, key)).max())
+        for key in swe_stepper.BUDGET_TERMS:
+            np.testing.assert_allclose(ensemble.budget_mean.mean[key][i], single.budget_mean.mean[key], \
+                                       rtol=0, atol=1e-12*np.abs(single.budget_mean.mean[key]).max())
+
+
+def test_shared_keys():
+    with pytest.raises(ValueError, match='dt'):
+        swe_ensemble.SWE_ensemble([small_input_file(), small_input_file(dt=600)])
@@ -0,0 +1,53 @@
+import os
+import time
+
+import sweep_runner as sweep_runner
+
+
+def job(job):
+    """module level, so the pool can pickle it"""
+    if job.get('sleep'):
+        time.sleep(job['sleep'])
+    if job.get('die'):
+        os._exit(9)
+    if job.get('fail'):
+        raise RuntimeError('failed on purpose')
+    return job.get('abort', False)
+
+
+def names(state, status):
+    return sorted(name for name, entry in state.items() if entry['status'] == status)
+
+
+def test_expand_grid():
+    combos = sweep_runner.expand_grid({'Q0': [10, 50], ('Hmean', 'Hmax'): [(200, 2500), (500, 5000)]})
+    assert len(combos) == 4
+    assert {'Q0': 50, 'Hmean': 500, 'Hmax': 5000} in combos
+
+
+def test_statuses_and_resume(tmp_path):
+    state_file = str(tmp_path/'state.json')
+    jobs       = [{'i': 0}, {'i': 1, 'abort': 'True'}, {'i': 2, 'fail': True}, {'i': 3}]
+    job_name   = lambda job: 'job%d'%(job['i'])
+    state = sweep_runner.run_sweep(jobs, job, state_file=state_file, job_name=job_name, n_workers=2, \
+                                   is_done=lambda job: job['i'] == 3)
+    assert names(state, sweep_runner.DONE) == ['job0', 'job3']
+    assert names(state, sweep_runner.ABORTED) == ['job1']
+    assert names(state, sweep_runner.FAILED) == ['job2']
+    assert 'failed on purpose' in state['job2']['error']
+
+    #### a rerun only runs the failed job again
+    jobs[2] = {'i': 2}
+    state   = sweep_runner.run_sweep(jobs, job, state_file=state_file, job_name=job_name, n_workers=2)
+    assert names(state, sweep_runner.DONE) == ['job0', 'job2', 'job3']
+    assert sweep_runner.load_state(state_file) == state
+
+
+def test_dead_worker(tmp_path):
+    """a worker that dies fails the jobs running with it and the sweep goes on in a new pool"""
+    jobs  = [{'i': 0, 'sleep': 0.5, 'die': True}, {'i': 1, 'sleep': 1.}, {'i': 2}, {'i': 3}]
+    state = sweep_runner.run_sweep(jobs, job, state_file=str(tmp_path/'state.json'), n_workers=2, \
+                                   job_name=lambda job: 'job%d'%(job['i']), cost=lambda job: -job['i'])
+    assert 'job0' in names(state, sweep_runner.FAILED)
+    assert names(state, sweep_runner.RUNNING) == [] and names(state, sweep_runner.PENDING) == []
+    assert {'job2', 'job3'} <= set(names(state, sweep_runner.DONE))